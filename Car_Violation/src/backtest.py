@@ -0,0 +1,217 @@
+"""
+滾動原點回測 (walk-forward) - 測試窗口以週或月為單位往後滑動，每一折只用測試窗口之前的資料訓練
+特徵由 feature_store 讀取一次 (memory-map)，各折以多個行程平行訓練；每折的模型依 (特徵、參數、訓練範圍) 快取，
+重跑時只訓練新增或改變的折
+incremental=True 時每折從上一折的模型接續訓練少量輪數 (warm start)，依序執行
+
+區域輪廓特徵 (zone_baseline_risk、zone_weekday_hour_rate、hist_slot_count 等) 在快取中以全部歷史統計，
+會包含測試窗口的取締；每折改以原點之前的紀錄重新統計 (ZoneProfile，bincount)，避免測試期的資訊洩漏到特徵
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from feature_store import FeatureStore, GROUPS, default_inputs, load_features, load_violations
+from grid import SlotZoneGrid
+from scoring import FEATURES
+from tuning import BASE_PARAMS, feature_matrix, ranking_metrics, split_cores
+from zone_profile import ZoneProfile
+
+STEPS = {'week': 'W-MON', 'month': 'MS'}
+
+
+# ==========================================
+# 1. 切分
+# ==========================================
+def make_folds(slots, step='month', min_train_days=180, train_days=None, purge=0):
+    """
+    回傳每一折的 {'origin', 'train': (起, 訖), 'test': (起, 訖)} (皆為時段位置)
+    測試窗口 = [原點, 下一個原點)；訓練 = 原點之前全部 (train_days 指定時只取最近 train_days 天)
+    purge: 訓練期最後去掉的時段數 (預測標籤看未來 WINDOW_SIZE 個時段，避免標籤包含測試期的取締)
+    """
+    days = slots.normalize()
+    first_day = days[0] + pd.Timedelta(days=min_train_days)
+    origins = pd.date_range(first_day, days[-1], freq=STEPS[step])
+    bounds = list(origins) + [days[-1] + pd.Timedelta(days=1)]
+    folds = []
+    for origin, end in zip(bounds[:-1], bounds[1:]):
+        test = (int(days.searchsorted(origin)), int(days.searchsorted(end)))
+        if test[0] == test[1]:
+            continue
+        train_start = 0 if train_days is None else int(days.searchsorted(origin - pd.Timedelta(days=train_days)))
+        folds.append({'origin': origin, 'train': (train_start, max(train_start, test[0] - purge)), 'test': test})
+    return folds
+
+
+# ==========================================
+# 2. 工作行程
+# ==========================================
+_WORKER = {}
+
+
+def _init_worker(cache_dir, inputs, freq, window_size, nthread):
+    # 主行程已寫好快取；工作行程不刪除快取 (keep=None)
+    store = FeatureStore(cache_dir, inputs, freq=freq, keep=None)
+    grid, features = load_features(store, window_size)
+    df_raw = load_violations(inputs['violations'], inputs['rules'])
+    _WORKER.update(grid=grid, features=features, labels=np.asarray(features['label']),
+                   violations=df_raw[['Datetime', 'Zone_ID']], slots=grid.slots, zones=grid.zones, nthread=nthread)
+
+
+def _fold_profile(origin):
+    """只以原點之前的取締紀錄統計的區域輪廓"""
+    df_raw = _WORKER['violations']
+    return ZoneProfile(df_raw[df_raw['Datetime'] < origin], _WORKER['zones'])
+
+
+def _fold_matrix(span, profile):
+    """時段範圍 span 的特徵矩陣，區域輪廓特徵 (與其交互特徵) 改用該折的 profile"""
+    grid = _WORKER['grid']
+    sub = SlotZoneGrid(grid.slots[span[0]:span[1]], grid.zones, grid.counts[span[0]:span[1]])
+    features = {name: values[span[0]:span[1]] for name, values in _WORKER['features'].items()}
+    features.update(profile.grid_features(sub.slots))
+    return feature_matrix(sub, features)
+
+
+def _train_fold(job):
+    """
+    job: {'fold', 'params', 'rounds', 'model_path', 'parent' (接續訓練的模型路徑或 None)}
+    已有快取模型時直接載入，回傳該折的測試指標
+    """
+    fold = job['fold']
+    labels = _WORKER['labels']
+    profile = _fold_profile(fold['origin'])
+    t0 = time.perf_counter()
+    cached = os.path.exists(job['model_path'])
+    if cached:
+        booster = xgb.Booster(model_file=job['model_path'])
+    else:
+        y_train = (labels[fold['train'][0]:fold['train'][1]] > 0).reshape(-1)
+        params = dict(job['params'], objective='binary:logistic', tree_method='hist', seed=42,
+                      scale_pos_weight=float((~y_train).sum() / max(y_train.sum(), 1)), nthread=_WORKER['nthread'])
+        dtrain = xgb.DMatrix(_fold_matrix(fold['train'], profile), label=y_train, feature_names=FEATURES)
+        parent = xgb.Booster(model_file=job['parent']) if job['parent'] else None
+        booster = xgb.train(params, dtrain, num_boost_round=job['rounds'], xgb_model=parent)
+        booster.save_model(job['model_path'])
+    train_seconds = time.perf_counter() - t0
+
+    test = fold['test']
+    dtest = xgb.DMatrix(_fold_matrix(test, profile), feature_names=FEATURES)
+    booster.set_param({'nthread': _WORKER['nthread']})
+    predictions = booster.predict(dtest)
+    fold_labels = labels[test[0]:test[1]]
+    result = {
+        'origin': fold['origin'],
+        'train_days': len(np.unique(_WORKER['slots'][fold['train'][0]:fold['train'][1]].normalize())),
+        'test_days': len(np.unique(_WORKER['slots'][test[0]:test[1]].normalize())),
+        'test_pos_rate': float((fold_labels > 0).mean()),
+        'trees': booster.num_boosted_rounds(),
+        'cached': cached,
+        'train_seconds': train_seconds,
+    }
+    result.update(ranking_metrics(_WORKER['slots'][test[0]:test[1]], _WORKER['zones'], fold_labels, predictions))
+    return result
+
+
+# ==========================================
+# 3. 回測
+# ==========================================
+def _model_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def backtest(cache_dir, inputs, freq='15min', window_size=10, step='month', min_train_days=180, train_days=None,
+             params=None, rounds=300, incremental=False, warm_rounds=50, n_cores=None, nthread=None):
+    """
+    回傳每折一列的指標表 (AUC、Hit Rate@3/5/10、NDCG@5/10)
+    incremental: 第一折訓練 rounds 輪，之後每折由上一折的模型接續訓練 warm_rounds 輪 (依序執行)
+    """
+    params = params or BASE_PARAMS
+    store = FeatureStore(cache_dir, inputs, freq=freq)
+    grid, _ = load_features(store, window_size)
+    folds = make_folds(grid.slots, step, min_train_days, train_days, purge=window_size - 1)
+
+    # 模型快取鍵：全部特徵群組的鍵 + 參數 + 訓練範圍 (接續訓練時再加上前一折的鍵)
+    # 'fold_profile'：區域輪廓特徵改為每折以原點之前的紀錄統計，舊的快取模型不再適用
+    data_key = [store.key(group, window_size=window_size) if group == 'label' else store.key(group)
+                for group in GROUPS] + ['fold_profile']
+    model_dir = os.path.join(cache_dir, 'backtest')
+    os.makedirs(model_dir, exist_ok=True)
+    jobs, parent_key = [], None
+    for i, fold in enumerate(folds):
+        n_rounds = warm_rounds if incremental and i > 0 else rounds
+        key = _model_key(data_key, params, n_rounds, fold['train'], parent_key)
+        jobs.append({'fold': fold, 'params': params, 'rounds': n_rounds,
+                     'model_path': os.path.join(model_dir, f'{key}.json'),
+                     'parent': jobs[-1]['model_path'] if incremental and i > 0 else None})
+        parent_key = key if incremental else None
+
+    workers, nthread = split_cores(n_cores or os.cpu_count(), nthread)
+    if incremental:
+        workers, nthread = 1, n_cores or os.cpu_count()  # 每折依賴上一折的模型，只能依序訓練
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_dir, inputs, freq, window_size, nthread)) as pool:
+        results = list(pool.map(_train_fold, jobs))
+    return pd.DataFrame(results)
+
+
+def summarize(table):
+    metrics = ['auc', 'hit@3', 'hit@5', 'hit@10', 'ndcg@5', 'ndcg@10']
+    return table[metrics].agg(['mean', 'std', 'min', 'max']).T
+
+
+def benchmark(cache_dir, inputs, step='month', rounds=300, warm_rounds=50):
+    """每折從頭訓練 vs 接續上一折訓練 (都不使用快取模型)"""
+    import shutil
+    for incremental in (False, True):
+        shutil.rmtree(os.path.join(cache_dir, 'backtest'), ignore_errors=True)
+        t0 = time.perf_counter()
+        table = backtest(cache_dir, inputs, step=step, rounds=rounds, incremental=incremental,
+                         warm_rounds=warm_rounds)
+        elapsed = time.perf_counter() - t0
+        label = f"接續訓練 (+{warm_rounds} 輪/折)" if incremental else f"每折重新訓練 ({rounds} 輪)"
+        print(f"{label:<24}: {len(table)} 折 {elapsed:6.1f}s，平均 AUC {table['auc'].mean():.4f}，"
+              f"Hit@5 {table['hit@5'].mean():.2%}，NDCG@5 {table['ndcg@5'].mean():.4f}")
+        t0 = time.perf_counter()
+        backtest(cache_dir, inputs, step=step, rounds=rounds, incremental=incremental, warm_rounds=warm_rounds)
+        print(f"{'':<24}  重跑 (模型全部取自快取): {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="滾動原點回測")
+    parser.add_argument('--data-dir', default='../data_after_process')
+    parser.add_argument('--cache-dir', default='../data_after_process/feature_store')
+    parser.add_argument('--freq', default='15min')
+    parser.add_argument('--window-size', type=int, default=10)
+    parser.add_argument('--step', choices=list(STEPS), default='month')
+    parser.add_argument('--min-train-days', type=int, default=180)
+    parser.add_argument('--train-days', type=int, default=None, help="只用最近 N 天訓練 (預設為擴張窗口)")
+    parser.add_argument('--rounds', type=int, default=300)
+    parser.add_argument('--incremental', action='store_true', help="每折接續上一折的模型訓練")
+    parser.add_argument('--warm-rounds', type=int, default=50)
+    parser.add_argument('--cores', type=int, default=None)
+    parser.add_argument('--output', default='backtest_results.csv')
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+
+    inputs = default_inputs(args.data_dir)
+    if args.benchmark:
+        benchmark(args.cache_dir, inputs, args.step, args.rounds, args.warm_rounds)
+    else:
+        table = backtest(args.cache_dir, inputs, args.freq, args.window_size, args.step, args.min_train_days,
+                         args.train_days, rounds=args.rounds, incremental=args.incremental,
+                         warm_rounds=args.warm_rounds, n_cores=args.cores)
+        table.to_csv(args.output, index=False, encoding='utf-8-sig')
+        pd.set_option('display.width', 160)
+        print(table.drop(columns=['cached']).to_string(index=False, float_format=lambda v: f'{v:.4f}'))
+        print("\n📊 各折指標統計:")
+        print(summarize(table).to_string(float_format=lambda v: f'{v:.4f}'))
+        print(f"\n結果已儲存至 {args.output} ({table['cached'].sum()}/{len(table)} 折使用快取模型)")
@@ -0,0 +1,374 @@
+"""
+特徵快取 - 網格特徵依群組存成 .npy (每個欄位一個檔，讀取時 memory-map，不複製)
+每個群組的鍵 = 該群組所依賴的輸入檔內容雜湊 + 參數 (FREQ、WINDOW_SIZE) + 群組版本；
+輸入沒變時直接載入，某個輸入改變時只有依賴它的群組需要重算
+
+cache_dir/
+    history/<鍵>/meta.json, lag_1.npy, lag_2.npy ...
+    weather/<鍵>/...
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from grid import SlotZoneGrid
+from history import history_features, forward_window
+from ingest import prepare_violations
+from spatial import zone_centroids, NeighborGraph
+from weather import fill_precipitation, build_daily_weather, lookup_daily_weather
+from zone_profile import ZoneProfile, STATIC_FEATURES, ADVANCED_FEATURES
+
+INPUT_FILES = {
+    'violations': 'violate_with_type.csv',
+    'rules': 'location_rules.csv',
+    'coords': 'unique_locations.csv',
+    'rain': 'rainfall.csv',
+    'temp': 'temperature.csv',
+}
+
+# 群組: (依賴的輸入, 版本)；計算方式改變時調高版本，舊快取自然失效
+# 時段範圍與區域由違規紀錄與區域規則決定，所以每個群組都依賴這兩者
+# (版本 +1：舉發日期 改以 ingest.parse_ticket_dates 解析，保留的紀錄與之前不同)
+GROUPS = {
+    'time': (('violations', 'rules'), 2),
+    'weather': (('violations', 'rules', 'rain', 'temp'), 2),
+    'zone_static': (('violations', 'rules'), 2),
+    'history': (('violations', 'rules'), 3),
+    'spatial': (('violations', 'rules', 'coords'), 2),
+    'advanced': (('violations', 'rules'), 2),
+    'label': (('violations', 'rules'), 2),
+}
+KEEP = 2  # 每個群組預設保留的快取份數
+
+
+def file_digest(path, block_size=1 << 20):
+    """檔案內容的 sha256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def flatten(grid, values):
+    """群組陣列 -> 長表欄位 ((時段,) 的陣列對每個區域重複)"""
+    if values.ndim == 1:
+        return np.tile(values, grid.n_zones)
+    return grid.flatten(values)
+
+
+def long_frame(grid, features):
+    """grid.to_long() 加上全部特徵欄位"""
+    df = grid.to_long()
+    for name, values in features.items():
+        df[name] = flatten(grid, values)
+    return df
+
+
+# ==========================================
+# 1. 儲存區
+# ==========================================
+class FeatureStore:
+    """
+    inputs: {輸入名稱: 檔案路徑}；freq: 網格時段長度 (所有群組共用的參數)
+    陣列形狀為 (時段,) 表示所有區域相同 (時間、天氣)，(時段, 區域) 為一般網格特徵
+    keep: 每個群組保留最近使用的幾份快取 (寫入新快取時刪除其餘)；None 表示不刪除
+    (多個行程共用同一個 cache_dir 時，只讀取的行程應使用 None，避免刪掉其他行程正在讀的快取)
+    """
+
+    def __init__(self, cache_dir, inputs, freq='15min', keep=KEEP):
+        self.cache_dir = cache_dir
+        self.inputs = inputs
+        self.freq = freq
+        self.keep = keep
+        self._digests = {}
+        self.last_status = {}  # {群組: 'hit' / 'miss'}
+
+    def digest(self, name):
+        if name not in self._digests:
+            self._digests[name] = file_digest(self.inputs[name])
+        return self._digests[name]
+
+    def key(self, group, **params):
+        deps, version = GROUPS[group]
+        spec = {
+            'group': group,
+            'version': version,
+            'inputs': {name: self.digest(name) for name in deps},
+            'params': dict(params, freq=self.freq),
+        }
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def path(self, group, **params):
+        return os.path.join(self.cache_dir, group, self.key(group, **params))
+
+    def get(self, group, build, **params):
+        """讀取群組特徵 {名稱: 陣列 (memmap)}；沒有快取時呼叫 build() 計算並寫入"""
+        path = self.path(group, **params)
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            self.last_status[group] = 'hit'
+            os.utime(path)  # 更新修改時間：刪除舊快取時依「最近使用」而不是「建立時間」排序
+            return self._load(path)
+        self.last_status[group] = 'miss'
+        arrays = build()
+        self._save(path, arrays, group, params)
+        self._prune(group)
+        return self._load(path)
+
+    def attach(self, df, grid, group, build, **params):
+        """將群組特徵攤平成長表欄位 (df 需為 grid.to_long() 的列順序)"""
+        for name, values in self.get(group, build, **params).items():
+            df[name] = flatten(grid, values)
+        return df
+
+    # ---------- 檔案 ----------
+    def _save(self, path, arrays, group, params):
+        # 先寫到暫存目錄再改名，中斷時不會留下不完整的快取
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.tmp-')
+        for name, values in arrays.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), np.ascontiguousarray(values))
+        meta = {
+            'group': group,
+            'columns': list(arrays),
+            'inputs': {name: self.digest(name) for name in GROUPS[group][0]},
+            'params': dict(params, freq=self.freq),
+            'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+        }
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp)  # 其他行程已寫入同一份快取
+            if not os.path.exists(path):
+                raise
+
+    @staticmethod
+    def _load(path):
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            columns = json.load(f)['columns']
+        return {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in columns}
+
+    def _prune(self, group):
+        if self.keep is None:
+            return
+        group_dir = os.path.join(self.cache_dir, group)
+        entries = [os.path.join(group_dir, d) for d in os.listdir(group_dir) if not d.startswith('.')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for old in entries[self.keep:]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+# ==========================================
+# 2. 各群組的計算 (定義同 notebook)
+# ==========================================
+def build_time(grid):
+    slots = grid.slots
+    hour = np.asarray(slots.hour)
+    minute = np.asarray(slots.minute)
+    weekday = np.asarray(slots.dayofweek)
+    morning = (hour >= 9) & (hour < 12)
+    start_min = np.where(morning, 9 * 60, 14 * 60)
+    end_min = np.where(morning, 11 * 60 + 30, 16 * 60 + 30)
+    return {
+        'weekday': weekday,
+        'hour': hour,
+        'minute': minute,
+        'is_morning_session': morning.astype(int),
+        'is_afternoon_session': ((hour >= 14) & (hour < 17)).astype(int),
+        'hour_sin': np.sin(2 * np.pi * hour / 24),
+        'hour_cos': np.cos(2 * np.pi * hour / 24),
+        'weekday_sin': np.sin(2 * np.pi * weekday / 7),
+        'weekday_cos': np.cos(2 * np.pi * weekday / 7),
+        'session_progress': (hour * 60 + minute - start_min) / (end_min - start_min),
+    }
+
+
+def build_weather(grid, daily_weather):
+    rain, temp = lookup_daily_weather(grid.slots, daily_weather)
+    return {'Precipitation': rain, 'temperature': temp}
+
+
+def build_zone_static(grid, df_raw):
+    return ZoneProfile(df_raw, grid.zones).grid_features(grid.slots, STATIC_FEATURES)
+
+
+def build_history(grid):
+    # 依區域各自計算 (版本 2：notebook 原本未依區域分組的 rolling / ewm 與當天全域累積會洩漏其他區域的資料)
+    return history_features(grid.counts, grid.day_codes)
+
+
+def build_spatial(grid, neighbors, today_cumsum):
+    return neighbors.features(grid.lag(1), today_cumsum)
+
+
+def build_advanced(grid, df_raw):
+    return ZoneProfile(df_raw, grid.zones).grid_features(grid.slots, ADVANCED_FEATURES)
+
+
+def build_label(grid, window_size):
+    future = forward_window(grid.counts, window_size)
+    return {'future_window_count': future.astype(float), 'label': future.astype(int)}
+
+
+# ==========================================
+# 3. 由檔案載入 (不經 notebook 時使用)
+# ==========================================
+def default_inputs(data_dir='../data_after_process'):
+    return {name: os.path.join(data_dir, filename) for name, filename in INPUT_FILES.items()}
+
+
+def load_violations(violations_path, rules_path):
+    """
+    notebook 的前處理 (ingest.prepare_violations)：解析 舉發日期、篩選 2023 年以後、將 違規地點 對應到 Zone_ID
+    與評分服務 (scoring.load_state) 使用同一個日期解析，訓練與線上的網格相同
+    """
+    df_raw = pd.read_csv(violations_path, encoding='utf-8-sig')
+    df_rules = pd.read_csv(rules_path, encoding='utf-8-sig')
+    loc_to_zone = df_rules.set_index('Original_Location')['Zone_ID'].to_dict()
+    return prepare_violations(df_raw, loc_to_zone)
+
+
+def load_features(store, window_size=10):
+    """
+    依 notebook 的順序讀取 (或計算) 全部群組，回傳 (grid, {名稱: 陣列})
+    違規紀錄只在需要建立網格時讀取一次；鄰居與天氣只在對應群組需要重算時才載入
+    """
+    inputs = store.inputs
+    df_raw = load_violations(inputs['violations'], inputs['rules'])
+    grid = SlotZoneGrid.from_violations(df_raw, freq=store.freq)
+
+    def neighbors():
+        df_coords = pd.read_csv(inputs['coords'], encoding='utf-8-sig')
+        df_rules = pd.read_csv(inputs['rules'], encoding='utf-8-sig')
+        zones = grid.zones
+        return NeighborGraph.knn(zones, zone_centroids(df_coords, df_rules, zones), k=5)
+
+    def daily_weather():
+        df_rain = pd.read_csv(inputs['rain'], encoding='utf-8-sig')
+        df_temp = pd.read_csv(inputs['temp'], encoding='utf-8-sig')
+        return build_daily_weather(fill_precipitation(df_rain), df_temp)
+
+    features = {}
+    features.update(store.get('time', lambda: build_time(grid)))
+    features.update(store.get('weather', lambda: build_weather(grid, daily_weather())))
+    features.update(store.get('zone_static', lambda: build_zone_static(grid, df_raw)))
+    features.update(store.get('history', lambda: build_history(grid)))
+    features.update(store.get('spatial', lambda: build_spatial(grid, neighbors(), features['today_cumsum'])))
+    features.update(store.get('advanced', lambda: build_advanced(grid, df_raw)))
+    features.update(store.get('label', lambda: build_label(grid, window_size), window_size=window_size))
+    return grid, features
+
+
+# ==========================================
+# 4. 驗證與效能測試
+# ==========================================
+def _copy_inputs(data_dir, dst):
+    os.makedirs(dst, exist_ok=True)
+    for filename in INPUT_FILES.values():
+        shutil.copy(os.path.join(data_dir, filename), dst)
+    return default_inputs(dst)
+
+
+def verify(data_dir='../data_after_process'):
+    """快取載入的結果與重新計算相同；修改單一輸入只讓依賴它的群組失效"""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        inputs = _copy_inputs(data_dir, os.path.join(tmp_dir, 'data'))
+        cache_dir = os.path.join(tmp_dir, 'cache')
+
+        store = FeatureStore(cache_dir, inputs)
+        _, built = load_features(store)
+        assert set(store.last_status.values()) == {'miss'}
+        store = FeatureStore(cache_dir, inputs)
+        _, loaded = load_features(store)
+        assert set(store.last_status.values()) == {'hit'}
+        for name, values in built.items():
+            assert isinstance(loaded[name], np.memmap), name
+            assert np.array_equal(loaded[name], values), name
+
+        # 修改降水資料：只有 weather 需要重算
+        with open(inputs['rain'], 'a', encoding='utf-8') as f:
+            f.write('2099-01-01,1.0\n')
+        store = FeatureStore(cache_dir, inputs)
+        load_features(store)
+        assert [g for g, s in store.last_status.items() if s == 'miss'] == ['weather'], store.last_status
+
+        # 改變 WINDOW_SIZE：只有 label 需要重算
+        store = FeatureStore(cache_dir, inputs)
+        load_features(store, window_size=8)
+        assert [g for g, s in store.last_status.items() if s == 'miss'] == ['label'], store.last_status
+        print(f"✅ 快取與重新計算一致 ({len(built)} 個欄位)，修改輸入只重算依賴它的群組")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def benchmark(data_dir='../data_after_process'):
+    """第一次計算 (並寫入) vs 之後直接載入 vs 原本的 X_df.csv / Y_df.csv 文字檔"""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        inputs = _copy_inputs(data_dir, os.path.join(tmp_dir, 'data'))
+        store = FeatureStore(os.path.join(tmp_dir, 'cache'), inputs)
+
+        t0 = time.perf_counter()
+        grid, features = load_features(store)
+        cold = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        grid, features = load_features(FeatureStore(store.cache_dir, inputs))
+        df = long_frame(grid, features)
+        warm = time.perf_counter() - t0
+
+        X, y = df.drop(columns=['label', 'future_window_count']), df['label']
+        t0 = time.perf_counter()
+        X.to_csv(os.path.join(tmp_dir, 'X_df.csv'), index=False, encoding='utf-8')
+        y.to_csv(os.path.join(tmp_dir, 'Y_df.csv'), index=False, encoding='utf-8')
+        csv_write = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        pd.read_csv(os.path.join(tmp_dir, 'X_df.csv'))
+        pd.read_csv(os.path.join(tmp_dir, 'Y_df.csv'))
+        csv_read = time.perf_counter() - t0
+
+        size_mb = sum(os.path.getsize(os.path.join(root, f))
+                      for root, _, files in os.walk(store.cache_dir) for f in files) / 2**20
+        print(f"{len(df)} 列 x {len(features)} 個特徵 (快取 {size_mb:.0f} MB)")
+        print(f"   第一次計算並寫入快取: {cold:.2f}s")
+        print(f"   輸入未變，載入快取並展開長表: {warm:.2f}s")
+        print(f"   X_df.csv / Y_df.csv 寫出: {csv_write:.2f}s，讀回: {csv_read:.2f}s")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="網格特徵快取")
+    parser.add_argument('--data-dir', default='../data_after_process')
+    parser.add_argument('--cache-dir', default='../data_after_process/feature_store')
+    parser.add_argument('--window-size', type=int, default=10)
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--clear', action='store_true', help="刪除全部快取")
+    args = parser.parse_args()
+
+    if args.verify:
+        verify(args.data_dir)
+    elif args.benchmark:
+        benchmark(args.data_dir)
+    else:
+        store = FeatureStore(args.cache_dir, default_inputs(args.data_dir))
+        if args.clear:
+            store.clear()
+            print(f"已刪除 {args.cache_dir}")
+        else:
+            grid, features = load_features(store, args.window_size)
+            print(f"{grid.n_slots} 時段 x {grid.n_zones} 區域，{len(features)} 個欄位: {store.last_status}")
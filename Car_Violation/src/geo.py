@@ -0,0 +1,152 @@
+"""
+地理工具 - 向量化 Haversine 距離、condensed 距離矩陣，以及可重複切割的階層式分群樹
+"""
+
+import time
+
+import numpy as np
+from scipy.cluster.hierarchy import linkage, fcluster
+
+EARTH_RADIUS_M = 6371000
+
+
+def haversine(coord1, coord2):
+    """
+    Haversine 距離 (公尺)，coord = (緯度, 經度)
+    支援 numpy 廣播：coord1 / coord2 可為 (..., 2) 的陣列
+    """
+    coord1 = np.radians(np.asarray(coord1, dtype=float))
+    coord2 = np.radians(np.asarray(coord2, dtype=float))
+    lat1, lon1 = coord1[..., 0], coord1[..., 1]
+    lat2, lon2 = coord2[..., 0], coord2[..., 1]
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_M * 2 * np.arcsin(np.sqrt(a))
+
+
+def haversine_matrix(coords_a, coords_b=None):
+    """一次計算兩組座標 (n x 2), (m x 2) 之間的完整距離矩陣 (n x m)；只給一組時為自身兩兩距離"""
+    coords_a = np.asarray(coords_a, dtype=float)
+    coords_b = coords_a if coords_b is None else np.asarray(coords_b, dtype=float)
+    dist = haversine(coords_a[:, None, :], coords_b[None, :, :])
+    if coords_b is coords_a:
+        np.fill_diagonal(dist, 0.0)
+    return dist
+
+
+def haversine_blocks(coords, block_rows=512):
+    """
+    逐區塊產生上三角距離：每次回傳 (start, stop, block)
+    block[i - start, :] = 第 i 個點到第 start+1 ~ n-1 個點的距離 (公尺)，暫存只有 block_rows x n
+    """
+    rad = np.radians(np.asarray(coords, dtype=float))
+    lat, lon = rad[:, 0], rad[:, 1]
+    cos_lat = np.cos(lat)
+    n = len(rad)
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        dlat = lat[start + 1:][None, :] - lat[start:stop, None]
+        dlon = lon[start + 1:][None, :] - lon[start:stop, None]
+        a = np.sin(dlat / 2) ** 2 + cos_lat[start:stop, None] * cos_lat[None, start + 1:] * np.sin(dlon / 2) ** 2
+        yield start, stop, EARTH_RADIUS_M * 2 * np.arcsin(np.sqrt(a))
+
+
+def haversine_condensed(coords, block_rows=512, dtype=np.float64):
+    """condensed 距離向量 (同 scipy pdist 的格式，長度 n(n-1)/2)，可直接交給 linkage"""
+    n = len(coords)
+    out = np.empty(n * (n - 1) // 2, dtype=dtype)
+    for start, stop, block in haversine_blocks(coords, block_rows):
+        for i in range(start, stop):
+            offset = i * n - i * (i + 1) // 2
+            out[offset:offset + n - i - 1] = block[i - start, i - start:]
+    return out
+
+
+class LinkageTree:
+    """
+    階層式分群樹：距離矩陣與 linkage 只算一次，之後可用任意多個距離閾值切割
+    dedupe=True 時先合併完全相同的座標 (逐筆罰單常落在同一點)，切割結果再對應回每一筆
+    """
+
+    def __init__(self, coords, method='complete', dedupe=True):
+        coords = np.asarray(coords, dtype=float)
+        if dedupe:
+            self.points, self.inverse = np.unique(coords, axis=0, return_inverse=True)
+            self.inverse = self.inverse.ravel()
+        else:
+            self.points, self.inverse = coords, np.arange(len(coords))
+        self.method = method
+        # 不到 2 個 (相異) 點時 linkage 無法計算，任何閾值都只有一群
+        self.Z = linkage(haversine_condensed(self.points), method=method) if len(self.points) >= 2 else None
+        self._cuts = {}
+
+    def cut(self, threshold):
+        """以距離閾值 (公尺) 切割，回傳每個原始座標的群組編號 (同 fcluster，從 1 開始)"""
+        if threshold not in self._cuts:
+            if self.Z is None:
+                self._cuts[threshold] = np.ones(len(self.points), dtype=np.int32)
+            else:
+                self._cuts[threshold] = fcluster(self.Z, t=threshold, criterion='distance')
+        return self._cuts[threshold][self.inverse]
+
+    def cut_many(self, thresholds):
+        return {t: self.cut(t) for t in thresholds}
+
+
+# ==========================================
+# 效能測試 (舊版雙層迴圈 vs 向量化)
+# ==========================================
+def _legacy_matrix(coords):
+    n = len(coords)
+    dist = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i + 1, n):
+            d = haversine(coords[i], coords[j])
+            dist[i, j] = d
+            dist[j, i] = d
+    return dist
+
+
+def _synthetic_points(n, seed=0):
+    # 中山大學校園附近 (約 1.5km 見方) 的隨機點
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(22.620, 22.634, n), rng.uniform(120.258, 120.272, n)])
+
+
+def benchmark(sizes=(1_000, 10_000, 50_000), linkage_limit=10_000, legacy_n=300):
+    coords = _synthetic_points(legacy_n)
+    t0 = time.perf_counter()
+    expected = _legacy_matrix(coords)
+    legacy_per_pair = (time.perf_counter() - t0) / (legacy_n * (legacy_n - 1) / 2)
+    assert np.allclose(haversine_matrix(coords), expected)
+
+    print(f"{'地點數':>8} | {'condensed (s)':>13} | {'雙層迴圈估計 (s)':>16} | {'linkage (s)':>11} | {'4 個閾值切割 (s)':>15}")
+    for n in sizes:
+        coords = _synthetic_points(n)
+        pairs = n * (n - 1) // 2
+        t0 = time.perf_counter()
+        if n <= linkage_limit:
+            haversine_condensed(coords)
+        else:
+            # 大量地點只量測距離核心 (逐區塊計算不保存)，完整矩陣約需 8 * n^2 / 2 bytes
+            for _ in haversine_blocks(coords):
+                pass
+        dist_s = time.perf_counter() - t0
+
+        if n <= linkage_limit:
+            t0 = time.perf_counter()
+            tree = LinkageTree(coords, dedupe=False)
+            link_s = time.perf_counter() - t0 - dist_s
+            t0 = time.perf_counter()
+            tree.cut_many([50, 100, 150, 200])
+            cut_s = f"{time.perf_counter() - t0:15.3f}"
+            link_s = f"{link_s:11.2f}"
+        else:
+            link_s = f"{'(略過)':>11}"
+            cut_s = f"{'-':>15}"
+        print(f"{n:>8,} | {dist_s:>13.2f} | {legacy_per_pair * pairs:>16.0f} | {link_s} | {cut_s}")
+
+
+if __name__ == "__main__":
+    benchmark()
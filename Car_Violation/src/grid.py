@@ -0,0 +1,231 @@
+"""
+區域時間網格 - 以 (時段 x 區域) 的 numpy 陣列儲存取締數，需要時才展開成長表 (long format)
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# 取締時段：上午 09:00 ~ 11:30、下午 13:00 ~ 16:30 (含起訖)
+MORNING_WINDOW = ((9, 0), (11, 30))
+AFTERNOON_WINDOW = ((13, 0), (16, 30))
+
+
+def enforcement_slot_mask(times):
+    """回傳 times 中落在取締時段內的布林遮罩"""
+    minutes = np.asarray(times.hour) * 60 + np.asarray(times.minute)
+    mask = np.zeros(len(minutes), dtype=bool)
+    for (h0, m0), (h1, m1) in (MORNING_WINDOW, AFTERNOON_WINDOW):
+        mask |= (minutes >= h0 * 60 + m0) & (minutes <= h1 * 60 + m1)
+    return mask
+
+
+def enforcement_slots(start_time, end_time, freq='15min'):
+    """建立 start_time ~ end_time 之間所有取締時段的 DatetimeIndex"""
+    time_index = pd.date_range(start=start_time, end=end_time, freq=freq)
+    return time_index[enforcement_slot_mask(time_index)]
+
+
+class SlotZoneGrid:
+    """
+    時段 x 區域的取締數網格
+    counts[i, j] = 第 i 個時段、第 j 個區域的取締數 (dense ndarray 或 scipy.sparse CSR)
+    """
+
+    def __init__(self, slots, zones, counts):
+        self.slots = pd.DatetimeIndex(slots)
+        self.zones = np.asarray(zones)
+        if counts.shape != (len(self.slots), len(self.zones)):
+            raise ValueError(f"counts 形狀 {counts.shape} 與網格 ({len(self.slots)}, {len(self.zones)}) 不符")
+        self._counts = counts
+        self._zone_pos = {z: j for j, z in enumerate(self.zones.tolist())}
+        self._day_codes = None
+
+    @classmethod
+    def from_violations(cls, df_raw, freq='15min', zones=None, time_col='Datetime',
+                        zone_col='Zone_ID', use_sparse=False, dtype=np.int32):
+        """由違規紀錄 (每筆一列) 建立網格；落在取締時段以外的紀錄不計入"""
+        start_time = df_raw[time_col].min().floor('D')
+        end_time = df_raw[time_col].max().ceil('D')
+        slots = enforcement_slots(start_time, end_time, freq)
+        if zones is None:
+            zones = np.sort(df_raw[zone_col].unique())
+        zones = np.asarray(zones)
+
+        # 以整數索引定位每筆紀錄的 (時段, 區域)
+        slot_pos = slots.get_indexer(df_raw[time_col].dt.floor(freq))
+        zone_pos = pd.Index(zones).get_indexer(df_raw[zone_col])
+        keep = (slot_pos >= 0) & (zone_pos >= 0)
+        slot_pos, zone_pos = slot_pos[keep], zone_pos[keep]
+
+        shape = (len(slots), len(zones))
+        ones = np.ones(len(slot_pos), dtype=dtype)
+        if use_sparse:
+            # coo -> csr 時重複座標會自動加總
+            counts = sparse.coo_matrix((ones, (slot_pos, zone_pos)), shape=shape).tocsr()
+        else:
+            counts = np.zeros(shape, dtype=dtype)
+            np.add.at(counts, (slot_pos, zone_pos), 1)
+        return cls(slots, zones, counts)
+
+    # ---------- 基本屬性 ----------
+    @property
+    def shape(self):
+        return self._counts.shape
+
+    @property
+    def n_slots(self):
+        return len(self.slots)
+
+    @property
+    def n_zones(self):
+        return len(self.zones)
+
+    @property
+    def is_sparse(self):
+        return sparse.issparse(self._counts)
+
+    @property
+    def counts(self):
+        """dense 的 (時段 x 區域) 取締數陣列"""
+        if self.is_sparse:
+            return self._counts.toarray()
+        return self._counts
+
+    @property
+    def sparse_counts(self):
+        return self._counts if self.is_sparse else sparse.csr_matrix(self._counts)
+
+    @property
+    def day_codes(self):
+        """每個時段所屬日期的整數編號 (0, 1, 2, ...)，用於當天累積等以日為界的計算"""
+        if self._day_codes is None:
+            self._day_codes = pd.factorize(self.slots.normalize())[0]
+        return self._day_codes
+
+    def slot_index(self, slot):
+        return self.slots.get_loc(pd.Timestamp(slot))
+
+    def zone_index(self, zone):
+        return self._zone_pos[zone]
+
+    # ---------- 陣列運算 ----------
+    def lag(self, k, values=None, dtype=np.float64):
+        """各區域沿時段往後平移 k 格 (前 k 格補 0)，等同長表的 groupby('Zone_ID').shift(k).fillna(0)"""
+        values = self.counts if values is None else values
+        out = np.zeros(values.shape, dtype=dtype)
+        if k < len(values):
+            out[k:] = values[:len(values) - k]
+        return out
+
+    def sparse_lag(self, k):
+        """
+        稀疏版 lag：CSR 往後平移 k 列只需改寫 indptr，data / indices 直接共用 (不複製)
+        回傳 scipy.sparse CSR，語意同 lag()
+        """
+        counts = self.sparse_counts
+        n = counts.shape[0]
+        k = min(k, n)
+        indptr = np.concatenate([np.zeros(k, dtype=counts.indptr.dtype), counts.indptr[:n - k + 1]])
+        end = indptr[-1]
+        return sparse.csr_matrix((counts.data[:end], counts.indices[:end], indptr),
+                                 shape=counts.shape, copy=False)
+
+    # ---------- 長表檢視 ----------
+    def to_long(self, features=None):
+        """
+        展開成 (Zone_ID, Slot_Start) 排序的長表，欄位: Slot_Start, Zone_ID, count_in_slot
+        features: {欄位名稱: (時段 x 區域) 陣列}，一併攤平成欄位
+        """
+        n_slots, n_zones = self.shape
+        df = pd.DataFrame({
+            'Slot_Start': np.tile(self.slots.values, n_zones),
+            'Zone_ID': np.repeat(self.zones, n_slots),
+            'count_in_slot': self.flatten(self.counts).astype(int),
+        })
+        for name, values in (features or {}).items():
+            df[name] = self.flatten(values)
+        return df
+
+    @staticmethod
+    def flatten(values):
+        """(時段 x 區域) 陣列 -> 依區域優先 (zone-major) 攤平，與 to_long 的列順序一致"""
+        if sparse.issparse(values):
+            values = values.toarray()
+        return np.asarray(values).T.ravel()
+
+    def unflatten(self, column):
+        """長表欄位 (zone-major) -> (時段 x 區域) 陣列"""
+        return np.asarray(column).reshape(self.n_zones, self.n_slots).T
+
+
+# ==========================================
+# 記憶體測試 (5 年、15 分鐘網格：原本長表 vs 陣列網格)
+# ==========================================
+def _synthetic_violations(years=5, n_zones=22, per_day=30, seed=0):
+    rng = np.random.default_rng(seed)
+    n_days = int(365 * years)
+    n = n_days * per_day
+    day = rng.integers(0, n_days, n)
+    minute = rng.choice(np.r_[9 * 60:11 * 60 + 45, 13 * 60:16 * 60 + 45], n)
+    dt = pd.Timestamp('2021-01-01') + pd.to_timedelta(day, unit='D') + pd.to_timedelta(minute, unit='min')
+    return pd.DataFrame({'Datetime': dt, 'Zone_ID': rng.integers(1, n_zones + 1, n)})
+
+
+def _legacy_grid_and_lags(df_raw, freq):
+    start_time = df_raw['Datetime'].min().floor('D')
+    end_time = df_raw['Datetime'].max().ceil('D')
+    active_time_index = enforcement_slots(start_time, end_time, freq)
+    zones = sorted(df_raw['Zone_ID'].unique())
+    idx = pd.MultiIndex.from_product([active_time_index, zones], names=['Slot_Start', 'Zone_ID'])
+    df_grid = pd.DataFrame(index=idx).reset_index()
+    df_raw = df_raw.assign(Slot_Start=df_raw['Datetime'].dt.floor(freq))
+    counts = df_raw.groupby(['Slot_Start', 'Zone_ID']).size().reset_index(name='count_in_slot')
+    df = pd.merge(df_grid, counts, on=['Slot_Start', 'Zone_ID'], how='left')
+    df['count_in_slot'] = df['count_in_slot'].fillna(0).astype(int)
+    df = df.sort_values(['Zone_ID', 'Slot_Start']).reset_index(drop=True)
+    grouped = df.groupby('Zone_ID')['count_in_slot']
+    for k in range(1, 5):
+        df[f'lag_{k}'] = grouped.shift(k).fillna(0)
+    return df
+
+
+def _array_grid_and_lags(df_raw, freq):
+    grid = SlotZoneGrid.from_violations(df_raw, freq=freq, dtype=np.int16)
+    lags = [grid.lag(k, dtype=np.int16) for k in range(1, 5)]
+    return grid, lags
+
+
+def _sparse_grid_and_lags(df_raw, freq):
+    grid = SlotZoneGrid.from_violations(df_raw, freq=freq, use_sparse=True)
+    lags = [grid.sparse_lag(k) for k in range(1, 5)]
+    return grid, lags
+
+
+def _peak_memory(func, *args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 2**20, elapsed
+
+
+def benchmark(years=5, freq='15min'):
+    df_raw = _synthetic_violations(years)
+    print(f"合成資料: {len(df_raw):,} 筆違規，{years} 年，FREQ={freq}")
+    legacy_mb, legacy_s = _peak_memory(_legacy_grid_and_lags, df_raw, freq)
+    array_mb, array_s = _peak_memory(_array_grid_and_lags, df_raw, freq)
+    sparse_mb, sparse_s = _peak_memory(_sparse_grid_and_lags, df_raw, freq)
+    print(f"長表 (MultiIndex + merge + shift): 峰值 {legacy_mb:8.1f} MB, {legacy_s:.2f}s")
+    print(f"陣列網格 (int16 dense + lag):      峰值 {array_mb:8.1f} MB, {array_s:.2f}s ({legacy_mb / array_mb:.1f}x)")
+    print(f"稀疏網格 (CSR + sparse_lag):       峰值 {sparse_mb:8.1f} MB, {sparse_s:.2f}s ({legacy_mb / sparse_mb:.1f}x)")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,170 @@
+"""
+歷史特徵核心 - 直接在 (時段 x 區域) 取締數陣列上計算 lag、滾動加總、指數衰減、當天累積與預測標籤
+全部由同一個前綴和 (cumsum) 推導：視窗加總 = 兩個前綴和相減，當天累積 = 前綴和減去當天開始時的前綴和；
+指數衰減以 scipy.signal.lfilter 沿時段方向一次算完所有區域。不需要長表、groupby 或字串鍵
+
+每個特徵都依區域各自計算，只使用本時段之前的取締數 (預測標籤除外)：
+notebook 原本在依區域排序的長表上直接 rolling / ewm，每個區域最前面幾格會混入上一個區域最後幾格的數值；
+當天全域累積以 groupby('date').cumsum() 在同樣的順序上累加，會算進編號較小的區域當天「之後」的取締 (標籤洩漏)
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+N_LAGS = 4
+RECENT_WINDOW = 4   # recent_1h_count：前 4 個時段
+HALFLIFE = 2        # decay_recent 的半衰期 (時段數)
+
+
+def prefix_sum(counts):
+    """S[t] = counts[:t].sum(axis=0)，第 0 列為 0 (共 時段數 + 1 列)"""
+    S = np.zeros((len(counts) + 1,) + counts.shape[1:], dtype=np.int64)
+    np.cumsum(counts, axis=0, out=S[1:])
+    return S
+
+
+def day_start_index(day_codes):
+    """每個時段所屬日期的第一個時段位置 (day_codes 需依時間排序)"""
+    day_codes = np.asarray(day_codes)
+    return np.searchsorted(day_codes, day_codes, side='left')
+
+
+def decay_mean(counts, halflife=HALFLIFE):
+    """
+    上一時段取締數的指數加權平均，等同 pd.DataFrame(counts).shift(1).ewm(halflife).mean().fillna(0)
+    (adjust=True：第 t 格 = sum w^(t-1-j) x_j / sum w^(t-1-j)，j < t)
+    """
+    w = 0.5 ** (1.0 / halflife)
+    numerator = lfilter([1.0], [1.0, -w], counts.astype(float), axis=0)
+    t = np.arange(1, len(counts))
+    out = np.zeros(counts.shape, dtype=float)
+    out[1:] = numerator[:-1] / ((1 - w ** t) / (1 - w))[:, None]
+    return out
+
+
+def history_features(counts, day_codes, S=None, n_lags=N_LAGS, window=RECENT_WINDOW, halflife=HALFLIFE):
+    """lag_1..n、recent_1h_count、decay_recent、today_cumsum、today_global_cumsum，皆為 (時段 x 區域) float 陣列"""
+    counts = np.asarray(counts)
+    S = prefix_sum(counts) if S is None else S
+    n = len(counts)
+    t = np.arange(n)
+    features = {}
+    for k in range(1, n_lags + 1):
+        lag = np.zeros(counts.shape, dtype=float)
+        lag[k:] = counts[:n - k]
+        features[f'lag_{k}'] = lag
+    features['recent_1h_count'] = (S[t] - S[np.maximum(t - window, 0)]).astype(float)
+    features['decay_recent'] = decay_mean(counts, halflife)
+
+    today = (S[t] - S[day_start_index(day_codes)]).astype(float)
+    features['today_cumsum'] = today
+    features['today_global_cumsum'] = np.repeat(today.sum(axis=1, keepdims=True), counts.shape[1], axis=1)
+    return features
+
+
+def forward_window(counts, window_size, S=None):
+    """未來 window_size 個時段 (含本時段) 的取締數，資料尾端不足時只加總剩餘時段 (int 陣列)"""
+    S = prefix_sum(counts) if S is None else S
+    t = np.arange(len(counts))
+    return S[np.minimum(t + window_size, len(counts))] - S[t]
+
+
+def grid_features(counts, day_codes, window_size=10):
+    """歷史特徵與預測標籤 (共用一次前綴和)"""
+    S = prefix_sum(np.asarray(counts))
+    features = history_features(counts, day_codes, S)
+    features['label'] = forward_window(counts, window_size, S).astype(int)
+    return features
+
+
+# ==========================================
+# 驗證與效能測試
+# ==========================================
+def _pandas_reference(counts, day_codes, window_size):
+    """依區域分組的 pandas 版本 (長表、groupby)，用來核對"""
+    n_slots, n_zones = counts.shape
+    df = pd.DataFrame({
+        'zone': np.repeat(np.arange(n_zones), n_slots),
+        'day': np.tile(day_codes, n_zones),
+        'slot': np.tile(np.arange(n_slots), n_zones),
+        'count': counts.T.ravel(),
+    })
+    grouped = df.groupby('zone')['count']
+    out = {f'lag_{k}': grouped.shift(k).fillna(0) for k in range(1, N_LAGS + 1)}
+    out['recent_1h_count'] = grouped.transform(lambda s: s.shift(1).rolling(RECENT_WINDOW, min_periods=1).sum())
+    out['decay_recent'] = grouped.transform(lambda s: s.shift(1).ewm(halflife=HALFLIFE).mean())
+    out['today_cumsum'] = df.groupby(['zone', 'day'])['count'].cumsum() - df['count']
+    slot_total = df.groupby('slot')['count'].sum()
+    global_cum = slot_total.groupby(day_codes).cumsum() - slot_total
+    out['today_global_cumsum'] = df['slot'].map(global_cum)
+    indexer = pd.api.indexers.FixedForwardWindowIndexer(window_size=window_size)
+    out['label'] = grouped.rolling(window=indexer, min_periods=1).sum().values
+    return {name: np.nan_to_num(np.asarray(values, dtype=float)).reshape(n_zones, n_slots).T
+            for name, values in out.items()}
+
+
+def _legacy_notebook(counts, slots, zones, window_size):
+    # notebook 原本的長表寫法 (字串鍵、逐群組 shift / rolling / ewm / FixedForwardWindowIndexer)
+    n_slots, n_zones = counts.shape
+    df = pd.DataFrame({
+        'Slot_Start': np.tile(slots.values, n_zones),
+        'Zone_ID': np.repeat(zones, n_slots),
+        'count_in_slot': counts.T.ravel(),
+    })
+    df['date'] = df['Slot_Start'].dt.date
+    grouped = df.groupby('Zone_ID')['count_in_slot']
+    for k in range(1, 5):
+        df[f'lag_{k}'] = grouped.shift(k).fillna(0)
+    df['recent_1h_count'] = grouped.shift(1).rolling(window=4, min_periods=1).sum().fillna(0)
+    df['decay_recent'] = grouped.shift(1).ewm(halflife=2).mean().fillna(0)
+    df['date_zone_key'] = df['date'].astype(str) + '_' + df['Zone_ID'].astype(str)
+    df['today_cumsum'] = df.groupby('date_zone_key')['count_in_slot'].cumsum() - df['count_in_slot']
+    df['today_global_cumsum'] = df.groupby('date')['count_in_slot'].cumsum() - df['count_in_slot']
+    indexer = pd.api.indexers.FixedForwardWindowIndexer(window_size=window_size)
+    df['label'] = df.groupby('Zone_ID')['count_in_slot'].rolling(window=indexer, min_periods=1).sum().values
+    return df
+
+
+def _synthetic_counts(freq, years=3, n_zones=22, seed=0):
+    from grid import SlotZoneGrid, _synthetic_violations
+    df = _synthetic_violations(years=years, n_zones=n_zones, seed=seed)
+    return SlotZoneGrid.from_violations(df, freq=freq)
+
+
+def verify(window_size=10):
+    for freq in ('15min', '5min'):
+        grid = _synthetic_counts(freq, years=1, n_zones=8)
+        got = grid_features(grid.counts, grid.day_codes, window_size)
+        expected = _pandas_reference(grid.counts, grid.day_codes, window_size)
+        for name, values in expected.items():
+            assert np.allclose(got[name], values, rtol=1e-12, atol=1e-12), (freq, name)
+    print(f"✅ 核心結果與依區域分組的 pandas 計算一致 ({len(expected)} 個特徵，15min / 5min)")
+
+
+def benchmark(years=3, window_size=10):
+    print(f"{'FREQ':>6} | {'時段 x 區域':>14} | {'長表 (notebook)':>15} | {'陣列核心':>9} | {'加速':>6}")
+    for freq in ('15min', '5min'):
+        grid = _synthetic_counts(freq, years=years)
+        t0 = time.perf_counter()
+        _legacy_notebook(grid.counts, grid.slots, grid.zones, window_size)
+        legacy = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        grid_features(grid.counts, grid.day_codes, window_size)
+        fast = time.perf_counter() - t0
+        shape = f"{grid.n_slots} x {grid.n_zones}"
+        print(f"{freq:>6} | {shape:>14} | {legacy:>14.2f}s | {fast:>8.3f}s | {legacy / fast:>5.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="歷史特徵核心")
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+    if args.verify:
+        verify()
+    if args.benchmark:
+        benchmark()
@@ -0,0 +1,307 @@
+"""
+增量匯入 - 只解析 violate.csv 新增的紀錄，附加到欄式儲存區 (parquet)，並只重算受影響時段的特徵
+
+水位 (high-water mark)：已匯入紀錄中最新的 舉發日期
+violate.csv 大致由新到舊排列 (分頁交界偶有數小時內的前後顛倒)，所以讀到比水位早 SCAN_LOOKBACK 的資料就停止；
+掃描範圍內再以 序號 去除已匯入的紀錄
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from grid import SlotZoneGrid, enforcement_slots
+from history import grid_features
+from spatial import zone_centroids, NeighborGraph
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools'))
+from plate import classify_vehicle_types
+
+NOISE_KEYWORD = "每頁紀錄"  # 爬蟲分頁列
+SERIAL_COL = '序號'
+DATE_COL = '舉發日期'
+
+SCAN_LOOKBACK = pd.Timedelta('1D')
+HISTORY_WARMUP = 128  # decay_recent (halflife=2) 的權重在 128 格後小於 2^-64，可視為沒有影響
+
+
+# ==========================================
+# 1. 讀取原始檔 (只取水位之後的紀錄)
+# ==========================================
+def drop_noise_rows(df):
+    """刪除任一欄含有「每頁紀錄」的分頁列 (逐欄向量化比對)"""
+    mask = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        mask |= df[col].astype(str).str.contains(NOISE_KEYWORD, regex=False).values
+    return df[~mask]
+
+
+def _sniff_delimiter(f, sample_size=64 * 1024):
+    sample = f.read(sample_size)
+    f.seek(0)
+    return csv.Sniffer().sniff(sample.splitlines()[0]).delimiter
+
+
+def parse_ticket_dates(values):
+    """舉發日期 格式不一 (含只有日期、全形冒號等)，逐筆判斷格式；無法解析者為 NaT"""
+    return pd.to_datetime(values, errors='coerce', format='mixed')
+
+
+def read_new_violations(raw_path, high_water=None, seen_serials=(), chunksize=5000):
+    """
+    逐塊讀取原始檔，回傳尚未匯入 (序號 不在 seen_serials) 的紀錄
+    讀到 舉發日期 早於 水位 - SCAN_LOOKBACK 的區塊後停止
+    """
+    high_water = pd.Timestamp(high_water) if high_water is not None else None
+    seen_serials = pd.Index(seen_serials)
+    new_parts = []
+
+    with open(raw_path, 'r', encoding='big5', errors='replace') as f:
+        sep = _sniff_delimiter(f)
+        for chunk in pd.read_csv(f, sep=sep, dtype=str, chunksize=chunksize):
+            chunk = drop_noise_rows(chunk)
+            new_parts.append(chunk[~chunk[SERIAL_COL].isin(seen_serials)])
+            if high_water is not None and (parse_ticket_dates(chunk[DATE_COL]) < high_water - SCAN_LOOKBACK).any():
+                break
+
+    if not new_parts:
+        return pd.DataFrame()
+    return pd.concat(new_parts, ignore_index=True)
+
+
+# ==========================================
+# 2. 欄式儲存區 (append-only parquet)
+# ==========================================
+class ViolationStore:
+    """
+    store_dir/
+        part-00000.parquet, part-00001.parquet ...  (每次匯入附加一個檔案，內容同 violate_with_type.csv)
+        state.json                                  (水位與統計)
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.state_path = os.path.join(store_dir, 'state.json')
+        os.makedirs(store_dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'high_water': None, 'n_rows': 0, 'parts': []}
+
+    def _save_state(self):
+        # 先寫暫存檔再取代，避免中斷時留下壞掉的 state.json
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def high_water(self):
+        hw = self.state['high_water']
+        return pd.Timestamp(hw) if hw is not None else None
+
+    def ingest(self, raw_path, chunksize=5000):
+        """匯入原始檔中的新紀錄，回傳本次新增 (車種有效) 的紀錄"""
+        seen = self.load(columns=[SERIAL_COL])[SERIAL_COL] if self.state['parts'] else ()
+        df_new = read_new_violations(raw_path, self.high_water, seen, chunksize)
+        if df_new.empty:
+            return df_new
+
+        dt = parse_ticket_dates(df_new[DATE_COL])
+        if dt.notna().any() and (self.high_water is None or dt.max() > self.high_water):
+            self.state['high_water'] = str(dt.max())
+
+        df_new['Vehicle_Type'] = classify_vehicle_types(df_new)
+        df_new = df_new[df_new['Vehicle_Type'] != 'Other'].reset_index(drop=True)
+
+        if not df_new.empty:
+            part_name = f"part-{len(self.state['parts']):05d}.parquet"
+            df_new.to_parquet(os.path.join(self.store_dir, part_name), index=False)
+            self.state['parts'].append(part_name)
+            self.state['n_rows'] += len(df_new)
+        self._save_state()
+        return df_new
+
+    def load(self, columns=None):
+        """讀取全部已匯入紀錄 (依匯入順序)"""
+        if not self.state['parts']:
+            return pd.DataFrame(columns=columns)
+        parts = [pd.read_parquet(os.path.join(self.store_dir, p), columns=columns) for p in self.state['parts']]
+        return pd.concat(parts, ignore_index=True)
+
+
+def prepare_violations(df, loc_to_zone, min_year=2023):
+    """notebook 的前處理：解析 舉發日期 (逐筆判斷格式，結果不受批次切法影響)、篩選年份、將 違規地點 對應到 Zone_ID"""
+    df = df.copy()
+    df['Datetime'] = parse_ticket_dates(df[DATE_COL])
+    df = df.dropna(subset=['Datetime'])
+    df = df[df['Datetime'].dt.year >= min_year].copy()
+    df['Zone_ID'] = df['違規地點'].map(loc_to_zone)
+    df = df.dropna(subset=['Zone_ID'])
+    df['Zone_ID'] = df['Zone_ID'].astype(int)
+    return df
+
+
+# ==========================================
+# 3. 特徵 (時段 x 區域 陣列) 與增量重算
+# ==========================================
+def compute_grid_features(counts, day_codes, neighbors, window_size=10):
+    """由取締數陣列計算歷史、當天累積、鄰居與預測標籤特徵，回傳 {名稱: 時段 x 區域 陣列}"""
+    features = grid_features(counts, day_codes, window_size)
+    features.update(neighbors.features(features['lag_1'], features['today_cumsum']))
+    return features
+
+
+class IncrementalFeatures:
+    """
+    持有取締數網格與所有特徵陣列；新資料進來時只重算受影響的時段
+    受影響範圍：最早的新時段往前 window_size - 1 格 (預測標籤會看到未來) 到最後
+    重算時往前多取 HISTORY_WARMUP 格並對齊到當天開始 (lag / rolling / ewm / 當天累積需要歷史)
+    """
+
+    def __init__(self, neighbors, freq='15min', window_size=10):
+        self.neighbors = neighbors
+        self.freq = freq
+        self.window_size = window_size
+        self.grid = None
+        self.features = None
+        self.last_recomputed = None
+
+    def build(self, df_viol):
+        """完整重建"""
+        self.grid = SlotZoneGrid.from_violations(df_viol, freq=self.freq, zones=self.neighbors.zones)
+        self.features = compute_grid_features(self.grid.counts, self.grid.day_codes,
+                                              self.neighbors, self.window_size)
+        self.last_recomputed = (0, self.grid.n_slots)
+        return self
+
+    def extend(self, end_time):
+        """網格延伸到 end_time 當天結束 (新時段取締數為 0)，供查詢尚無紀錄的時段"""
+        if pd.Timestamp(end_time).ceil('D') <= self.grid.slots[-1].ceil('D'):
+            return self
+        empty = pd.DataFrame({'Datetime': pd.DatetimeIndex([end_time]), 'Zone_ID': self.grid.zones[:1]})
+        return self.update(empty, counted=False)
+
+    def update(self, df_new, counted=True):
+        """附加新紀錄 (需已有 Datetime / Zone_ID 欄位)，只重算受影響的時段；counted=False 時只延伸網格"""
+        if self.grid is None:
+            return self.build(df_new)
+        if df_new.empty:
+            return self
+        unknown = set(df_new['Zone_ID']) - set(self.grid.zones.tolist())
+        if unknown:
+            raise ValueError(f"新資料含有未知區域 {sorted(unknown)}，請重新 build")
+        if df_new['Datetime'].min() < self.grid.slots[0].floor('D'):
+            raise ValueError("新資料早於網格起點，請重新 build")
+
+        # 1. 延伸網格並加入新取締數
+        old_n = self.grid.n_slots
+        end_time = max(self.grid.slots[-1].ceil('D'), df_new['Datetime'].max().ceil('D'))
+        slots = enforcement_slots(self.grid.slots[0].floor('D'), end_time, self.freq)
+        counts = np.zeros((len(slots), self.grid.n_zones), dtype=self.grid.counts.dtype)
+        counts[:old_n] = self.grid.counts
+        slot_pos = slots.get_indexer(df_new['Datetime'].dt.floor(self.freq))
+        zone_pos = pd.Index(self.grid.zones).get_indexer(df_new['Zone_ID'])
+        keep = (slot_pos >= 0) & counted
+        np.add.at(counts, (slot_pos[keep], zone_pos[keep]), 1)
+        self.grid = SlotZoneGrid(slots, self.grid.zones, counts)
+
+        # 2. 決定重算範圍
+        first_changed = min(slot_pos[keep].min(), old_n) if keep.any() else old_n
+        out_start = max(0, int(first_changed) - self.window_size + 1)
+        day_codes = self.grid.day_codes
+        warm_start = max(0, out_start - HISTORY_WARMUP)
+        in_start = int(np.searchsorted(day_codes, day_codes[warm_start]))
+
+        # 3. 只對 [in_start, 結尾) 計算，寫回 [out_start, 結尾)
+        partial = compute_grid_features(counts[in_start:], day_codes[in_start:],
+                                        self.neighbors, self.window_size)
+        for name, values in partial.items():
+            full = np.zeros((len(slots),) + values.shape[1:], dtype=values.dtype)
+            full[:old_n] = self.features[name][:old_n]
+            full[out_start:] = values[out_start - in_start:]
+            self.features[name] = full
+        self.last_recomputed = (out_start, len(slots))
+        return self
+
+    def to_long(self):
+        return self.grid.to_long(self.features)
+
+
+# ==========================================
+# 4. 驗證：增量結果 = 完整重建
+# ==========================================
+def _load_neighbors(data_dir):
+    df_coords = pd.read_csv(f'{data_dir}/unique_locations.csv', encoding='utf-8-sig')
+    df_rules = pd.read_csv(f'{data_dir}/location_rules.csv', encoding='utf-8-sig')
+    zones = np.sort(df_rules['Zone_ID'].unique())
+    graph = NeighborGraph.knn(zones, zone_centroids(df_coords, df_rules, zones), k=5)
+    loc_to_zone = df_rules.set_index('Original_Location')['Zone_ID'].to_dict()
+    return graph, loc_to_zone
+
+
+def verify(raw_path='../rawdata/violate.csv', data_dir='../data_after_process', n_batches=4):
+    """把原始檔切成由舊到新的幾批依序匯入，確認儲存區與特徵都和一次完整匯入相同"""
+    neighbors, loc_to_zone = _load_neighbors(data_dir)
+    # 以位元組切割，避免重新編碼改變無法解碼的字元
+    with open(raw_path, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    header, body = lines[0], lines[1:]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # 完整匯入
+        full_store = ViolationStore(os.path.join(tmp_dir, 'full'))
+        full_store.ingest(raw_path)
+        df_full = prepare_violations(full_store.load(), loc_to_zone)
+        full = IncrementalFeatures(neighbors).build(df_full)
+
+        # 分批匯入：每次模擬原始檔多了最新的一段 (檔案由新到舊，新資料在前面)
+        inc_store = ViolationStore(os.path.join(tmp_dir, 'incremental'))
+        inc = IncrementalFeatures(neighbors)
+        cuts = np.linspace(len(body), 0, n_batches + 1).astype(int)[1:]
+        for cut in cuts:
+            snapshot = os.path.join(tmp_dir, 'violate_snapshot.csv')
+            with open(snapshot, 'wb') as f:
+                f.writelines([header] + body[cut:])
+            df_batch = prepare_violations(inc_store.ingest(snapshot), loc_to_zone)
+            if not df_batch.empty:
+                inc.update(df_batch)
+            print(f"   批次: 新增 {len(df_batch):>6} 筆，重算時段 {inc.last_recomputed}")
+
+        stored_full = full_store.load().sort_values(SERIAL_COL).reset_index(drop=True)
+        stored_inc = inc_store.load().sort_values(SERIAL_COL).reset_index(drop=True)
+        pd.testing.assert_frame_equal(stored_inc, stored_full)
+
+        assert inc.grid.slots.equals(full.grid.slots)
+        assert np.array_equal(inc.grid.counts, full.grid.counts)
+        for name, values in full.features.items():
+            assert np.allclose(inc.features[name], values, rtol=0, atol=1e-9), name
+        print(f"✅ 增量結果與完整重建一致 ({len(stored_full)} 筆紀錄, {len(full.features)} 個特徵)")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="增量匯入 violate.csv")
+    parser.add_argument('--raw', default='../rawdata/violate.csv')
+    parser.add_argument('--store', default='../data_after_process/violation_store')
+    parser.add_argument('--verify', action='store_true', help="驗證增量匯入與完整重建結果一致")
+    args = parser.parse_args()
+
+    if args.verify:
+        verify(args.raw)
+    else:
+        store = ViolationStore(args.store)
+        df_new = store.ingest(args.raw)
+        print(f"新增 {len(df_new)} 筆，累計 {store.state['n_rows']} 筆，水位: {store.state['high_water']}")
@@ -6,7 +6,13 @@ import seaborn as sns
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import itertools
+import joblib
 import os
+import shutil
+import time
 import warnings
 
 # ==========================================
@@ -18,11 +24,218 @@ if not os.path.exists(cache_dir):
     os.makedirs(cache_dir)
 fastf1.Cache.enable_cache(cache_dir)
 
+# 每站抽出的進站特徵另存成 parquet，第二次執行不必再由 FastF1 反序列化整場比賽
+# 抽取方式改變時調高版本，舊快取自然失效
+FEATURE_CACHE_DIR = os.path.join(cache_dir, 'pit_features')
+FEATURE_VERSION = 4
+# 快取中保留進站後第 1~5 圈的名次，改變判斷成功的圈數 (after_lap) 不必重新抽取
+AFTER_LAPS = (1, 2, 3, 4, 5)
+# 每次進站保留進站前一圈的天氣，模型可選用其中任意欄位 (weather_features)
+WEATHER_COLUMNS = ['TrackTemp', 'AirTemp', 'Humidity', 'Rainfall', 'WindSpeed']
+PIT_COLUMNS = ['Driver', 'LapNumber'] + WEATHER_COLUMNS + ['TyreAge', 'PitDuration', 'PosBefore'] + \
+              [f'PosAfter_{k}' for k in AFTER_LAPS]
+
+# ==========================================
+# 2. 單站進站特徵 (可在子行程執行)
+# ==========================================
+class LapLookup:
+    """(車手, 圈數) -> 圈資料的列位置 (同一鍵有多列時取第一列)；鍵編成整數 車手代碼 * 1000 + 圈數"""
+
+    def __init__(self, laps):
+        codes, self.drivers = pd.factorize(laps['Driver'])
+        keys = pd.Index(codes * 1000 + laps['LapNumber'].to_numpy(dtype=float))
+        first = ~keys.duplicated()
+        self.index = keys[first]
+        self.rows = np.flatnonzero(first)
+
+    def find(self, drivers, lap_numbers):
+        """找不到的鍵為 -1"""
+        codes = self.drivers.get_indexer(drivers)
+        pos = self.index.get_indexer(np.where(codes >= 0, codes * 1000 + lap_numbers, -1.0))
+        return np.where(pos >= 0, self.rows[pos], -1)
+
+
+def pit_features(laps, pit_stops, before=1):
+    """
+    每次進站一列 (進站前 before 圈在 laps 中找不到則略過)：
+    Driver, LapNumber, 天氣 (WEATHER_COLUMNS), TyreAge, PitDuration, PosBefore, PosAfter_1 ~ PosAfter_5
+    PosAfter_k：進站後第 k 圈的名次；該圈不在 laps 中為 NaN，該圈沒有名次為 inf (比較時視為掉名次)
+    """
+    lookup = LapLookup(laps)
+    drivers = pit_stops['Driver'].to_numpy()
+    stop_laps = pit_stops['LapNumber'].to_numpy(dtype=float)
+    prev = lookup.find(drivers, stop_laps - before)
+    found = prev >= 0
+    drivers, stop_laps, prev = drivers[found], stop_laps[found], prev[found]
+    stops = pit_stops[found]
+
+    # 保底值同原本：TrackTemp 35°C、TyreAge 15 圈、沒有 PitDuration 欄位時 25 秒
+    rows = pd.DataFrame({'Driver': drivers, 'LapNumber': stop_laps.astype(int)})
+    for col in WEATHER_COLUMNS:
+        rows[col] = laps[col].to_numpy(dtype=float)[prev] if col in laps.columns else np.nan
+    rows['TrackTemp'] = rows['TrackTemp'].fillna(35.0)
+    rows['TyreAge'] = stops['TyreLife'].fillna(15).to_numpy()
+    if 'PitDuration' in stops.columns:
+        rows['PitDuration'] = stops['PitDuration'].dt.total_seconds().to_numpy()
+    else:
+        rows['PitDuration'] = 25.0
+    position = laps['Position'].to_numpy(dtype=float)
+    rows['PosBefore'] = position[prev]
+    for k in AFTER_LAPS:
+        post = lookup.find(drivers, stop_laps + k)
+        rows[f'PosAfter_{k}'] = np.where(post >= 0, np.nan_to_num(position[post], nan=np.inf), np.nan)
+    return rows
+
+
+def success_label(rows, after=3):
+    """只保留進站後第 after 圈存在的進站，IsSuccess = 排名沒有掉 (或提升)"""
+    pos_after = rows[f'PosAfter_{after}']
+    rows = rows[pos_after.notna()].copy()
+    rows['IsSuccess'] = (pos_after[rows.index] <= rows['PosBefore']).astype(int)
+    return rows
+
+
+def attach_weather(laps, weather, columns=WEATHER_COLUMNS):
+    """
+    每圈接上圈開始時 (LapStartTime) 當下或之前最近的一筆天氣 (as-of join)
+    天氣依 Time 排序後以 searchsorted 一次對齊整場所有車手的圈；第一筆天氣之前開始的圈取第一筆，
+    沒有 LapStartTime 的圈為 NaN
+    """
+    weather = weather.sort_values('Time')
+    sample_times = weather['Time'].to_numpy(dtype='timedelta64[ns]')
+    lap_starts = laps['LapStartTime'].to_numpy(dtype='timedelta64[ns]')
+    pos = np.clip(np.searchsorted(sample_times, lap_starts, side='right') - 1, 0, None)
+    valid = ~np.isnat(lap_starts)
+    laps = laps.copy()
+    for col in columns:
+        if col in weather.columns:
+            laps[col] = np.where(valid, weather[col].to_numpy(dtype=float)[pos], np.nan)
+    return laps
+
+
+def extract_pit_features(session, before=1):
+    """由已載入的 session 抽出進站特徵 (見 pit_features)"""
+    # 1. 將 FastF1 內建天氣數據對齊到每一圈 (解決 NONE 問題)
+    laps = session.laps.reset_index(drop=True)
+    weather_data = session.weather_data
+    if weather_data is not None and not weather_data.empty:
+        laps = attach_weather(laps, weather_data)
+    else:
+        print(f"   ⚠️ 警告: {session.event['EventName']} 無法獲取內建天氣，使用預設值")
+        laps['TrackTemp'] = 35.0
+
+    # 只保留綠旗
+    laps = laps[laps['TrackStatus'] == '1']
+
+    pit_stops = session.laps[~pd.isna(session.laps['PitInTime'])]
+    return pit_features(laps, pit_stops, before)
+
+
+def race_cache_path(year, gp, before=1):
+    name = f"{year}_{gp.replace(' ', '_')}_before{before}.parquet"
+    return os.path.join(FEATURE_CACHE_DIR, f"v{FEATURE_VERSION}", name)
+
+
+def match_event(schedule, gp):
+    """
+    在賽程表 (fastf1.get_event_schedule) 中找出 gp 對應的分站，回傳該列或 None
+    先比對 EventName (如 'Italian' -> Italian Grand Prix)，找不到再比對 Country (如 'Spain')
+    不用 fastf1.get_session 的模糊比對：該年沒有的分站會被對到別場比賽 (如 2022 的 Las Vegas)
+    對到多站 (同國多場) 時也視為找不到，避免誤載
+    """
+    key = gp.casefold()
+    names = schedule['EventName'].str.casefold()
+    hits = schedule[names.str.contains(key, regex=False)]
+    if hits.empty:
+        hits = schedule[schedule['Country'].str.casefold() == key]
+    return hits.iloc[0] if len(hits) == 1 else None
+
+
+def load_race(year, gp, before=1):
+    """載入單站 (FastF1 cache) 並抽出進站特徵，寫入特徵快取；回傳 (year, gp, 特徵表或 None, 錯誤訊息, 秒數)"""
+    t0 = time.perf_counter()
+    try:
+        event = match_event(fastf1.get_event_schedule(year, include_testing=False), gp)
+        if event is None:
+            return year, gp, None, f"{year} 賽季沒有這一站", time.perf_counter() - t0
+        session = fastf1.get_session(year, int(event['RoundNumber']), 'R')
+        session.load(telemetry=False, messages=False)
+        rows = extract_pit_features(session, before)
+    except Exception as e:
+        return year, gp, None, str(e), time.perf_counter() - t0
+
+    path = race_cache_path(year, gp, before)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    rows.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return year, gp, rows, None, time.perf_counter() - t0
+
+
+def load_seasons(years, races, before=1, workers=None, refresh=False):
+    """
+    載入多個賽季的進站特徵 (加上 Year、GP 欄位)
+    已有特徵快取的站直接讀 parquet；其餘各站互相獨立，以多個行程平行載入
+    refresh=True 時忽略特徵快取 (FastF1 本身的 cache 仍會使用)
+    """
+    t0 = time.perf_counter()
+    jobs = [(year, gp) for year in years for gp in races]
+    results, pending = {}, []
+    for year, gp in jobs:
+        path = race_cache_path(year, gp, before)
+        if not refresh and os.path.exists(path):
+            results[(year, gp)] = pd.read_parquet(path)
+        else:
+            pending.append((year, gp))
+
+    def collect(year, gp, rows, error, seconds):
+        if rows is None:
+            print(f"   ⚠️ 跳過 {year} {gp}: {error}")
+            return
+        print(f"   📍 {year} {gp}: {len(rows)} 次進站 ({seconds:.1f}s)")
+        results[(year, gp)] = rows
+
+    workers = min(workers or os.cpu_count(), len(pending)) if pending else 0
+    if workers == 1:
+        for year, gp in pending:
+            collect(*load_race(year, gp, before))
+    elif workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(load_race, year, gp, before) for year, gp in pending]
+            for future in as_completed(futures):
+                collect(*future.result())
+
+    frames = [results[(year, gp)].assign(Year=year, GP=gp) for year, gp in jobs if (year, gp) in results]
+    print(f"⏱️ {len(results)}/{len(jobs)} 站完成 (特徵快取 {len(jobs) - len(pending)} 站，"
+          f"FastF1 載入 {len(pending)} 站，{workers} 個行程)，耗時 {time.perf_counter() - t0:.1f}s")
+    if not frames:
+        return pd.DataFrame(columns=PIT_COLUMNS + ['Year', 'GP'])
+    return pd.concat(frames, ignore_index=True)
+
+
+# ==========================================
+# 3. 模型
+# ==========================================
+BASE_FEATURES = ['Degradation', 'TyreAge', 'PitDuration', 'PosBefore']
+# 訓練好的模型連同特徵順序 / 預設值一起存檔，情境推估 (predict_surface) 不必重建資料集與重新訓練
+MODEL_PATH = 'strategy_gain_model.joblib'
+# 情境網格每次 predict_proba 最多的列數 (超過時分批，限制特徵矩陣的記憶體)
+SCENARIO_CHUNK_ROWS = 2_000_000
+
+
 class StrategyGainPredictor:
-    def __init__(self, year=2023):
+    def __init__(self, year=2023, years=None, before_lap=1, after_lap=3, weather_features=('TrackTemp',)):
         self.year = year
+        self.years = list(years) if years else [year]
+        # 模型使用的天氣欄位 (WEATHER_COLUMNS 的子集)
+        self.weather_features = list(weather_features)
+        # 以進站前 before_lap 圈的名次為基準，比較進站後第 after_lap 圈的名次
+        self.before_lap = before_lap
+        self.after_lap = after_lap
+        self.stops = None
         self.dataset = None
         self.model = None
+        self.schema = None
         
         # === 輔助資料集 (Supplementary Dataset) [cite: 12] ===
         # 這是我們手動引入的"外部資料"，用來增強模型
@@ -47,89 +260,19 @@ class StrategyGainPredictor:
             'Las Vegas': {'Degradation': 3, 'Type': 'Street'}
         }
 
-    def build_dataset(self):
-        print(f"🚀 開始構建 {self.year} 賽季資料集 (FastF1 + Circuit Info)...")
-        
+    def build_dataset(self, workers=None, refresh=False):
+        seasons = ', '.join(str(y) for y in self.years)
+        print(f"🚀 開始構建 {seasons} 賽季資料集 (FastF1 + Circuit Info)...")
+
         target_races = list(self.circuit_info.keys())
-        all_data = []
-
-        for gp in target_races:
-            print(f"\n📍 分析賽站: {gp}")
-            try:
-                # 載入數據 (開啟 weather=True)
-                session = fastf1.get_session(self.year, gp, 'R')
-                session.load(telemetry=False, messages=False)
-                
-                # 1. 獲取 FastF1 內建天氣數據 (解決 NONE 問題)
-                laps = session.laps
-                # 將天氣數據合併到每一圈
-                weather_data = laps.get_weather_data()
-                laps = laps.reset_index(drop=True)
-                # 這裡我們只取需要的欄位合併
-                if not weather_data.empty:
-                    weather_cols = weather_data[['TrackTemp', 'AirTemp', 'Humidity']]
-                    laps = pd.concat([laps, weather_cols], axis=1)
-                else:
-                    print(f"   ⚠️ 警告: {gp} 無法獲取內建天氣，使用預設值")
-                    laps['TrackTemp'] = 35.0
-                
-                # 只保留綠旗
-                laps = laps[laps['TrackStatus'] == '1']
-                
-                # 2. 獲取輔助資料 (Supplementary Data Integration)
-                deg_level = self.circuit_info[gp]['Degradation']
-                is_street = 1 if 'Street' in self.circuit_info[gp]['Type'] else 0
-                
-                pit_stops = session.laps[~pd.isna(session.laps['PitInTime'])]
-                
-                print(f"   🏎️ 掃描 {len(pit_stops)} 次進站...")
-                
-                for i, stop in pit_stops.iterrows():
-                    driver = stop['Driver']
-                    stop_lap = int(stop['LapNumber'])
-                    
-                    # 取得進站"前一圈"數據
-                    prev_lap_data = laps[(laps['Driver'] == driver) & (laps['LapNumber'] == stop_lap - 1)]
-                    if prev_lap_data.empty: continue
-                    
-                    # 取得進站"後三圈"數據
-                    post_lap_data = laps[(laps['Driver'] == driver) & (laps['LapNumber'] == stop_lap + 3)]
-                    if post_lap_data.empty: continue
-                    
-                    # === 提取特徵 ===
-                    # 關鍵修正：確保 TrackTemp 是數值
-                    track_temp = prev_lap_data['TrackTemp'].iloc[0]
-                    if pd.isna(track_temp): track_temp = 35.0 # 最終保底
-                    
-                    pos_before = prev_lap_data['Position'].iloc[0]
-                    pos_after = post_lap_data['Position'].iloc[0]
-                    tyre_age = stop['TyreLife']
-                    if pd.isna(tyre_age): tyre_age = 15
-                    
-                    try:
-                        pit_duration = stop['PitDuration'].total_seconds()
-                    except:
-                        pit_duration = 25.0
-                    
-                    # Target: 排名沒有掉 (或提升)
-                    is_success = 1 if pos_after <= pos_before else 0
-                    
-                    all_data.append({
-                        'TrackTemp': float(track_temp), # 確保是 float
-                        'Degradation': deg_level,       # Supp Data
-                        'IsStreet': is_street,          # Supp Data
-                        'TyreAge': tyre_age,
-                        'PitDuration': pit_duration,
-                        'PosBefore': pos_before,
-                        'IsSuccess': is_success
-                    })
-                    
-            except Exception as e:
-                print(f"   ⚠️ 跳過此站: {e}")
-                continue
-                
-        self.dataset = pd.DataFrame(all_data)
-        
+        data = load_seasons(self.years, target_races, self.before_lap, workers=workers, refresh=refresh)
+
+        # 獲取輔助資料 (Supplementary Data Integration)
+        data['Degradation'] = data['GP'].map(lambda gp: self.circuit_info[gp]['Degradation'])
+        data['IsStreet'] = data['GP'].map(lambda gp: 1 if 'Street' in self.circuit_info[gp]['Type'] else 0)
+        self.stops = data
+        self.dataset = success_label(data, self.after_lap)[self.dataset_columns()]
+
         # 去除極端異常值
         self.dataset = self.dataset.dropna()
         
@@ -141,13 +284,29 @@ class StrategyGainPredictor:
         else:
             print("❌ 錯誤：沒有數據。")
 
-    def train_model(self):
+    def dataset_columns(self):
+        weather = ['TrackTemp'] + [c for c in self.weather_features if c != 'TrackTemp']
+        return weather + ['Degradation', 'IsStreet', 'TyreAge', 'PitDuration', 'PosBefore', 'IsSuccess', 'Year', 'GP']
+
+    def sweep_after_laps(self):
+        """以同一份進站資料比較不同 after_lap 的樣本數與成功率 (不重新抽取)"""
+        if self.stops is None or self.stops.empty: return
+        print("\n🔁 進站後第 k 圈判斷成功:")
+        for k in AFTER_LAPS:
+            rows = success_label(self.stops, k)[self.dataset_columns()].dropna()
+            print(f"   +{k} 圈: {len(rows):5d} 筆，成功率 {rows['IsSuccess'].mean():.2%}")
+
+    def feature_names(self):
+        return self.weather_features + BASE_FEATURES
+
+    def train_model(self, model_path=MODEL_PATH, plot=True):
+        """訓練並評估模型；model_path 不為 None 時連同特徵結構存檔 (見 save_model)"""
         if self.dataset is None or self.dataset.empty: return
         
         print("\n🤖 訓練模型 (Balanced Random Forest)...")
         
         # 特徵工程
-        X = self.dataset[['TrackTemp', 'Degradation', 'TyreAge', 'PitDuration', 'PosBefore']]
+        X = self.dataset[self.feature_names()]
         y = self.dataset['IsSuccess']
         
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
@@ -163,8 +322,86 @@ class StrategyGainPredictor:
         print(f"🏆 模型準確率 (Accuracy): {accuracy_score(y_test, y_pred):.2%}")
         print("\n📊 分類報告 (注意 Class 1 的 Recall 是否提升):")
         print(classification_report(y_test, y_pred))
-        
-        self.plot_results()
+
+        # 特徵結構：欄位順序、未指定時的預設值 (訓練資料中位數) 與範圍，供情境推估使用
+        self.schema = {
+            'features': self.feature_names(),
+            'defaults': {name: float(X[name].median()) for name in X.columns},
+            'ranges': {name: (float(X[name].min()), float(X[name].max())) for name in X.columns},
+            'years': self.years, 'before_lap': self.before_lap, 'after_lap': self.after_lap,
+            'n_samples': len(X),
+        }
+        if model_path:
+            self.save_model(model_path)
+        if plot:
+            self.plot_results()
+
+    # ---------- 模型存檔 ----------
+    def save_model(self, path=MODEL_PATH):
+        """模型與特徵結構存成同一個 joblib 檔 (先寫暫存檔再改名，避免留下寫到一半的檔案)"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        joblib.dump({'model': self.model, 'schema': self.schema}, tmp_path)
+        os.replace(tmp_path, path)
+        print(f"💾 模型已存檔: {path}")
+
+    @classmethod
+    def load_model(cls, path=MODEL_PATH):
+        """由存檔建立只含模型的 predictor (不載入 FastF1 資料)"""
+        saved = joblib.load(path)
+        schema = saved['schema']
+        trained = list(getattr(saved['model'], 'feature_names_in_', schema['features']))
+        if trained != schema['features']:
+            raise ValueError(f"模型的特徵 {trained} 與存檔的特徵結構 {schema['features']} 不符")
+        weather = [name for name in schema['features'] if name not in BASE_FEATURES]
+        predictor = cls(years=schema['years'], before_lap=schema['before_lap'], after_lap=schema['after_lap'],
+                        weather_features=weather)
+        predictor.model, predictor.schema = saved['model'], schema
+        return predictor
+
+    # ---------- 情境推估 ----------
+    def scenario_axes(self, **scenario):
+        """
+        拆出情境的網格軸：值為序列 (list / range / ndarray) 的特徵成為一個軸，純量為固定值
+        回傳 (軸 {特徵: 值陣列}, 每個特徵的固定值)；未指定的特徵取訓練資料的中位數
+        """
+        features = self.schema['features']
+        unknown = set(scenario) - set(features)
+        if unknown:
+            raise ValueError(f"未知的特徵 {sorted(unknown)}，模型特徵為 {features}")
+        axes, fixed = {}, dict(self.schema['defaults'])
+        for name, values in scenario.items():
+            if np.ndim(values) == 0:
+                fixed[name] = float(values)
+            else:
+                axes[name] = np.asarray(values, dtype=np.float32).ravel()
+        return axes, fixed
+
+    def predict_surface(self, n_jobs=-1, chunk_rows=SCENARIO_CHUNK_ROWS, **scenario):
+        """
+        情境網格 (各軸的笛卡兒積) 的成功機率，例如
+        predict_surface(TyreAge=range(10, 41), TrackTemp=range(25, 56), Degradation=1)
+        整個網格組成一個特徵矩陣，以一次平行 (n_jobs) predict_proba 評分 (超過 chunk_rows 列時分批)
+        回傳 (機率陣列，形狀依軸的順序, 軸 {特徵: 值陣列})
+        """
+        if self.model is None:
+            raise ValueError("尚未訓練或載入模型")
+        axes, fixed = self.scenario_axes(**scenario)
+        shape = tuple(len(values) for values in axes.values())
+        n_rows = int(np.prod(shape))
+        positive = int(np.flatnonzero(self.model.classes_ == 1)[0])
+        self.model.set_params(n_jobs=n_jobs)
+
+        proba = np.empty(n_rows)
+        axis_of = {name: k for k, name in enumerate(axes)}
+        # RandomForest 內部以 float32 評分，直接建 float32 矩陣省去轉型複製
+        for start in range(0, n_rows, chunk_rows):
+            stop = min(start + chunk_rows, n_rows)
+            idx = np.unravel_index(np.arange(start, stop), shape) if shape else ()
+            X = np.empty((stop - start, len(self.schema['features'])), dtype=np.float32)
+            for j, name in enumerate(self.schema['features']):
+                X[:, j] = axes[name][idx[axis_of[name]]] if name in axes else fixed[name]
+            proba[start:stop] = self.model.predict_proba(X)[:, positive]
+        return proba.reshape(shape), axes
 
     def plot_results(self):
         # 畫圖：溫度對成功率的影響
@@ -190,8 +427,329 @@ class StrategyGainPredictor:
         plt.show()
         print("💡 圖表已生成。紅色曲線若上升，代表高溫有利於進站策略(因對手衰退快)。")
 
+def benchmark(years, workers=None):
+    """特徵快取為空 (依序 / 平行載入 FastF1) vs 特徵快取已建立"""
+    races = list(StrategyGainPredictor().circuit_info.keys())
+    timings = {}
+    for label, n_workers in (('冷快取，依序', 1), ('冷快取，平行', workers or os.cpu_count())):
+        shutil.rmtree(FEATURE_CACHE_DIR, ignore_errors=True)
+        t0 = time.perf_counter()
+        load_seasons(years, races, workers=n_workers)
+        timings[label] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    data = load_seasons(years, races, workers=workers)
+    timings['熱快取'] = time.perf_counter() - t0
+    print(f"\n📊 {len(data)} 筆進站 ({len(years)} 個賽季 x {len(races)} 站)")
+    for label, seconds in timings.items():
+        print(f"   {label:<8}: {seconds:6.2f}s")
+
+
+# ==========================================
+# 4. 驗證：向量化抽取 = 原本逐次進站的迴圈
+# ==========================================
+def _legacy_pit_features(laps, pit_stops, before=1, after=3):
+    """原本 build_dataset 內的寫法 (每次進站掃描兩次 laps)"""
+    rows = []
+    for i, stop in pit_stops.iterrows():
+        driver = stop['Driver']
+        stop_lap = int(stop['LapNumber'])
+        prev_lap_data = laps[(laps['Driver'] == driver) & (laps['LapNumber'] == stop_lap - before)]
+        if prev_lap_data.empty: continue
+        post_lap_data = laps[(laps['Driver'] == driver) & (laps['LapNumber'] == stop_lap + after)]
+        if post_lap_data.empty: continue
+        track_temp = prev_lap_data['TrackTemp'].iloc[0]
+        if pd.isna(track_temp): track_temp = 35.0
+        pos_before = prev_lap_data['Position'].iloc[0]
+        pos_after = post_lap_data['Position'].iloc[0]
+        tyre_age = stop['TyreLife']
+        if pd.isna(tyre_age): tyre_age = 15
+        try:
+            pit_duration = stop['PitDuration'].total_seconds()
+        except:
+            pit_duration = 25.0
+        rows.append({'TrackTemp': float(track_temp), 'TyreAge': tyre_age, 'PitDuration': pit_duration,
+                     'PosBefore': pos_before, 'IsSuccess': 1 if pos_after <= pos_before else 0})
+    return pd.DataFrame(rows, columns=['TrackTemp', 'TyreAge', 'PitDuration', 'PosBefore', 'IsSuccess'])
+
+
+def _synthetic_race(n_drivers=20, n_laps=60, seed=0, with_duration=False):
+    """模擬一場比賽的 (綠旗圈, 進站圈)：部分圈非綠旗、部分溫度 / 名次 / 胎齡缺值"""
+    rng = np.random.default_rng(seed)
+    drivers = [f'D{i:02d}' for i in range(n_drivers)]
+    laps = pd.DataFrame({
+        'Driver': np.repeat(drivers, n_laps),
+        'LapNumber': np.tile(np.arange(1, n_laps + 1, dtype=float), n_drivers),
+        'Position': np.concatenate([rng.permutation(n_drivers) + 1.0 for _ in range(n_laps)]).reshape(n_laps, -1).T.ravel(),
+        'TrackTemp': rng.normal(35, 5, n_drivers * n_laps).round(1),
+        'TrackStatus': rng.choice(['1', '1', '1', '1', '4'], n_drivers * n_laps),
+        'TyreLife': rng.integers(1, 30, n_drivers * n_laps).astype(float),
+        'PitInTime': pd.Series(pd.NaT, index=range(n_drivers * n_laps), dtype='timedelta64[ns]'),
+    })
+    # 每圈約 90 秒，車手之間錯開；少數圈沒有 LapStartTime
+    start = (laps['LapNumber'] - 1) * 90 + np.repeat(np.arange(n_drivers) * 0.7, n_laps) + rng.uniform(0, 5, len(laps))
+    laps['LapStartTime'] = pd.to_timedelta(start, unit='s')
+    laps.loc[rng.random(len(laps)) < 0.02, 'LapStartTime'] = pd.NaT
+    for col, frac in (('Position', 0.03), ('TrackTemp', 0.05), ('TyreLife', 0.1)):
+        laps.loc[rng.random(len(laps)) < frac, col] = np.nan
+    stop = rng.random(len(laps)) < 2.5 / n_laps
+    laps.loc[stop, 'PitInTime'] = pd.to_timedelta(rng.uniform(3000, 6000, stop.sum()), unit='s')
+    if with_duration:
+        laps['PitDuration'] = pd.to_timedelta(rng.uniform(20, 30, len(laps)), unit='s')
+        laps.loc[rng.random(len(laps)) < 0.1, 'PitDuration'] = pd.NaT
+    pit_stops = laps[~pd.isna(laps['PitInTime'])]
+    return laps[laps['TrackStatus'] == '1'], pit_stops
+
+
+def _synthetic_weather(n_laps=60, seed=0):
+    """約每 60 秒一筆 (第一筆在第 1 圈開始之後)，順序打亂"""
+    rng = np.random.default_rng(seed)
+    times = np.arange(20, n_laps * 95, 60) + rng.uniform(0, 1, len(np.arange(20, n_laps * 95, 60)))
+    weather = pd.DataFrame({
+        'Time': pd.to_timedelta(times, unit='s'),
+        'AirTemp': rng.normal(25, 2, len(times)).round(1),
+        'Humidity': rng.uniform(20, 80, len(times)).round(),
+        'Pressure': 1013.0,
+        'Rainfall': rng.random(len(times)) < 0.1,
+        'TrackTemp': rng.normal(35, 5, len(times)).round(1),
+        'WindSpeed': rng.uniform(0, 3, len(times)).round(1),
+    })
+    return weather.sample(frac=1, random_state=seed)
+
+
+def _per_lap_weather(laps, weather, columns=WEATHER_COLUMNS):
+    """逐圈掃描天氣表 (對照 attach_weather 用)"""
+    out = []
+    for _, lap in laps.iterrows():
+        if pd.isna(lap['LapStartTime']):
+            out.append({col: np.nan for col in columns})
+            continue
+        before = weather[weather['Time'] <= lap['LapStartTime']]
+        sample = before.loc[before['Time'].idxmax()] if not before.empty else weather.loc[weather['Time'].idxmin()]
+        out.append({col: float(sample[col]) for col in columns})
+    return pd.DataFrame(out, columns=columns, index=laps.index)
+
+
+def verify():
+    for seed in range(3):
+        laps, _ = _synthetic_race(seed=seed, n_drivers=6)
+        weather = _synthetic_weather(seed=seed)
+        got = attach_weather(laps.drop(columns='TrackTemp'), weather)[WEATHER_COLUMNS]
+        pd.testing.assert_frame_equal(got, _per_lap_weather(laps, weather), check_dtype=False)
+    print(f"✅ as-of 天氣對齊與逐圈掃描一致 ({', '.join(WEATHER_COLUMNS)})")
+
+    columns = ['TrackTemp', 'TyreAge', 'PitDuration', 'PosBefore', 'IsSuccess']
+    for seed in range(6):
+        laps, pit_stops = _synthetic_race(seed=seed, with_duration=seed % 2 == 1)
+        for before in (1, 2):
+            rows = pit_features(laps, pit_stops, before)
+            for after in AFTER_LAPS:
+                expected = _legacy_pit_features(laps, pit_stops, before, after)
+                got = success_label(rows, after)[columns].reset_index(drop=True)
+                pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+    print(f"✅ 向量化抽取與原本的迴圈一致 (6 場 x 進站前 1~2 圈 x 進站後 {AFTER_LAPS[0]}~{AFTER_LAPS[-1]} 圈)")
+
+    # 2021 賽季 (節錄)：還沒有 Miami、Las Vegas，美國站只有 Austin
+    schedule = pd.DataFrame({
+        'RoundNumber': [1, 4, 14, 17, 20],
+        'EventName': ['Bahrain Grand Prix', 'Spanish Grand Prix', 'Italian Grand Prix',
+                      'United States Grand Prix', 'Qatar Grand Prix'],
+        'Country': ['Bahrain', 'Spain', 'Italy', 'United States', 'Qatar'],
+    })
+    expected = {'Bahrain': 1, 'Spain': 4, 'Italian': 14, 'United States': 17, 'Qatar': 20,
+                'Miami': None, 'Las Vegas': None, 'Hungary': None}
+    got = {gp: None if (event := match_event(schedule, gp)) is None else int(event['RoundNumber'])
+           for gp in expected}
+    assert got == expected, got
+    print(f"✅ 分站依賽程表比對，該年沒有的站 ({', '.join(gp for gp, r in expected.items() if r is None)}) 跳過")
+
+
+def benchmark_extraction(n_races=16):
+    """一個賽季的進站特徵抽取：原本的迴圈 (只算 +3 圈) vs 向量化 (一次算出 +1~+5 圈)；天氣逐圈對齊 vs as-of"""
+    races = [_synthetic_race(seed=seed) for seed in range(n_races)]
+    t0 = time.perf_counter()
+    for laps, pit_stops in races:
+        _legacy_pit_features(laps, pit_stops)
+    legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for laps, pit_stops in races:
+        pit_features(laps, pit_stops)
+    fast = time.perf_counter() - t0
+    n_stops = sum(len(p) for _, p in races)
+    print(f"{n_races} 站 / {n_stops} 次進站: 迴圈 {legacy:.2f}s，向量化 {fast:.3f}s ({legacy / fast:.0f}x)")
+
+    weathers = [_synthetic_weather(seed=seed) for seed in range(n_races)]
+    t0 = time.perf_counter()
+    for (laps, _), weather in zip(races, weathers):
+        _per_lap_weather(laps, weather)
+    legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for (laps, _), weather in zip(races, weathers):
+        attach_weather(laps, weather)
+    fast = time.perf_counter() - t0
+    n_laps = sum(len(laps) for laps, _ in races)
+    print(f"{n_races} 站 / {n_laps} 圈天氣對齊: 逐圈 {legacy:.2f}s，as-of {fast:.3f}s ({legacy / fast:.0f}x)")
+
+
+# ==========================================
+# 5. 情境推估：驗證與效能測試
+# ==========================================
+def _synthetic_dataset(n=3000, seed=0):
+    """模擬的訓練資料 (欄位同 dataset_columns)：胎齡越大、賽道越耗胎，進站越容易保住名次"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'TrackTemp': rng.normal(38, 8, n).round(1),
+        'Degradation': rng.integers(1, 4, n),
+        'IsStreet': rng.integers(0, 2, n),
+        'TyreAge': rng.integers(1, 45, n).astype(float),
+        'PitDuration': rng.uniform(20, 32, n).round(2),
+        'PosBefore': rng.integers(1, 21, n).astype(float),
+    })
+    logit = 0.05 * (df['TyreAge'] - 20) - 0.5 * (df['Degradation'] - 2) + 0.03 * (df['TrackTemp'] - 38) \
+        - 0.2 * (df['PitDuration'] - 25) + 0.08 * (df['PosBefore'] - 10)
+    df['IsSuccess'] = (rng.random(n) < 1 / (1 + np.exp(-logit))).astype(int)
+    return df.assign(Year=2023, GP='Synthetic')
+
+
+def _trained_on_synthetic(model_path):
+    predictor = StrategyGainPredictor()
+    predictor.dataset = _synthetic_dataset()
+    predictor.train_model(model_path=model_path, plot=False)
+    return predictor
+
+
+def _per_scenario_proba(model, features, defaults, axes):
+    """逐一組出每個情境的一列 DataFrame 再 predict_proba (對照 predict_surface 用)"""
+    out = []
+    for combo in itertools.product(*axes.values()):
+        row = dict(defaults, **dict(zip(axes, combo)))
+        out.append(model.predict_proba(pd.DataFrame([row], columns=features))[0, 1])
+    return np.asarray(out).reshape(tuple(len(v) for v in axes.values()))
+
+
+def verify_scenarios():
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.joblib')
+        trained = _trained_on_synthetic(path)
+        loaded = StrategyGainPredictor.load_model(path)
+    assert loaded.schema == trained.schema and loaded.weather_features == trained.weather_features
+
+    scenario = {'TyreAge': range(10, 41, 6), 'TrackTemp': np.arange(25, 56, 7.5), 'Degradation': 1}
+    surface, axes = loaded.predict_surface(**scenario)
+    assert surface.shape == (6, 5) and list(axes) == ['TyreAge', 'TrackTemp']
+    defaults = dict(loaded.schema['defaults'], Degradation=1)
+    expected = _per_scenario_proba(trained.model, loaded.schema['features'], defaults, axes)
+    assert np.allclose(surface, expected, atol=1e-12)
+    chunked, _ = loaded.predict_surface(chunk_rows=7, n_jobs=1, **scenario)
+    assert np.array_equal(chunked, surface)
+    single, _ = loaded.predict_surface(TyreAge=22, Degradation=1)
+    expected = _per_scenario_proba(trained.model, loaded.schema['features'], dict(defaults, TyreAge=22), {})
+    assert single.shape == () and np.isclose(single, expected)
+    try:
+        loaded.predict_surface(Tyre=range(3))
+        raise AssertionError("未知特徵應該報錯")
+    except ValueError:
+        pass
+    print("✅ 存檔 / 載入後特徵結構一致；情境網格機率與逐情境 predict_proba 相同 (含分批)")
+
+
+def benchmark_scenarios(n_jobs=-1, loop_samples=200):
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.joblib')
+        _trained_on_synthetic(path)
+        predictor = StrategyGainPredictor.load_model(path)
+    scenario = {'TyreAge': np.arange(1, 51), 'TrackTemp': np.arange(20, 60), 'PitDuration': np.arange(20, 30, 0.2),
+                'PosBefore': np.arange(1, 11), 'Degradation': 1}
+    axes, _ = predictor.scenario_axes(**scenario)
+    n_rows = int(np.prod([len(v) for v in axes.values()]))
+
+    sample = {name: values[:1] for name, values in axes.items()}
+    sample['TyreAge'] = axes['TyreAge'][:loop_samples]
+    predictor.model.set_params(n_jobs=n_jobs)
+    t0 = time.perf_counter()
+    _per_scenario_proba(predictor.model, predictor.schema['features'], dict(predictor.schema['defaults'], Degradation=1), sample)
+    per_row = (time.perf_counter() - t0) / len(sample['TyreAge'])
+
+    t0 = time.perf_counter()
+    predictor.predict_surface(n_jobs=n_jobs, **scenario)
+    batch = time.perf_counter() - t0
+    print(f"{n_rows:,} 個情境: 逐情境 predict_proba 約 {per_row * n_rows:,.0f}s (推估)，"
+          f"網格一次評分 {batch:.2f}s ({n_rows / batch:,.0f} 情境/秒)")
+
+
+def parse_scenario(items):
+    """命令列情境：TyreAge=10:40 (含起訖，步長 1)、TrackTemp=25:55:5、PosBefore=1,5,10、Degradation=1"""
+    scenario = {}
+    for item in items:
+        name, _, value = item.partition('=')
+        if ':' in value:
+            parts = [float(v) for v in value.split(':')]
+            start, stop, step = parts if len(parts) == 3 else parts + [1.0]
+            scenario[name] = np.arange(start, stop + step / 2, step)
+        elif ',' in value:
+            scenario[name] = [float(v) for v in value.split(',')]
+        else:
+            scenario[name] = float(value)
+    return scenario
+
+
+def print_surface(surface, axes):
+    if surface.ndim == 2:
+        names = list(axes)
+        table = pd.DataFrame(surface, index=pd.Index(axes[names[0]], name=names[0]),
+                             columns=pd.Index(axes[names[1]], name=names[1]))
+        print(table.round(3).to_string())
+    elif surface.ndim <= 1:
+        print(pd.Series(np.atleast_1d(surface), index=axes[next(iter(axes))] if axes else None).round(3).to_string())
+    else:
+        print(f"{surface.shape} 網格：成功機率 平均 {surface.mean():.3f}，最低 {surface.min():.3f}，最高 {surface.max():.3f}")
+    if axes and surface.size:
+        best = np.unravel_index(np.argmax(surface), surface.shape)
+        combo = ', '.join(f"{name}={values[k]:g}" for (name, values), k in zip(axes.items(), best))
+        print(f"🏁 最高成功機率 {surface.max():.3f}: {combo}")
+
+
 # --- 執行 ---
 if __name__ == "__main__":
-    predictor = StrategyGainPredictor(2023)
-    predictor.build_dataset()
-    predictor.train_model()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="進站策略成功率預測")
+    parser.add_argument('--years', type=int, nargs='+', default=[2023])
+    parser.add_argument('--workers', type=int, default=None, help="平行載入的行程數 (預設為 CPU 核心數)")
+    parser.add_argument('--refresh', action='store_true', help="忽略進站特徵快取，重新由 FastF1 抽取")
+    parser.add_argument('--before-lap', type=int, default=1, help="以進站前第 N 圈的名次為基準")
+    parser.add_argument('--after-lap', type=int, default=3, choices=AFTER_LAPS, help="比較進站後第 N 圈的名次")
+    parser.add_argument('--weather', nargs='+', default=['TrackTemp'], choices=WEATHER_COLUMNS,
+                        help="模型使用的天氣欄位")
+    parser.add_argument('--sweep', action='store_true', help="列出進站後 +1~+5 圈判斷成功的樣本數與成功率")
+    parser.add_argument('--model-path', default=MODEL_PATH, help="訓練後存檔 / 情境推估讀取的模型檔")
+    parser.add_argument('--scenario', nargs='+', default=None, metavar='特徵=值',
+                        help="讀取已存檔的模型推估情境網格，例如 TyreAge=10:40 TrackTemp=25:55:5 Degradation=1")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="情境推估 predict_proba 的平行數")
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--benchmark', action='store_true', help="載入時間 (特徵快取為空 vs 已建立)")
+    parser.add_argument('--benchmark-extract', action='store_true', help="進站特徵抽取時間 (模擬資料)")
+    parser.add_argument('--benchmark-scenario', action='store_true', help="情境網格評分時間 (模擬資料訓練的模型)")
+    args = parser.parse_args()
+
+    if args.verify:
+        verify()
+        verify_scenarios()
+    if args.benchmark_extract:
+        benchmark_extraction()
+    if args.benchmark_scenario:
+        benchmark_scenarios(args.n_jobs)
+    if args.benchmark:
+        benchmark(args.years, args.workers)
+    if args.scenario:
+        predictor = StrategyGainPredictor.load_model(args.model_path)
+        t0 = time.perf_counter()
+        surface, axes = predictor.predict_surface(n_jobs=args.n_jobs, **parse_scenario(args.scenario))
+        print(f"🔮 {surface.size:,} 個情境 ({time.perf_counter() - t0:.2f}s)")
+        print_surface(surface, axes)
+    elif not (args.verify or args.benchmark or args.benchmark_extract or args.benchmark_scenario):
+        predictor = StrategyGainPredictor(years=args.years, before_lap=args.before_lap, after_lap=args.after_lap,
+                                          weather_features=args.weather)
+        predictor.build_dataset(workers=args.workers, refresh=args.refresh)
+        if args.sweep:
+            predictor.sweep_after_laps()
+        predictor.train_model(model_path=args.model_path)
@@ -0,0 +1,278 @@
+"""
+排序評估指標 - 將測試結果一次整理成 (時段 x 區域) 的分數 / 標籤陣列，所有 K 值的指標在同一次向量化運算中算完
+結果與 notebook 原本逐時段 groupby 的版本相同 (nlargest / nsmallest 的同分取前、sklearn ndcg_score 的同分平均)
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_KS = (3, 5, 10)
+
+
+class SlotRanking:
+    """
+    scores / labels: (時段 x 區域) 陣列；valid 標示該時段該區域是否有資料 (測試集可能缺列)
+    區域依 Zone_ID 排序，同分時以區域順序決定先後 (與 groupby 後 nlargest(keep='first') 相同)
+    """
+
+    def __init__(self, slots, zones, scores, labels, valid):
+        self.slots = slots
+        self.zones = zones
+        self.scores = scores
+        self.labels = labels
+        self.valid = valid
+        self.n_valid = valid.sum(axis=1)
+        self.has_event = (np.where(valid, labels, 0) > 0).any(axis=1)
+        self._topk = {}
+
+    @classmethod
+    def from_frame(cls, meta, score_col='risk_score', label_col='label', slot_col='Slot_Start', zone_col='Zone_ID'):
+        """長表 (每列一個 時段 x 區域) -> 陣列，只掃描一次"""
+        slot_codes, slots = pd.factorize(meta[slot_col], sort=True)
+        zone_codes, zones = pd.factorize(meta[zone_col], sort=True)
+        shape = (len(slots), len(zones))
+        scores = np.full(shape, np.nan)
+        labels = np.zeros(shape)
+        valid = np.zeros(shape, dtype=bool)
+        scores[slot_codes, zone_codes] = meta[score_col].values
+        labels[slot_codes, zone_codes] = meta[label_col].values
+        valid[slot_codes, zone_codes] = True
+        return cls(slots, zones, scores, labels, valid)
+
+    # ---------- Top-K / Bottom-K ----------
+    def _select(self, ks, bottom=False):
+        """
+        {k: (時段 x 區域) 布林遮罩}，標示每個時段分數最高 (bottom=True 時最低) 的 k 個區域
+        以 np.partition 一次取得所有 k 的門檻值，等於門檻的同分區域依區域順序補足 k 個
+        """
+        key = np.where(self.valid, -self.scores if not bottom else self.scores, np.inf)
+        n_zones = key.shape[1]
+        kth = [min(k, n_zones) - 1 for k in ks]
+        thresholds = np.partition(key, kth, axis=1)
+        masks = {}
+        for k, j in zip(ks, kth):
+            v = thresholds[:, j:j + 1]
+            better = self.valid & (key < v)
+            tied = self.valid & (key == v)
+            need = k - better.sum(axis=1, keepdims=True)
+            masks[k] = better | (tied & (np.cumsum(tied, axis=1) <= need))
+        return masks
+
+    def top_k(self, ks):
+        missing = [k for k in ks if ('top', k) not in self._topk]
+        if missing:
+            for k, mask in self._select(missing).items():
+                self._topk[('top', k)] = mask
+        return {k: self._topk[('top', k)] for k in ks}
+
+    def bottom_k(self, ks):
+        missing = [k for k in ks if ('bottom', k) not in self._topk]
+        if missing:
+            for k, mask in self._select(missing, bottom=True).items():
+                self._topk[('bottom', k)] = mask
+        return {k: self._topk[('bottom', k)] for k in ks}
+
+    def _hits(self, masks):
+        """{k: 每個時段被選到且有取締的區域數}"""
+        positive = self.valid & (self.labels > 0)
+        return {k: (mask & positive).sum(axis=1) for k, mask in masks.items()}
+
+    # ---------- 指標 ----------
+    def precision_at_k(self, ks=DEFAULT_KS):
+        """有取締的時段中，Top K 命中數 / K 的平均"""
+        hits = self._hits(self.top_k(ks))
+        return {k: _mean(hits[k][self.has_event] / k) for k in ks}
+
+    def hit_rate_at_k(self, ks=DEFAULT_KS):
+        """有取締的時段中，Top K 至少命中一個的比例"""
+        hits = self._hits(self.top_k(ks))
+        return {k: _mean(hits[k][self.has_event] > 0) for k in ks}
+
+    def danger_rate_at_k(self, ks=DEFAULT_KS):
+        """所有時段 Top K 中有取締的比例 (危險率)"""
+        hits = self._hits(self.top_k(ks))
+        return {k: _mean(hits[k] / k) for k in ks}
+
+    def safe_rate_at_k(self, ks=DEFAULT_KS):
+        """所有時段 Bottom K 中沒有取締的比例 (安全率)"""
+        masks = self.bottom_k(ks)
+        safe = self.valid & (self.labels == 0)
+        return {k: _mean((masks[k] & safe).sum(axis=1) / k) for k in ks}
+
+    def ndcg_at_k(self, ks=DEFAULT_KS):
+        """有取締且超過一個區域的時段平均 NDCG@K (同分時平均增益，與 sklearn.metrics.ndcg_score 相同)"""
+        rows = self.has_event & (self.n_valid > 1)
+        scores = np.where(self.valid, self.scores, -np.inf)[rows]
+        gains = np.where(self.valid, self.labels, 0.0)[rows]
+        n_zones = scores.shape[1]
+
+        # 依分數由高到低排序，找出每個同分群組的起訖位置
+        order = np.argsort(-scores, axis=1, kind='stable')
+        s = np.take_along_axis(scores, order, axis=1)
+        g = np.take_along_axis(gains, order, axis=1)
+        pos = np.arange(n_zones)
+        new_group = np.ones(s.shape, dtype=bool)
+        new_group[:, 1:] = s[:, 1:] != s[:, :-1]
+        start = np.maximum.accumulate(np.where(new_group, pos, 0), axis=1)
+        end_group = np.ones(s.shape, dtype=bool)
+        end_group[:, :-1] = new_group[:, 1:]
+        end = np.minimum.accumulate(np.where(end_group, pos + 1, n_zones)[:, ::-1], axis=1)[:, ::-1]
+
+        gain_cum = np.concatenate([np.zeros((len(g), 1)), np.cumsum(g, axis=1)], axis=1)
+        ideal = -np.sort(-gains, axis=1)
+        out = {}
+        for k in ks:
+            discount = np.where(pos < k, 1.0 / np.log2(pos + 2), 0.0)
+            disc_cum = np.concatenate([[0.0], np.cumsum(discount)])
+            # 每個元素分到所屬群組 (平均增益 x 群組位置折扣總和) 的 1 / 群組大小
+            size = end - start
+            group_gain = np.take_along_axis(gain_cum, end, axis=1) - np.take_along_axis(gain_cum, start, axis=1)
+            dcg = (group_gain * (disc_cum[end] - disc_cum[start]) / size ** 2).sum(axis=1)
+            idcg = (ideal * discount).sum(axis=1)
+            ndcg = np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0)
+            out[k] = _mean(ndcg)
+        return out
+
+    def spearman_per_slot(self, min_zones=5):
+        """
+        每個時段 (區域數 > min_zones 且有取締) 分數與標籤的 Spearman ρ (平均名次的 Pearson 相關)
+        標籤全部相同的時段相關係數無定義，不列入 (回傳 NaN)
+        """
+        rows = self.has_event & (self.n_valid > min_zones)
+        valid = self.valid[rows]
+        rx = _average_ranks(np.where(valid, self.scores[rows], np.nan))
+        ry = _average_ranks(np.where(valid, self.labels[rows], np.nan))
+        n = valid.sum(axis=1)
+        rx = np.where(valid, rx - np.nansum(rx, axis=1, keepdims=True) / n[:, None], 0.0)
+        ry = np.where(valid, ry - np.nansum(ry, axis=1, keepdims=True) / n[:, None], 0.0)
+        denom = np.sqrt((rx ** 2).sum(axis=1) * (ry ** 2).sum(axis=1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rho = np.where(denom > 0, (rx * ry).sum(axis=1) / denom, np.nan)
+        out = np.full(len(self.slots), np.nan)
+        out[rows] = np.clip(rho, -1.0, 1.0)
+        return pd.Series(out, index=self.slots, name='spearman')
+
+    # ---------- 總表 ----------
+    def report(self, ks=DEFAULT_KS):
+        """整理成長表：metric, k, value (spearman / 時段統計的 k 為 NaN)"""
+        rows = []
+        for metric, values in (('precision', self.precision_at_k(ks)),
+                               ('hit_rate', self.hit_rate_at_k(ks)),
+                               ('ndcg', self.ndcg_at_k(ks)),
+                               ('top_danger_rate', self.danger_rate_at_k(ks)),
+                               ('bottom_safe_rate', self.safe_rate_at_k(ks))):
+            rows += [(metric, k, v) for k, v in values.items()]
+        rho = self.spearman_per_slot().dropna()
+        rows += [('spearman', np.nan, rho.mean() if len(rho) else 0.0),
+                 ('n_slots', np.nan, float(len(self.slots))),
+                 ('n_active_slots', np.nan, float(self.has_event.sum()))]
+        report = pd.DataFrame(rows, columns=['metric', 'k', 'value'])
+        report['k'] = report['k'].astype('Int64')
+        return report
+
+
+def _mean(values):
+    return float(np.mean(values)) if len(values) else 0.0
+
+
+def _average_ranks(values):
+    """每列的平均名次 (1 起算，同分取平均，NaN 保持 NaN)，等同逐列 scipy.stats.rankdata"""
+    n_rows, n_cols = values.shape
+    order = np.argsort(values, axis=1, kind='stable')
+    s = np.take_along_axis(values, order, axis=1)
+    pos = np.arange(n_cols)
+    new_group = np.ones(s.shape, dtype=bool)
+    new_group[:, 1:] = s[:, 1:] != s[:, :-1]
+    start = np.maximum.accumulate(np.where(new_group, pos, 0), axis=1)
+    end_group = np.ones(s.shape, dtype=bool)
+    end_group[:, :-1] = new_group[:, 1:]
+    end = np.minimum.accumulate(np.where(end_group, pos, n_cols - 1)[:, ::-1], axis=1)[:, ::-1]
+    ranks_sorted = (start + end) / 2 + 1
+    ranks = np.empty_like(ranks_sorted)
+    np.put_along_axis(ranks, order, ranks_sorted, axis=1)
+    return np.where(np.isnan(values), np.nan, ranks)
+
+
+def ranking_report(meta, ks=DEFAULT_KS, score_col='risk_score', label_col='label'):
+    """meta_test (Slot_Start, Zone_ID, label, risk_score) -> 指標長表"""
+    return SlotRanking.from_frame(meta, score_col, label_col).report(ks)
+
+
+# ==========================================
+# 驗證與效能測試 (與 notebook 原本的逐時段 groupby 版本比較)
+# ==========================================
+def _legacy_metrics(df_res, ks):
+    from scipy.stats import spearmanr
+    from sklearn.metrics import ndcg_score
+
+    out = {}
+    groups = [g for _, g in df_res.groupby('Slot_Start')]
+    for k in ks:
+        active = [g for g in groups if g['label'].sum() > 0]
+        out[('precision', k)] = np.mean([(g.nlargest(k, 'risk_score')['label'] > 0).sum() / k for g in active])
+        out[('hit_rate', k)] = np.mean([(g.nlargest(k, 'risk_score')['label'] > 0).any() for g in active])
+        out[('ndcg', k)] = np.mean([ndcg_score(g['label'].values.reshape(1, -1), g['risk_score'].values.reshape(1, -1),
+                                               k=k) for g in active if len(g) > 1])
+        out[('top_danger_rate', k)] = np.mean([(g.nlargest(k, 'risk_score')['label'] > 0).sum() / k for g in groups])
+        out[('bottom_safe_rate', k)] = np.mean([(g.nsmallest(k, 'risk_score')['label'] == 0).sum() / k
+                                                for g in groups])
+    correlations = []
+    for g in groups:
+        if len(g) > 5 and g['label'].sum() > 0:
+            corr, _ = spearmanr(g['risk_score'].rank(ascending=False), g['label'].rank(ascending=False))
+            if not np.isnan(corr):
+                correlations.append(corr)
+    out[('spearman', None)] = np.mean(correlations)
+    return out
+
+
+def _synthetic_meta(n_slots, n_zones, seed=0, missing=0.03):
+    """含同分 (分數四捨五入) 與缺列的測試結果"""
+    rng = np.random.default_rng(seed)
+    slots = pd.date_range('2025-01-01 09:00', periods=n_slots, freq='15min')
+    meta = pd.DataFrame({
+        'Slot_Start': np.repeat(slots, n_zones),
+        'Zone_ID': np.tile(np.arange(1, n_zones + 1), n_slots),
+    })
+    risk = rng.beta(0.5, 4, len(meta))
+    meta['risk_score'] = np.round(risk, 2)
+    meta['label'] = rng.poisson(risk * 2) * (rng.random(len(meta)) < 0.5)
+    meta = meta[rng.random(len(meta)) > missing]
+    return meta.sort_values(['Zone_ID', 'Slot_Start']).reset_index(drop=True)
+
+
+def verify(ks=(1, 3, 5, 10, 30)):
+    import warnings
+    for n_slots, n_zones, seed in ((300, 22, 0), (200, 8, 1), (100, 40, 2)):
+        meta = _synthetic_meta(n_slots, n_zones, seed)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            expected = _legacy_metrics(meta, ks)
+        report = ranking_report(meta, ks)
+        got = {(m, None if pd.isna(k) else k): v for m, k, v in report.itertuples(index=False)}
+        for key, value in expected.items():
+            assert np.isclose(got[key], value, rtol=0, atol=1e-12), (key, got[key], value)
+        print(f"✅ {n_slots} 時段 x {n_zones} 區域，{len(expected)} 個指標一致")
+
+
+def benchmark(n_slots=5_000, n_zones=50, ks=(1, 3, 5, 10, 20), legacy_slots=500):
+    import warnings
+    meta = _synthetic_meta(n_slots, n_zones)
+    small = meta[meta['Slot_Start'] < meta['Slot_Start'].sort_values().unique()[legacy_slots]]
+    t0 = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        _legacy_metrics(small, ks)
+    legacy = (time.perf_counter() - t0) / legacy_slots * n_slots
+    t0 = time.perf_counter()
+    ranking_report(meta, ks)
+    fast = time.perf_counter() - t0
+    print(f"{n_slots:,} 時段 x {n_zones} 區域，{len(ks)} 個 K: 向量化 {fast * 1000:.0f} ms，"
+          f"逐時段 groupby 估計 {legacy:.1f}s ({legacy / fast:.0f}x)")
+
+
+if __name__ == "__main__":
+    verify()
+    benchmark()
@@ -0,0 +1,440 @@
+"""
+區域風險流程 - notebook (main.ipynb) 的各步驟拆成可匯入的階段，依序執行並記錄每個階段的
+執行時間、峰值 RSS 與輸出列數 (StageProfiler)；synthetic_inputs 依 違規筆數 / 區域數 / 天數 產生模擬輸入檔
+benchmark 在多個規模下各以新的行程執行全部階段，與基準結果比較，時間或記憶體超過容許倍數時以非 0 結束
+
+python pipeline.py                                   # 真實資料跑一次，列出各階段
+python pipeline.py --profile features spatial        # 另外列出這些階段的 cProfile 前幾名
+python pipeline.py --benchmark --save-baseline       # 產生基準 (依機器各自保存)
+python pipeline.py --benchmark                       # 與基準比較，退步時 exit 1
+"""
+
+import argparse
+import cProfile
+import json
+import multiprocessing
+import os
+import platform
+import pstats
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from feature_store import (default_inputs, load_violations, build_time, build_weather, build_zone_static,
+                           build_history, build_spatial, build_advanced, build_label)
+from grid import SlotZoneGrid
+from spatial import zone_centroids, NeighborGraph
+from tuning import BASE_PARAMS, EARLY_STOPPING, SearchData, evaluate
+from weather import fill_precipitation, build_daily_weather
+
+FREQ = '15min'
+WINDOW_SIZE = 10
+ROUNDS = 800
+
+# 規模: 違規筆數、區域數、天數 (15 分鐘網格每天 26 個時段)
+SIZES = {
+    'small': {'n_violations': 20_000, 'n_zones': 20, 'n_days': 365},
+    'medium': {'n_violations': 100_000, 'n_zones': 40, 'n_days': 730},
+    'large': {'n_violations': 400_000, 'n_zones': 80, 'n_days': 1095},
+}
+BENCHMARK_ROUNDS = 100
+BASELINE_PATH = 'pipeline_baseline.json'
+TIME_TOLERANCE = 1.5    # 比基準慢 1.5 倍以上視為退步
+MEMORY_TOLERANCE = 1.25
+MIN_SECONDS = 0.05      # 太短的階段只看相對倍數容易誤判，差距小於此值不算退步
+MIN_MEMORY_MB = 32.0
+
+
+# ==========================================
+# 1. 量測
+# ==========================================
+def current_rss_mb():
+    """目前的 RSS (Linux 讀 /proc/self/statm；其他平台退回行程的峰值 RSS)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageProfiler:
+    """
+    記錄每個階段的 wall time、峰值 RSS (背景執行緒每 interval 秒取樣) 與輸出列數
+    profile: 需要 cProfile 的階段名稱，結果存在 self.stats[名稱]
+    """
+
+    def __init__(self, interval=0.005, profile=()):
+        self.interval = interval
+        self.profile = set(profile)
+        self.records = []
+        self.stats = {}
+
+    @contextmanager
+    def stage(self, name):
+        record = {'stage': name, 'rows': None}
+        start_rss = current_rss_mb()
+        peak = [start_rss]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.interval):
+                peak[0] = max(peak[0], current_rss_mb())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        profiler = cProfile.Profile() if name in self.profile else None
+        t0 = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+                self.stats[name] = pstats.Stats(profiler)
+            record['seconds'] = time.perf_counter() - t0
+            done.set()
+            sampler.join()
+            end_rss = current_rss_mb()
+            record['peak_rss_mb'] = max(peak[0], end_rss)
+            record['rss_delta_mb'] = end_rss - start_rss
+            self.records.append(record)
+
+    def table(self):
+        return pd.DataFrame(self.records, columns=['stage', 'seconds', 'peak_rss_mb', 'rss_delta_mb', 'rows'])
+
+    def print_stats(self, top=15):
+        for name, stats in self.stats.items():
+            print(f"\n🔍 {name} (cProfile, 依累計時間前 {top} 名):")
+            stats.sort_stats('cumulative').print_stats(top)
+
+
+# ==========================================
+# 2. 階段 (state 為 dict，每個階段讀取前面階段的結果並回傳輸出列數)
+# ==========================================
+def stage_load(state):
+    """載入資料：違規紀錄 (篩選 2023 年以後、對應 Zone_ID)、地點座標、區域規則、每日天氣"""
+    inputs = state['inputs']
+    state['df_raw'] = load_violations(inputs['violations'], inputs['rules'])
+    state['df_rules'] = pd.read_csv(inputs['rules'], encoding='utf-8-sig')
+    state['df_coords'] = pd.read_csv(inputs['coords'], encoding='utf-8-sig')
+    df_rain = pd.read_csv(inputs['rain'], encoding='utf-8-sig')
+    df_temp = pd.read_csv(inputs['temp'], encoding='utf-8-sig')
+    state['daily_weather'] = build_daily_weather(fill_precipitation(df_rain), df_temp)
+    return len(state['df_raw'])
+
+
+def stage_grid(state):
+    """建立區域時間網格"""
+    state['grid'] = grid = SlotZoneGrid.from_violations(state['df_raw'], freq=state['freq'])
+    return grid.n_slots * grid.n_zones
+
+
+def stage_neighbors(state):
+    """計算區域中心座標與鄰近區域"""
+    zones = state['grid'].zones
+    centroids = zone_centroids(state['df_coords'], state['df_rules'], zones)
+    state['neighbors'] = NeighborGraph.knn(zones, centroids, k=5)
+    return len(centroids)
+
+
+def stage_features(state):
+    """特徵工程：時間、天氣、區域靜態、歷史特徵"""
+    grid, df_raw = state['grid'], state['df_raw']
+    features = state['features'] = {}
+    features.update(build_time(grid))
+    features.update(build_weather(grid, state['daily_weather']))
+    features.update(build_zone_static(grid, df_raw))
+    features.update(build_history(grid))
+    return grid.n_slots * grid.n_zones
+
+
+def stage_spatial(state):
+    """空間特徵 (鄰居的上一時段與當天累積取締數)"""
+    grid, features = state['grid'], state['features']
+    features.update(build_spatial(grid, state['neighbors'], features['today_cumsum']))
+    return grid.n_slots * grid.n_zones
+
+
+def stage_advanced(state):
+    """進階特徵 (同星期幾 + 同時段的歷史取締率與次數)"""
+    grid = state['grid']
+    state['features'].update(build_advanced(grid, state['df_raw']))
+    return grid.n_slots * grid.n_zones
+
+
+def stage_label(state):
+    """預測目標 (未來 WINDOW_SIZE 個時段內是否取締)"""
+    grid = state['grid']
+    state['features'].update(build_label(grid, state['window_size']))
+    return grid.n_slots * grid.n_zones
+
+
+def stage_split(state):
+    """特徵矩陣 (含交互特徵) 與依日期的訓練 / 驗證 / 測試切分"""
+    state['data'] = data = SearchData(state['grid'], state['features'])
+    data.dmatrix('train')
+    data.dmatrix('valid')
+    return len(data.X)
+
+
+def stage_train(state):
+    """XGBoost 二元分類 (notebook 的參數；驗證期 early stopping)"""
+    data = state['data']
+    params = dict(BASE_PARAMS, objective='binary:logistic', eval_metric='auc', tree_method='hist', seed=42,
+                  scale_pos_weight=data.scale_pos_weight)
+    state['model'] = xgb.train(params, data.dmatrix('train'), num_boost_round=state['rounds'],
+                               evals=[(data.dmatrix('valid'), 'valid')],
+                               early_stopping_rounds=state['early_stopping'], verbose_eval=False)
+    if state['early_stopping']:
+        state['model'] = state['model'][:state['model'].best_iteration + 1]
+    start, end = data.ranges['train']
+    return (end - start) * len(data.zones)
+
+
+def stage_evaluate(state):
+    """測試期的 AUC、Hit Rate@K、NDCG"""
+    data, model = state['data'], state['model']
+    predictions = model.predict(data.dmatrix('test'))
+    state['metrics'] = evaluate(data, 'test', predictions)
+    return len(predictions)
+
+
+STAGES = [
+    ('load', stage_load),
+    ('grid', stage_grid),
+    ('neighbors', stage_neighbors),
+    ('features', stage_features),
+    ('spatial', stage_spatial),
+    ('advanced', stage_advanced),
+    ('label', stage_label),
+    ('split', stage_split),
+    ('train', stage_train),
+    ('evaluate', stage_evaluate),
+]
+
+
+def run_pipeline(inputs, freq=FREQ, window_size=WINDOW_SIZE, rounds=ROUNDS, early_stopping=EARLY_STOPPING,
+                 stages=STAGES, profiler=None, verbose=True):
+    """依序執行各階段，回傳 (state, profiler)"""
+    profiler = profiler or StageProfiler()
+    state = {'inputs': inputs, 'freq': freq, 'window_size': window_size, 'rounds': rounds,
+             'early_stopping': early_stopping}
+    for name, func in stages:
+        with profiler.stage(name) as record:
+            record['rows'] = func(state)
+        if verbose:
+            print(f"   {name:<10} {record['seconds']:7.2f}s  峰值 RSS {record['peak_rss_mb']:7.0f} MB  "
+                  f"{record['rows']:>10,} 列  {func.__doc__.splitlines()[0]}")
+    return state, profiler
+
+
+# ==========================================
+# 3. 模擬輸入
+# ==========================================
+def synthetic_inputs(out_dir, n_violations=100_000, n_zones=40, n_days=730, seed=0):
+    """
+    在 out_dir 寫出 feature_store.INPUT_FILES 的五個檔案 (格式同真實資料)，回傳 inputs
+    區域的取締量依 Zipf 分布 (少數區域很熱門)，每個區域 1 ~ 3 個地點，取締時間落在上午 / 下午取締時段
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    inputs = default_inputs(out_dir)
+
+    # 區域、地點與座標
+    zone_ids = np.arange(1, n_zones + 1)
+    locations_per_zone = rng.integers(1, 4, n_zones)
+    loc_zone = np.repeat(zone_ids, locations_per_zone)
+    locations = np.array([f'地點{i}' for i in range(len(loc_zone))])
+    pd.DataFrame({
+        'Original_Location': locations, 'Zone_ID': loc_zone, 'Zone_Name': [f'區域{z}' for z in loc_zone],
+        'Locations_in_Zone': locations_per_zone[loc_zone - 1],
+    }).to_csv(inputs['rules'], index=False, encoding='utf-8-sig')
+    center = rng.normal([22.627, 120.267], 0.003, (n_zones, 2))[loc_zone - 1]
+    coords = center + rng.normal(0, 0.0003, center.shape)
+    pd.DataFrame({'Location': locations, 'Latitude': coords[:, 0].round(6), 'Longitude': coords[:, 1].round(6)}) \
+        .to_csv(inputs['coords'], index=False, encoding='utf-8-sig')
+
+    # 違規紀錄
+    weights = 1.0 / np.arange(1, len(locations) + 1) ** 0.8
+    loc = rng.permutation(len(locations))[rng.choice(len(locations), n_violations, p=weights / weights.sum())]
+    day = rng.integers(0, n_days, n_violations)
+    minute = rng.choice(np.r_[9 * 60:11 * 60 + 45, 13 * 60:16 * 60 + 45], n_violations)
+    second = rng.integers(0, 60, n_violations)
+    start = pd.Timestamp('2023-01-02')
+    times = start + pd.to_timedelta(day * 86400 + minute * 60 + second, unit='s')
+    order = np.argsort(times.values)[::-1]  # 同 violate.csv 由新到舊
+    pd.DataFrame({
+        '序號': [f'DR{i:09d}' for i in range(n_violations)],
+        '車牌號碼': 'ABC-' + pd.Series(rng.integers(1000, 10000, n_violations)).astype(str),
+        '違規地點': locations[loc][order],
+        '違規事由': '未依學校規定區域停放',
+        '舉發日期': times[order].strftime('%Y-%m-%d %H:%M:%S'),
+        'Vehicle_Type': np.where(rng.random(n_violations) < 0.6, 'Scooter', 'Car'),
+    }).to_csv(inputs['violations'], index=False, encoding='utf-8-sig')
+
+    # 每日天氣 (降水約 5% 缺值或 T，由 fill_precipitation 補全)
+    dates = pd.date_range(start - pd.Timedelta(days=5), periods=n_days + 10, freq='D').strftime('%Y-%m-%d')
+    rain = np.where(rng.random(len(dates)) < 0.7, 0.0, rng.gamma(0.8, 12.0, len(dates)).round(1)).astype(object)
+    rain[rng.random(len(dates)) < 0.05] = 'T'
+    pd.DataFrame({'date': dates, 'Precipitation': rain}).to_csv(inputs['rain'], index=False, encoding='utf-8-sig')
+    day_of_year = np.arange(len(dates))
+    temp = 25 + 5 * np.sin(2 * np.pi * (day_of_year - 100) / 365) + rng.normal(0, 1.5, len(dates))
+    pd.DataFrame({'date': dates, 'temperature': temp.round(1)}).to_csv(inputs['temp'], index=False,
+                                                                         encoding='utf-8-sig')
+    return inputs
+
+
+# ==========================================
+# 4. 效能測試與退步檢查
+# ==========================================
+def _benchmark_run(inputs, rounds):
+    """在獨立的行程執行一次全部階段 (峰值 RSS 不受前一次執行影響)"""
+    _, profiler = run_pipeline(inputs, rounds=rounds, early_stopping=None, verbose=False)
+    return profiler.records
+
+
+def benchmark_sizes(sizes=('small', 'medium'), repeat=3, rounds=BENCHMARK_ROUNDS, seed=0):
+    """
+    每個規模產生一次模擬輸入，執行 repeat 次 (每次一個新行程)，各階段取最短時間 / 最小峰值
+    回傳 {規模: {階段: {'seconds', 'peak_rss_mb', 'rows'}}}
+    """
+    results = {}
+    tmp_dir = tempfile.mkdtemp()
+    context = multiprocessing.get_context('spawn')
+    try:
+        for size in sizes:
+            inputs = synthetic_inputs(os.path.join(tmp_dir, size), seed=seed, **SIZES[size])
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    runs.append(pool.submit(_benchmark_run, inputs, rounds).result())
+            stages = {}
+            for records in zip(*runs):
+                name = records[0]['stage']
+                stages[name] = {
+                    'seconds': min(r['seconds'] for r in records),
+                    'peak_rss_mb': min(r['peak_rss_mb'] for r in records),
+                    'rows': records[0]['rows'],
+                }
+            stages['total'] = {
+                'seconds': sum(s['seconds'] for s in stages.values()),
+                'peak_rss_mb': max(s['peak_rss_mb'] for s in stages.values()),
+                'rows': None,
+            }
+            results[size] = stages
+            print(f"   {size}: {SIZES[size]} -> {stages['total']['seconds']:.2f}s，"
+                  f"峰值 RSS {stages['total']['peak_rss_mb']:.0f} MB")
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def compare(results, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """
+    逐一比較 (規模, 階段)，回傳比較表與是否退步
+    退步：時間 > 基準 x time_tolerance 且多出 MIN_SECONDS 以上；峰值 RSS 同理；輸出列數不同
+    """
+    rows = []
+    for size, stages in results.items():
+        for stage, now in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None:
+                rows.append({'size': size, 'stage': stage, 'seconds': now['seconds'], 'peak_rss_mb': now['peak_rss_mb'],
+                             'status': '新增'})
+                continue
+            slow = (now['seconds'] > base['seconds'] * time_tolerance
+                    and now['seconds'] - base['seconds'] > MIN_SECONDS)
+            heavy = (now['peak_rss_mb'] > base['peak_rss_mb'] * memory_tolerance
+                     and now['peak_rss_mb'] - base['peak_rss_mb'] > MIN_MEMORY_MB)
+            changed = now['rows'] != base['rows']
+            problems = [label for label, flag in (('時間', slow), ('記憶體', heavy), ('列數', changed)) if flag]
+            rows.append({
+                'size': size, 'stage': stage,
+                'seconds': now['seconds'], 'base_seconds': base['seconds'],
+                'time_ratio': now['seconds'] / max(base['seconds'], 1e-9),
+                'peak_rss_mb': now['peak_rss_mb'], 'base_rss_mb': base['peak_rss_mb'],
+                'status': '❌ ' + '/'.join(problems) if problems else '✅',
+            })
+    table = pd.DataFrame(rows)
+    return table, bool(table['status'].str.startswith('❌').any())
+
+
+def _machine():
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'node': platform.node(),
+            'cpus': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__, 'xgboost': xgb.__version__}
+
+
+def benchmark(sizes=('small', 'medium'), repeat=3, baseline_path=BASELINE_PATH, save_baseline=False,
+              time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """回傳是否通過 (沒有基準檔時只輸出結果)"""
+    print(f"🚀 {len(sizes)} 個規模 x {repeat} 次 (每次一個新行程，{BENCHMARK_ROUNDS} 輪、不 early stopping)")
+    results = benchmark_sizes(sizes, repeat)
+
+    if save_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump({'machine': _machine(), 'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+                       'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"基準已儲存至 {baseline_path}")
+        return True
+    if not os.path.exists(baseline_path):
+        print(f"⚠️ 找不到基準 {baseline_path}，請先以 --save-baseline 產生")
+        return True
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    if saved['machine'] != _machine():
+        print(f"⚠️ 基準來自不同的環境: {saved['machine']}")
+    table, regressed = compare(results, saved['results'], time_tolerance, memory_tolerance)
+    pd.set_option('display.width', 160)
+    print(table.to_string(index=False, float_format=lambda v: f'{v:.2f}'))
+    if regressed:
+        print(f"\n❌ 有階段退步 (時間容許 {time_tolerance}x、記憶體容許 {memory_tolerance}x)")
+    else:
+        print(f"\n✅ 與基準 ({saved['created']}) 相比沒有退步")
+    return not regressed
+
+
+def main(data_dir='../data_after_process', rounds=ROUNDS, profile=(), output=None):
+    print(f"🚀 區域風險流程 (FREQ={FREQ}, WINDOW_SIZE={WINDOW_SIZE})")
+    profiler = StageProfiler(profile=profile)
+    state, profiler = run_pipeline(default_inputs(data_dir), rounds=rounds, profiler=profiler)
+    table = profiler.table()
+    print(f"\n⏱️ 共 {table['seconds'].sum():.1f}s，最慢: {table.loc[table['seconds'].idxmax(), 'stage']}，"
+          f"峰值 RSS {table['peak_rss_mb'].max():.0f} MB")
+    print("📊 測試期: " + ", ".join(f"{k} {v:.4f}" for k, v in state['metrics'].items()))
+    profiler.print_stats()
+    if output:
+        table.to_csv(output, index=False, encoding='utf-8-sig')
+        print(f"各階段紀錄已儲存至 {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="區域風險流程 (分階段量測)")
+    parser.add_argument('--data-dir', default='../data_after_process')
+    parser.add_argument('--rounds', type=int, default=ROUNDS)
+    parser.add_argument('--profile', nargs='*', default=[], help="要以 cProfile 分析的階段")
+    parser.add_argument('--output', default=None, help="各階段紀錄 (.csv)")
+    parser.add_argument('--benchmark', action='store_true', help="在多個規模下執行並與基準比較")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        ok = benchmark(args.sizes, args.repeat, args.baseline, args.save_baseline,
+                       args.time_tolerance, args.memory_tolerance)
+        sys.exit(0 if ok else 1)
+    main(args.data_dir, args.rounds, args.profile, args.output)
@@ -0,0 +1,248 @@
+"""
+預先計算的風險日曆 - 未來 N 天每個取締時段 (09:00 ~ 11:30、13:00 ~ 16:30) x 所有區域的風險分數
+特徵一次組成 (時段 x 區域) 矩陣，整批呼叫一次 inplace_predict；分數量化成 uint8 / float16 存成 .npy，
+查詢時以 memory-map 開啟，由 (日期, 一天中的分鐘) 直接算出列位置 (O(1)，不搜尋)
+
+日曆產生時未來時段尚無取締紀錄：lag / 當天累積 / 鄰居等動態特徵與 RiskScorer 查詢未來時段時相同 (皆為 0)，
+因此是「沒有新觀測時」的事前排名；當天有新紀錄時以 scoring.py 即時評分
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from grid import enforcement_slots
+from scoring import FREQ, MAX_EXTEND_DAYS, RiskScorer, time_feature_table
+from weather import lookup_daily_weather
+
+SCORES_FILE = 'scores.npy'
+META_FILE = 'meta.json'
+QUANT_LEVELS = 255  # uint8 量化：分數線性對應到 0 ~ 255
+
+
+# ==========================================
+# 1. 批次特徵與評分
+# ==========================================
+def calendar_slots(start, days, freq=FREQ):
+    """start 當天起 days 天內的所有取締時段"""
+    start = pd.Timestamp(start).normalize()
+    return enforcement_slots(start, start + pd.Timedelta(days=days), freq)
+
+
+def batch_feature_matrix(scorer, slots):
+    """多個時段所有區域的特徵 ((時段 x 區域) x 特徵，列順序為時段優先，欄位順序同模型)"""
+    slots = pd.DatetimeIndex(slots)
+    with scorer._lock:
+        grid = scorer.history.grid
+        if slots[0] < grid.slots[0]:
+            raise ValueError(f"{slots[0]} 早於歷史資料起點 {grid.slots[0]}")
+        if slots[-1] - grid.slots[-1] > pd.Timedelta(days=MAX_EXTEND_DAYS):
+            raise ValueError(f"{slots[-1]} 超出資料尾端 {MAX_EXTEND_DAYS} 天以上")
+        scorer.history.extend(slots[-1])
+        idx = scorer.history.grid.slots.get_indexer(slots)
+        columns = {name: values[idx] for name, values in scorer.history.features.items()}
+
+    # 時間與天氣特徵為 (時段,)，區域輪廓為 (時段 x 區域)，一律 broadcast 成 (時段 x 區域)
+    columns.update({name: values[:, None] for name, values in time_feature_table(slots).items()})
+    columns.update(scorer.profile.grid_features(slots))
+    rain, temp = lookup_daily_weather(slots, scorer.daily_weather)
+    columns['Precipitation'], columns['temperature'] = rain[:, None], temp[:, None]
+    columns['risk_x_morning'] = columns['zone_baseline_risk'] * columns['is_morning_session']
+    columns['risk_x_afternoon'] = columns['zone_baseline_risk'] * columns['is_afternoon_session']
+    columns['risk_x_progress'] = columns['zone_baseline_risk'] * columns['session_progress']
+    columns['weekday_hour_risk'] = columns['zone_weekday_risk'] * columns['zone_weekday_hour_rate']
+
+    shape = (len(slots), len(scorer.zones))
+    X = np.empty((shape[0] * shape[1], len(scorer.feature_names)), dtype=np.float32)
+    for j, name in enumerate(scorer.feature_names):
+        X[:, j] = np.broadcast_to(columns[name], shape).ravel()
+    return X
+
+
+def quantize(scores, dtype='uint8'):
+    """回傳 (量化後陣列, 下界, 上界)；uint8 以 [下界, 上界] 線性對應到 0 ~ 255"""
+    low, high = float(scores.min()), float(scores.max())
+    if dtype == 'float16':
+        return scores.astype(np.float16), low, high
+    if dtype != 'uint8':
+        raise ValueError(f"不支援的量化型別 {dtype} (uint8 / float16)")
+    scale = (high - low) or 1.0
+    return np.rint((scores - low) / scale * QUANT_LEVELS).astype(np.uint8), low, high
+
+
+def build_calendar(scorer, start, days, dtype='uint8', nthread=None):
+    """產生 start 當天起 days 天的風險日曆 (RiskCalendar)"""
+    slots = calendar_slots(start, days)
+    X = batch_feature_matrix(scorer, slots)
+    scorer.booster.set_param({'nthread': nthread or os.cpu_count()})
+    scores = scorer.booster.inplace_predict(X, iteration_range=scorer.iteration_range)
+    values, low, high = quantize(scores.reshape(len(slots), len(scorer.zones)), dtype)
+    day_minutes = np.unique(slots.hour * 60 + slots.minute)
+    meta = {
+        'start': str(slots[0].normalize().date()), 'days': int(days), 'freq': FREQ,
+        'day_minutes': day_minutes.tolist(), 'dtype': dtype, 'low': low, 'high': high,
+        'zones': scorer.zones.tolist(), 'zone_names': scorer.zone_names,
+        'last_observed_slot': str(scorer.history.grid.slots[-1]),
+        'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+    }
+    return RiskCalendar(values, meta)
+
+
+# ==========================================
+# 2. 日曆 (儲存 / memory-map / O(1) 查詢)
+# ==========================================
+class RiskCalendar:
+    """
+    values: (天數 x 每天時段數, 區域) 的量化分數；第 d 天第 k 個時段在第 d * 每天時段數 + k 列
+    查詢時間對齊方式同 RiskScorer.resolve_slot (對齊 15 分鐘，不在取締時段內取下一個時段)
+    """
+
+    def __init__(self, values, meta):
+        self.values = values
+        self.meta = meta
+        self.start = pd.Timestamp(meta['start'])
+        self.zones = np.asarray(meta['zones'])
+        self.zone_names = meta['zone_names']
+        self.day_minutes = np.asarray(meta['day_minutes'])
+        self.slots_per_day = len(self.day_minutes)
+        if values.shape != (meta['days'] * self.slots_per_day, len(self.zones)):
+            raise ValueError(f"分數陣列形狀 {values.shape} 與日曆設定不符")
+        # 一天中每一分鐘 -> 該分鐘對齊後的 (下一個) 取締時段編號；等於每天時段數表示隔天第一個時段
+        step = pd.Timedelta(meta['freq']) // pd.Timedelta(minutes=1)
+        minutes = np.arange(24 * 60)
+        self._next_slot = np.searchsorted(self.day_minutes, minutes - minutes % step)
+
+    def save(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        np.save(os.path.join(out_dir, SCORES_FILE), self.values)
+        with open(os.path.join(out_dir, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, out_dir, mmap=True):
+        """mmap=True 時分數陣列以唯讀 memory-map 開啟 (只讀取查到的列)"""
+        with open(os.path.join(out_dir, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(np.load(os.path.join(out_dir, SCORES_FILE), mmap_mode='r' if mmap else None), meta)
+
+    # ---------- 查詢 ----------
+    def position(self, at):
+        """回傳 (時段, 列位置)；超出日曆範圍時 KeyError"""
+        ts = pd.Timestamp(at)
+        day = (ts.normalize() - self.start).days
+        k = int(self._next_slot[ts.hour * 60 + ts.minute])
+        if k == self.slots_per_day:
+            day, k = day + 1, 0
+        if not 0 <= day < self.meta['days']:
+            raise KeyError(f"{ts} 不在日曆範圍 ({self.meta['start']} 起 {self.meta['days']} 天)")
+        slot = self.start + pd.Timedelta(days=day, minutes=int(self.day_minutes[k]))
+        return slot, day * self.slots_per_day + k
+
+    def scores(self, at):
+        """回傳 (時段, 各區域風險分數陣列)，uint8 還原成 [下界, 上界] 的浮點數"""
+        slot, row = self.position(at)
+        values = np.asarray(self.values[row], dtype=np.float64)
+        if self.meta['dtype'] == 'uint8':
+            values = self.meta['low'] + values / QUANT_LEVELS * (self.meta['high'] - self.meta['low'])
+        return slot, values
+
+    def rank(self, at, top=5):
+        """最危險 / 最安全的 top 個區域 (格式同 RiskScorer.rank)"""
+        slot, scores = self.scores(at)
+        order = np.argsort(-scores, kind='stable')
+
+        def zone_list(idx):
+            return [{'Zone_ID': int(self.zones[i]), 'Zone_Name': self.zone_names[i],
+                     'risk_score': round(float(scores[i]), 6)} for i in idx]
+
+        return {'slot': str(slot), 'top': zone_list(order[:top]), 'bottom': zone_list(order[::-1][:top])}
+
+
+# ==========================================
+# 3. 驗證與效能測試
+# ==========================================
+def verify(model_path, data_dir='../data_after_process', days=3):
+    """批次特徵 = RiskScorer 逐時段的特徵；量化誤差在半格以內；查詢對齊同 resolve_slot"""
+    import tempfile
+    scorer = RiskScorer.from_files(model_path, data_dir)
+    start = scorer.history.grid.slots[-1].normalize() + pd.Timedelta(days=1)
+    slots = calendar_slots(start - pd.Timedelta(days=days), days * 2)  # 前半在歷史內、後半為未來
+    X = batch_feature_matrix(scorer, slots).reshape(len(slots), len(scorer.zones), -1)
+    for i, slot in enumerate(slots):
+        assert np.allclose(X[i], scorer.feature_matrix(slot), rtol=1e-6, atol=1e-6), slot
+
+    calendar = build_calendar(scorer, start, days, dtype='uint8')
+    exact = build_calendar(scorer, start, days, dtype='float16')
+    half_step = (calendar.meta['high'] - calendar.meta['low']) / QUANT_LEVELS / 2
+    with tempfile.TemporaryDirectory() as tmp:
+        calendar.save(tmp)
+        loaded = RiskCalendar.load(tmp)
+        day = calendar.start
+        for minute in range(0, 24 * 60, 7):
+            at = day + pd.Timedelta(minutes=minute)
+            expected_slot, expected = scorer.score(at)
+            slot, got = loaded.scores(at)
+            assert slot == expected_slot, at
+            assert np.abs(got - expected).max() <= half_step + 1e-6, at
+            assert np.allclose(exact.scores(at)[1], expected, rtol=1e-3, atol=1e-4), at
+    print(f"✅ {len(slots)} 個時段的批次特徵與逐時段相同；{days} 天日曆的 uint8 誤差 <= {half_step:.2e}，"
+          f"float16 相對誤差 <= 1e-3，查詢時段與 resolve_slot 一致")
+
+
+def benchmark(model_path, data_dir='../data_after_process', days=14):
+    scorer = RiskScorer.from_files(model_path, data_dir)
+    start = scorer.history.grid.slots[-1].normalize() + pd.Timedelta(days=1)
+    slots = calendar_slots(start, days)
+    scorer.history.extend(slots[-1])
+    t0 = time.perf_counter()
+    for slot in slots:
+        scorer.score(slot)
+    per_slot = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    calendar = build_calendar(scorer, start, days)
+    batch = time.perf_counter() - t0
+
+    rng = np.random.default_rng(0)
+    queries = [slots[i] + pd.Timedelta(minutes=int(m)) for i, m in
+               zip(rng.integers(0, len(slots), 10_000), rng.integers(0, 15, 10_000))]
+    t0 = time.perf_counter()
+    for q in queries:
+        calendar.scores(q)
+    lookup = (time.perf_counter() - t0) / len(queries)
+    print(f"{days} 天 x {len(slots) // days} 時段 x {len(scorer.zones)} 區域: 逐時段評分 {per_slot:.2f}s，"
+          f"批次日曆 {batch:.2f}s ({per_slot / batch:.1f}x)，"
+          f"日曆 {calendar.values.nbytes / 1024:.1f} KB，每次查詢 {lookup * 1e6:.1f} µs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="未來 N 天的取締風險日曆")
+    parser.add_argument('--model', default='parking_risk_model_v4_zone.json')
+    parser.add_argument('--data-dir', default='../data_after_process')
+    parser.add_argument('--store', default=None, help="ingest.py 的儲存區 (預設讀 violate_with_type.csv)")
+    parser.add_argument('--out', default='../data_after_process/risk_calendar')
+    parser.add_argument('--start', default=None, help="日曆第一天 (預設今天)")
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--dtype', choices=['uint8', 'float16'], default='uint8')
+    parser.add_argument('--nthread', type=int, default=None)
+    parser.add_argument('--at', default=None, help="讀取已產生的日曆，輸出此時間的排名後結束")
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+
+    if args.verify:
+        verify(args.model, args.data_dir)
+    elif args.benchmark:
+        benchmark(args.model, args.data_dir, args.days)
+    elif args.at:
+        print(json.dumps(RiskCalendar.load(args.out).rank(args.at), ensure_ascii=False, indent=2))
+    else:
+        t0 = time.perf_counter()
+        scorer = RiskScorer.from_files(args.model, args.data_dir, args.store)
+        calendar = build_calendar(scorer, args.start or pd.Timestamp.now(), args.days, args.dtype, args.nthread)
+        calendar.save(args.out)
+        print(f"✅ {calendar.meta['start']} 起 {args.days} 天、{calendar.values.shape[0]} 個時段 x "
+              f"{len(calendar.zones)} 區域 ({args.dtype}) -> {args.out} ({time.perf_counter() - t0:.1f}s)")
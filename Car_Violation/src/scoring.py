@@ -0,0 +1,436 @@
+"""
+即時風險評分服務 - XGBoost 模型只載入一次，各區域的滾動狀態 (lag、當天累積、鄰居統計、每日天氣) 常駐記憶體
+任一時間點的所有區域一次批次評分，回傳最危險 / 最安全的區域 (程式內呼叫或本機 HTTP)
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from grid import MORNING_WINDOW, AFTERNOON_WINDOW
+from ingest import IncrementalFeatures, ViolationStore, prepare_violations, _load_neighbors
+from weather import load_daily_weather, lookup_daily_weather
+from zone_profile import ZoneProfile
+
+FREQ = '15min'
+MAX_EXTEND_DAYS = 366  # 查詢時間最多可超出資料尾端的天數
+
+# notebook 的特徵順序 (模型檔沒有記錄特徵名稱時使用)
+FEATURES = [
+    'weekday', 'hour', 'minute',
+    'is_morning_session', 'is_afternoon_session',
+    'hour_sin', 'hour_cos', 'weekday_sin', 'weekday_cos',
+    'session_progress',
+    'zone_baseline_risk', 'zone_morning_ratio', 'zone_afternoon_ratio', 'zone_weekday_risk',
+    'lag_1', 'lag_2', 'lag_3', 'lag_4',
+    'recent_1h_count', 'decay_recent',
+    'today_cumsum', 'today_global_cumsum',
+    'neighbor_lag1_sum', 'neighbor_lag1_mean', 'neighbor_has_event', 'neighbor_event_count',
+    'neighbor_today_sum', 'neighbor_today_max',
+    'zone_weekday_hour_rate', 'hist_slot_count',
+    'risk_x_morning', 'risk_x_afternoon', 'risk_x_progress', 'weekday_hour_risk',
+    'Precipitation', 'temperature',
+]
+
+
+# ==========================================
+# 1. 時間特徵 (定義同 notebook；區域靜態特徵見 zone_profile.py)
+# ==========================================
+def time_features(slot):
+    """單一時段的時間特徵 (所有區域相同)"""
+    h, m, wd = slot.hour, slot.minute, slot.dayofweek
+    if 9 <= h < 12:
+        start_min, end_min = 9 * 60, 11 * 60 + 30
+    else:
+        start_min, end_min = 14 * 60, 16 * 60 + 30
+    return {
+        'weekday': wd, 'hour': h, 'minute': m,
+        'is_morning_session': int(9 <= h < 12),
+        'is_afternoon_session': int(14 <= h < 17),
+        'hour_sin': np.sin(2 * np.pi * h / 24), 'hour_cos': np.cos(2 * np.pi * h / 24),
+        'weekday_sin': np.sin(2 * np.pi * wd / 7), 'weekday_cos': np.cos(2 * np.pi * wd / 7),
+        'session_progress': (h * 60 + m - start_min) / (end_min - start_min),
+    }
+
+
+def time_feature_table(slots):
+    """多個時段的時間特徵 (每個特徵為 (時段,) 陣列，定義同 time_features)"""
+    slots = pd.DatetimeIndex(slots)
+    h, m, wd = np.asarray(slots.hour), np.asarray(slots.minute), np.asarray(slots.dayofweek)
+    morning = (h >= 9) & (h < 12)
+    start_min = np.where(morning, 9 * 60, 14 * 60)
+    end_min = np.where(morning, 11 * 60 + 30, 16 * 60 + 30)
+    return {
+        'weekday': wd, 'hour': h, 'minute': m,
+        'is_morning_session': morning.astype(int),
+        'is_afternoon_session': ((h >= 14) & (h < 17)).astype(int),
+        'hour_sin': np.sin(2 * np.pi * h / 24), 'hour_cos': np.cos(2 * np.pi * h / 24),
+        'weekday_sin': np.sin(2 * np.pi * wd / 7), 'weekday_cos': np.cos(2 * np.pi * wd / 7),
+        'session_progress': (h * 60 + m - start_min) / (end_min - start_min),
+    }
+
+
+def load_state(data_dir='../data_after_process', store_dir=None):
+    """由歷史紀錄建立 (IncrementalFeatures, ZoneProfile, 每日天氣表, 區域名稱)"""
+    neighbors, loc_to_zone = _load_neighbors(data_dir)
+    if store_dir:
+        df = ViolationStore(store_dir).load()
+    else:
+        df = pd.read_csv(os.path.join(data_dir, 'violate_with_type.csv'), encoding='utf-8-sig', dtype=str)
+    df_viol = prepare_violations(df, loc_to_zone)
+    history = IncrementalFeatures(neighbors, freq=FREQ).build(df_viol)
+    daily = load_daily_weather(os.path.join(data_dir, 'rainfall.csv'), os.path.join(data_dir, 'temperature.csv'))
+    df_zone = pd.read_csv(os.path.join(data_dir, 'zone_info.csv'), encoding='utf-8-sig')
+    zone_names = df_zone.set_index('Zone_ID')['Zone_Name'].to_dict()
+    return history, ZoneProfile(df_viol, history.grid.zones), daily, zone_names
+
+
+# ==========================================
+# 2. 評分服務
+# ==========================================
+class RiskScorer:
+    """
+    history: IncrementalFeatures (取締數網格與歷史 / 鄰居特徵陣列)
+    score() 取出單一時段的特徵列 (區域 x 特徵) 後一次呼叫 inplace_predict
+    """
+
+    def __init__(self, booster, history, profile, daily_weather, zone_names=None):
+        self.booster = booster
+        self.history = history
+        self.profile = profile
+        self.daily_weather = daily_weather
+        self.zones = history.grid.zones
+        self.zone_names = [(zone_names or {}).get(z, f'Zone_{z}') for z in self.zones.tolist()]
+        self.feature_names = booster.feature_names or FEATURES
+        best = booster.attributes().get('best_iteration')
+        self.iteration_range = (0, int(best) + 1) if best is not None else (0, 0)
+        self._lock = threading.Lock()
+        self._weather_cache = {}
+
+    @classmethod
+    def from_files(cls, model_path, data_dir='../data_after_process', store_dir=None):
+        """載入模型與歷史資料 (store_dir 為 ingest.ViolationStore；未指定時讀 violate_with_type.csv)"""
+        booster = xgb.Booster()
+        booster.load_model(model_path)
+        return cls(booster, *load_state(data_dir, store_dir))
+
+    # ---------- 狀態 ----------
+    def observe(self, df_new):
+        """加入新的取締紀錄 (Datetime, Zone_ID)，只重算受影響的時段；區域靜態特徵維持載入時的統計"""
+        with self._lock:
+            self.history.update(df_new)
+
+    def resolve_slot(self, at=None):
+        """對齊到 15 分鐘；不在取締時段內時取下一個取締時段"""
+        ts = pd.Timestamp(at) if at is not None else pd.Timestamp.now()
+        ts = ts.floor(FREQ)
+        day = ts.normalize()
+        for (h0, m0), (h1, m1) in (MORNING_WINDOW, AFTERNOON_WINDOW):
+            if ts <= day + pd.Timedelta(hours=h1, minutes=m1):
+                return max(ts, day + pd.Timedelta(hours=h0, minutes=m0))
+        (h0, m0), _ = MORNING_WINDOW
+        return day + pd.Timedelta(days=1, hours=h0, minutes=m0)
+
+    def _weather(self, slot):
+        day = slot.normalize()
+        if day not in self._weather_cache:
+            rain, temp = lookup_daily_weather([day], self.daily_weather)
+            self._weather_cache[day] = (rain[0], temp[0])
+        return self._weather_cache[day]
+
+    def feature_matrix(self, slot):
+        """單一時段所有區域的特徵 (區域 x 特徵，欄位順序同模型)"""
+        with self._lock:
+            grid = self.history.grid
+            if slot < grid.slots[0]:
+                raise ValueError(f"{slot} 早於歷史資料起點 {grid.slots[0]}")
+            if slot > grid.slots[-1]:
+                if slot - grid.slots[-1] > pd.Timedelta(days=MAX_EXTEND_DAYS):
+                    raise ValueError(f"{slot} 超出資料尾端 {MAX_EXTEND_DAYS} 天以上")
+                self.history.extend(slot)
+                grid = self.history.grid
+            i = grid.slot_index(slot)
+            columns = {name: values[i] for name, values in self.history.features.items()}
+
+        columns.update(time_features(slot))
+        columns.update(self.profile.features(slot))
+        rain, temp = self._weather(slot)
+        columns['Precipitation'], columns['temperature'] = rain, temp
+        columns['risk_x_morning'] = columns['zone_baseline_risk'] * columns['is_morning_session']
+        columns['risk_x_afternoon'] = columns['zone_baseline_risk'] * columns['is_afternoon_session']
+        columns['risk_x_progress'] = columns['zone_baseline_risk'] * columns['session_progress']
+        columns['weekday_hour_risk'] = columns['zone_weekday_risk'] * columns['zone_weekday_hour_rate']
+
+        X = np.empty((len(self.zones), len(self.feature_names)), dtype=np.float32)
+        for j, name in enumerate(self.feature_names):
+            X[:, j] = columns[name]
+        return X
+
+    # ---------- 評分 ----------
+    def score(self, at=None):
+        """回傳 (時段, 各區域風險分數陣列)"""
+        slot = self.resolve_slot(at)
+        X = self.feature_matrix(slot)
+        scores = self.booster.inplace_predict(X, iteration_range=self.iteration_range)
+        return slot, scores
+
+    def rank(self, at=None, top=5):
+        """最危險 / 最安全的 top 個區域"""
+        slot, scores = self.score(at)
+        order = np.argsort(-scores, kind='stable')
+
+        def zone_list(idx):
+            return [{'Zone_ID': int(self.zones[i]), 'Zone_Name': self.zone_names[i],
+                     'risk_score': round(float(scores[i]), 6)} for i in idx]
+
+        return {'slot': str(slot), 'top': zone_list(order[:top]), 'bottom': zone_list(order[::-1][:top])}
+
+
+# ==========================================
+# 3. 本機 HTTP 服務
+# ==========================================
+def make_server(scorer, host='127.0.0.1', port=8000):
+    """
+    GET  /rank?at=2025-11-21T09:00&top=5   (省略 at 表示現在)
+    POST /observe  [{"Datetime": "...", "Zone_ID": 3}, ...]
+    GET  /health
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True  # 回應的標頭與內容分開寫出，避免 Nagle + delayed ACK 多等 40ms
+
+        def _send(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == '/health':
+                return self._send(200, {'status': 'ok', 'last_slot': str(scorer.history.grid.slots[-1])})
+            if url.path != '/rank':
+                return self._send(404, {'error': 'not found'})
+            try:
+                result = scorer.rank(query.get('at', [None])[0], int(query.get('top', ['5'])[0]))
+            except (ValueError, KeyError) as e:
+                return self._send(400, {'error': str(e)})
+            self._send(200, result)
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/observe':
+                return self._send(404, {'error': 'not found'})
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                records = json.loads(body or b'[]')
+                df_new = pd.DataFrame(records, columns=['Datetime', 'Zone_ID'])
+                df_new['Datetime'] = pd.to_datetime(df_new['Datetime'])
+                df_new['Zone_ID'] = df_new['Zone_ID'].astype(int)
+                scorer.observe(df_new)
+            except (json.JSONDecodeError, ValueError, KeyError, TypeError) as e:
+                return self._send(400, {'error': str(e)})
+            self._send(200, {'observed': len(df_new)})
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+# ==========================================
+# 4. 驗證與延遲測試
+# ==========================================
+def _reference_features(scorer, df_viol, slots):
+    """以長表 (groupby / rolling / merge) 另外計算指定時段的特徵，用來核對陣列查表的結果"""
+    grid = scorer.history.grid
+    df = grid.to_long()
+    grouped = df.groupby('Zone_ID')['count_in_slot']
+    for k in range(1, 5):
+        df[f'lag_{k}'] = grouped.shift(k).fillna(0)
+    df['recent_1h_count'] = grouped.transform(lambda s: s.shift(1).rolling(4, min_periods=1).sum()).fillna(0)
+    df['decay_recent'] = grouped.transform(lambda s: s.shift(1).ewm(halflife=2).mean()).fillna(0)
+    df['date'] = df['Slot_Start'].dt.normalize()
+    df['today_cumsum'] = df.groupby(['Zone_ID', 'date'])['count_in_slot'].cumsum() - df['count_in_slot']
+    slot_total = df.groupby('Slot_Start')['count_in_slot'].sum()
+    global_cum = slot_total.groupby(slot_total.index.normalize()).cumsum() - slot_total
+    df['today_global_cumsum'] = df['Slot_Start'].map(global_cum)
+    df = df[df['Slot_Start'].isin(slots)].copy()
+
+    df['weekday'] = df['Slot_Start'].dt.dayofweek
+    df['hour'] = df['Slot_Start'].dt.hour
+    df['minute'] = df['Slot_Start'].dt.minute
+    zone_total = df_viol.groupby('Zone_ID').size()
+    df['zone_baseline_risk'] = df['Zone_ID'].map(zone_total / zone_total.sum()).fillna(0)
+    is_morning = df_viol['Datetime'].dt.hour.between(9, 11)
+    for name, part in (('zone_morning_ratio', is_morning), ('zone_afternoon_ratio', ~is_morning)):
+        ratio = (df_viol[part].groupby('Zone_ID').size() / zone_total).fillna(0.5)
+        df[name] = df['Zone_ID'].map(ratio).fillna(0.5)
+    weekday = df_viol['Datetime'].dt.dayofweek.rename('weekday')
+    zone_wd = df_viol.groupby(['Zone_ID', weekday]).size().unstack(fill_value=0)
+    zone_wd = (zone_wd / (zone_wd.sum(axis=1).values.reshape(-1, 1) + 1e-10)).stack().rename('zone_weekday_risk')
+    df = df.merge(zone_wd.reset_index(), how='left', on=['Zone_ID', 'weekday'])
+    df['zone_weekday_risk'] = df['zone_weekday_risk'].fillna(0.14)
+    raw = df_viol.assign(weekday=df_viol['Datetime'].dt.dayofweek, hour=df_viol['Datetime'].dt.hour,
+                         minute=df_viol['Datetime'].dt.minute)
+    rate = raw.groupby(['Zone_ID', 'weekday', 'hour']).size().reset_index(name='hist_count')
+    rate = rate.merge(raw.groupby(['weekday', 'hour']).size().reset_index(name='total'), on=['weekday', 'hour'])
+    rate['zone_weekday_hour_rate'] = rate['hist_count'] / (rate['total'] + 1)
+    df = df.merge(rate[['Zone_ID', 'weekday', 'hour', 'zone_weekday_hour_rate']], how='left',
+                  on=['Zone_ID', 'weekday', 'hour']).fillna({'zone_weekday_hour_rate': 0})
+    slot_count = raw.groupby(['Zone_ID', 'weekday', 'hour', 'minute']).size().rename('hist_slot_count')
+    df = df.merge(slot_count.reset_index(), how='left', on=['Zone_ID', 'weekday', 'hour', 'minute'])
+    df['hist_slot_count'] = df['hist_slot_count'].fillna(0)
+    return df.sort_values(['Slot_Start', 'Zone_ID']).reset_index(drop=True)
+
+
+def verify(model_path, data_dir='../data_after_process', n_slots=40, seed=0):
+    """
+    線上的取締數網格與訓練用的 feature_store.load_features 相同 (同一個日期解析與前處理)；
+    陣列查表的特徵與長表計算一致，且 rank() 的分數等於直接對特徵矩陣 predict
+    """
+    import tempfile
+    from feature_store import FeatureStore, default_inputs, load_features
+    scorer = RiskScorer.from_files(model_path, data_dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        trained, _ = load_features(FeatureStore(tmp, default_inputs(data_dir)))
+    served = scorer.history.grid
+    assert served.slots.equals(trained.slots), "線上與訓練的時段不同"
+    assert np.array_equal(served.zones, trained.zones), "線上與訓練的區域不同"
+    assert np.array_equal(served.counts, trained.counts), \
+        f"線上與訓練的取締數不同 ({served.counts.sum()} vs {trained.counts.sum()} 筆)"
+    print(f"✅ 線上與訓練的網格相同 ({served.n_slots} 時段 x {served.n_zones} 區域，{served.counts.sum()} 筆)")
+
+    df = pd.read_csv(os.path.join(data_dir, 'violate_with_type.csv'), encoding='utf-8-sig', dtype=str)
+    df_viol = prepare_violations(df, _load_neighbors(data_dir)[1])
+    rng = np.random.default_rng(seed)
+    slots = pd.DatetimeIndex(np.sort(rng.choice(scorer.history.grid.slots[200:], n_slots, replace=False)))
+    ref = _reference_features(scorer, df_viol, slots)
+
+    checked = ['lag_1', 'lag_2', 'lag_3', 'lag_4', 'recent_1h_count', 'decay_recent', 'today_cumsum',
+               'today_global_cumsum', 'zone_baseline_risk', 'zone_morning_ratio', 'zone_afternoon_ratio',
+               'zone_weekday_risk', 'zone_weekday_hour_rate', 'hist_slot_count',
+               'weekday', 'hour', 'minute']
+    for slot in slots:
+        X = scorer.feature_matrix(slot)
+        expected = ref[ref['Slot_Start'] == slot]
+        for name in checked:
+            got = X[:, scorer.feature_names.index(name)]
+            assert np.allclose(got, expected[name].values.astype(np.float32), rtol=1e-6, atol=1e-6), (slot, name)
+        _, scores = scorer.score(slot)
+        direct = scorer.booster.predict(xgb.DMatrix(X, feature_names=scorer.feature_names),
+                                        iteration_range=scorer.iteration_range)
+        assert np.allclose(scores, direct, atol=1e-6), slot
+    print(f"✅ {n_slots} 個時段的特徵與長表計算一致，分數與 DMatrix predict 相同")
+
+
+def _stand_in_booster(model_path, data_dir, n_rounds=200, n_slots=2000, seed=0):
+    """沒有 notebook 產生的模型檔時，以相同特徵與標籤訓練一個替代模型 (只用於延遲測試)"""
+    scorer = RiskScorer(xgb.Booster(), *load_state(data_dir))
+    grid = scorer.history.grid
+    picks = np.random.default_rng(seed).choice(grid.n_slots, min(n_slots, grid.n_slots), replace=False)
+    X = np.vstack([scorer.feature_matrix(grid.slots[i]) for i in picks])
+    y = np.concatenate([scorer.history.features['label'][i] > 0 for i in picks]).astype(int)
+    dtrain = xgb.DMatrix(X, label=y, feature_names=FEATURES)
+    params = {'objective': 'binary:logistic', 'max_depth': 8, 'eta': 0.05, 'tree_method': 'hist'}
+    xgb.train(params, dtrain, num_boost_round=n_rounds).save_model(model_path)
+
+
+def _percentiles(latencies):
+    ms = np.asarray(latencies) * 1000
+    return np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def benchmark(model_path, data_dir='../data_after_process', n_requests=1000, concurrency=(1, 8)):
+    if not os.path.exists(model_path):
+        print(f"找不到 {model_path}，改用替代模型測試延遲 (請先執行 main.ipynb 產生正式模型)")
+        import tempfile
+        model_path = os.path.join(tempfile.mkdtemp(), 'stand_in_model.json')
+        _stand_in_booster(model_path, data_dir)
+    t0 = time.perf_counter()
+    scorer = RiskScorer.from_files(model_path, data_dir)
+    print(f"載入模型與歷史狀態: {time.perf_counter() - t0:.2f}s，{len(scorer.zones)} 區域，"
+          f"{scorer.history.grid.n_slots} 時段")
+
+    rng = np.random.default_rng(0)
+    slots = scorer.history.grid.slots
+    queries = [str(slots[i]) for i in rng.integers(len(slots) - 26 * 60, len(slots), n_requests)]
+    for q in queries[:50]:
+        scorer.rank(q)  # 預熱 (天氣查表快取)
+
+    def timed_rank(q):
+        t = time.perf_counter()
+        scorer.rank(q)
+        return time.perf_counter() - t
+
+    print(f"{'方式':<10} | {'並行數':>6} | {'p50 (ms)':>9} | {'p99 (ms)':>9} | {'請求/秒':>8}")
+    for workers in concurrency:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            latencies = list(pool.map(timed_rank, queries))
+        elapsed = time.perf_counter() - t0
+        p50, p99 = _percentiles(latencies)
+        print(f"{'程式內':<10} | {workers:>6} | {p50:>9.2f} | {p99:>9.2f} | {n_requests / elapsed:>8.0f}")
+
+    import requests
+    server = make_server(scorer, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/rank"
+    local = threading.local()
+
+    def timed_http(q):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        t = time.perf_counter()
+        response = local.session.get(url, params={'at': q, 'top': 5})
+        response.raise_for_status()
+        return time.perf_counter() - t
+
+    try:
+        for workers in concurrency:
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                latencies = list(pool.map(timed_http, queries))
+            elapsed = time.perf_counter() - t0
+            p50, p99 = _percentiles(latencies)
+            print(f"{'HTTP':<10} | {workers:>6} | {p50:>9.2f} | {p99:>9.2f} | {n_requests / elapsed:>8.0f}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="停車風險即時評分服務")
+    parser.add_argument('--model', default='parking_risk_model_v4_zone.json')
+    parser.add_argument('--data-dir', default='../data_after_process')
+    parser.add_argument('--store', default=None, help="ingest.py 的儲存區 (預設讀 violate_with_type.csv)")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--at', default=None, help="只輸出此時間的排名後結束")
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--benchmark', action='store_true', help="程式內與 HTTP 的 p50 / p99 延遲")
+    args = parser.parse_args()
+
+    if args.verify:
+        verify(args.model, args.data_dir)
+    elif args.benchmark:
+        benchmark(args.model, args.data_dir)
+    else:
+        scorer = RiskScorer.from_files(args.model, args.data_dir, args.store)
+        if args.at:
+            print(json.dumps(scorer.rank(args.at), ensure_ascii=False, indent=2))
+        else:
+            server = make_server(scorer, port=args.port)
+            print(f"🚀 評分服務已啟動: http://127.0.0.1:{args.port}/rank?at=2025-11-21T09:00")
+            server.serve_forever()
@@ -0,0 +1,139 @@
+"""
+空間特徵 - 以稀疏的 區域 x 區域 鄰接矩陣表示鄰居關係，鄰居統計皆為 (時段 x 區域) 陣列上的矩陣乘法
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from geo import haversine_matrix
+
+
+def zone_centroids(df_coords, df_rules, zones=None):
+    """各區域所含地點座標的平均 (區域中心)，回傳以 Zone_ID 為索引的 Latitude / Longitude 表"""
+    located = df_rules.merge(df_coords, left_on='Original_Location', right_on='Location', how='inner')
+    centroids = located.groupby('Zone_ID')[['Latitude', 'Longitude']].mean()
+    if zones is not None:
+        centroids = centroids[centroids.index.isin(zones)]
+    return centroids
+
+
+class NeighborGraph:
+    """
+    區域鄰接圖 (對應網格的區域順序)
+    adjacency[i, j] = 區域 j 對區域 i 的權重 (0 表示不是鄰居)；沒有座標的區域沒有鄰居
+    distances: 同樣結構的鄰居距離 (公尺)，供距離衰減使用
+    """
+
+    def __init__(self, zones, adjacency, distances=None):
+        self.zones = np.asarray(zones)
+        self.adjacency = sparse.csr_matrix(adjacency)
+        self.distances = distances
+        self._binary = None
+        self._padded = None
+
+    @classmethod
+    def knn(cls, zones, centroids, k=5):
+        """
+        以區域中心的 Haversine 距離取最近 k 個鄰居 (排除自己與距離為 0 的區域)
+        centroids: zone_centroids() 的結果
+        """
+        zones = np.asarray(zones)
+        zone_list = np.array([z for z in zones if z in centroids.index])
+        dist = haversine_matrix(centroids.loc[zone_list, ['Latitude', 'Longitude']].values)
+
+        # 每列排序後取第 1 ~ k 名 (第 0 名為自己)
+        order = np.argsort(dist, axis=1)[:, 1:k + 1]
+        rows = np.repeat(np.arange(len(zone_list)), order.shape[1])
+        cols = order.ravel()
+        keep = dist[rows, cols] > 0
+
+        # 對應回網格的區域位置
+        pos = pd.Index(zones).get_indexer(zone_list)
+        index = (pos[rows[keep]], pos[cols[keep]])
+        shape = (len(zones), len(zones))
+        adjacency = sparse.csr_matrix((np.ones(keep.sum()), index), shape=shape)
+        distances = sparse.csr_matrix((dist[rows[keep], cols[keep]], index), shape=shape)
+        return cls(zones, adjacency, distances)
+
+    # ---------- 衍生圖 ----------
+    def distance_decay(self, scale=100.0):
+        """權重改為 exp(-距離 / scale) (公尺)，用於距離衰減的鄰居加總"""
+        weights = self.distances.copy()
+        weights.data = np.exp(-weights.data / scale)
+        return NeighborGraph(self.zones, weights, self.distances)
+
+    def two_hop(self):
+        """兩步內可到達的區域 (鄰居的鄰居)，排除自己"""
+        binary = self.binary
+        reach = ((binary + binary @ binary) > 0).astype(float).tolil()
+        reach.setdiag(0)
+        reach = reach.tocsr()
+        reach.eliminate_zeros()
+        return NeighborGraph(self.zones, reach)
+
+    # ---------- 基本屬性 ----------
+    @property
+    def binary(self):
+        if self._binary is None:
+            self._binary = (self.adjacency > 0).astype(float).tocsr()
+        return self._binary
+
+    @property
+    def n_neighbors(self):
+        return np.asarray(self.binary.sum(axis=1)).ravel()
+
+    def neighbor_map(self):
+        """{區域: [鄰居區域...]}，方便檢視"""
+        adj = self.binary
+        return {z: self.zones[adj.indices[adj.indptr[i]:adj.indptr[i + 1]]].tolist()
+                for i, z in enumerate(self.zones)}
+
+    # ---------- 鄰居統計 (values: 時段 x 區域) ----------
+    def sum(self, values):
+        """加權加總 (values @ A^T)"""
+        return np.asarray(self.adjacency @ np.asarray(values, dtype=float).T).T
+
+    def mean(self, values):
+        """鄰居平均；沒有鄰居的區域為 0"""
+        n = self.n_neighbors
+        return np.divide(self.sum(values), n, out=np.zeros(np.shape(values)), where=n > 0)
+
+    def count_positive(self, values):
+        """鄰居中數值 > 0 的個數"""
+        return np.asarray(self.binary @ (np.asarray(values) > 0).T.astype(float)).T.astype(int)
+
+    def any_positive(self, values):
+        return (self.count_positive(values) > 0).astype(int)
+
+    def max(self, values):
+        """鄰居最大值；沒有鄰居的區域為 0"""
+        values = np.asarray(values, dtype=float)
+        if self._padded is None:
+            adj = self.binary
+            width = max(int(self.n_neighbors.max()), 1) if adj.shape[0] else 1
+            padded = np.full((adj.shape[0], width), -1)
+            for i in range(adj.shape[0]):
+                cols = adj.indices[adj.indptr[i]:adj.indptr[i + 1]]
+                padded[i, :len(cols)] = cols
+            self._padded = padded
+        # 以 -inf 的補位欄收集 (時段 x 區域 x 鄰居) 後取最大值
+        padded_values = np.concatenate([values, np.full((len(values), 1), -np.inf)], axis=1)
+        gathered = padded_values[:, self._padded]
+        out = gathered.max(axis=2)
+        out[~np.isfinite(out)] = 0.0
+        return out
+
+    def features(self, lag1, today_cumsum):
+        """
+        notebook 使用的鄰居特徵 (皆為 時段 x 區域 陣列)
+        lag1: 上一時段取締數；today_cumsum: 當天累積取締數
+        """
+        return {
+            'neighbor_lag1_sum': self.sum(lag1),
+            'neighbor_lag1_mean': self.mean(lag1),
+            'neighbor_has_event': self.any_positive(lag1),
+            'neighbor_event_count': self.count_positive(lag1),
+            'neighbor_today_sum': self.sum(today_cumsum),
+            'neighbor_today_max': self.max(today_cumsum),
+        }
@@ -2,10 +2,14 @@
 地點合併工具 - 根據座標自動分群，並產生建議的合併規則
 """
 
+import os
+import sys
+
 import pandas as pd
-import numpy as np
-from scipy.cluster.hierarchy import linkage, fcluster
-from scipy.spatial.distance import pdist
+
+# 共用 src/geo.py 的向量化距離與分群樹
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from geo import haversine_matrix, LinkageTree
 
 # 載入資料
 df_coords = pd.read_csv('../../data_after_process/unique_locations.csv', encoding='utf-8-sig')
@@ -14,32 +18,18 @@ print("\n原始地點列表:")
 for i, row in df_coords.iterrows():
     print(f"  {i+1}. {row['Location']}")
 
-# 計算 Haversine 距離 (公尺)
-def haversine(coord1, coord2):
-    lat1, lon1 = np.radians(coord1)
-    lat2, lon2 = np.radians(coord2)
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-    return 6371000 * 2 * np.arcsin(np.sqrt(a))
-
 # 準備座標矩陣
 coords = df_coords[['Latitude', 'Longitude']].values
 locations = df_coords['Location'].tolist()
 
-# 計算距離矩陣
-n = len(coords)
-dist_matrix = np.zeros((n, n))
-for i in range(n):
-    for j in range(i+1, n):
-        d = haversine(coords[i], coords[j])
-        dist_matrix[i, j] = d
-        dist_matrix[j, i] = d
+# 計算 Haversine 距離矩陣 (公尺)，一次向量化算完
+dist_matrix = haversine_matrix(coords)
 
 print(f"\n📏 距離範圍: {dist_matrix[dist_matrix > 0].min():.0f}m ~ {dist_matrix.max():.0f}m")
 
 # 使用階層式分群 (Hierarchical Clustering)
-# 設定不同的距離閾值
+# 使用 complete linkage (最遠距離)，分群樹只建一次，再用不同的距離閾值切割
+tree = LinkageTree(coords, method='complete', dedupe=False)
 thresholds = [50, 100, 150, 200]
 
 print("\n" + "=" * 70)
@@ -47,10 +37,7 @@ print("🔍 自動分群建議 (根據不同距離閾值)")
 print("=" * 70)
 
 for threshold in thresholds:
-    # 使用 complete linkage (最遠距離)
-    condensed_dist = pdist(coords, metric=lambda u, v: haversine(u, v))
-    Z = linkage(condensed_dist, method='complete')
-    clusters = fcluster(Z, t=threshold, criterion='distance')
+    clusters = tree.cut(threshold)
     
     n_clusters = len(set(clusters))
     print(f"\n📦 閾值 {threshold}m → {n_clusters} 個群組")
@@ -71,9 +58,7 @@ print("\n" + "=" * 70)
 print("📋 建議合併規則 (100m 閾值，你可以手動調整)")
 print("=" * 70)
 
-condensed_dist = pdist(coords, metric=lambda u, v: haversine(u, v))
-Z = linkage(condensed_dist, method='complete')
-clusters = fcluster(Z, t=100, criterion='distance')
+clusters = tree.cut(100)
 
 # 建立分群結果
 cluster_dict = {}
@@ -0,0 +1,278 @@
+"""
+合併爬蟲匯出的 中山大學違規紀錄總表N.xlsx - 多個行程同時讀取各活頁簿，欄位統一成 plate.py 使用的格式，
+刪除分頁列、依 序號 去除重複抓取的分頁後，依 舉發日期 的月份分區寫成 parquet 資料集 (month=YYYY-MM/)
+之後的步驟以 read_store(start, end) 只讀需要的月份，不必每次重新讀取全部 Excel
+
+活頁簿直接以 zipfile + ElementTree 串流解析工作表 XML (只有字串儲存格)，比 openpyxl 快；
+遇到數字、日期等其他儲存格型別時該活頁簿改用 pd.read_excel
+
+python tools/consolidate.py                # 在 Car_Violation 目錄下執行
+python tools/consolidate.py --verify --benchmark
+"""
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from preprocess import DATE_COL, NOISE_KEYWORD, to_typed
+
+INPUT_PATTERN = 'rawdata/中山大學違規紀錄總表*.xlsx'
+STORE_DIR = 'data_after_process/violations'
+COLUMNS = ['序號', '車牌號碼', '違規地點', '違規事由', '處理方式', '聯絡人', '舉發日期', '處理限期', '繳款日期', '提出申訴']
+KEY_COL = '序號'
+PARTITION_COL = 'month'
+UNKNOWN_MONTH = 'unknown'  # 舉發日期 無法解析的列
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+# ==========================================
+# 1. 讀取單一活頁簿
+# ==========================================
+class UnsupportedCell(ValueError):
+    pass
+
+
+def _column_index(ref):
+    """'C12' -> 2"""
+    n = 0
+    for ch in ref:
+        if ch.isdigit():
+            break
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def _first_sheet(z):
+    """由 workbook.xml 與其 rels 找出第一個工作表在 zip 中的路徑"""
+    sheet = ET.fromstring(z.read('xl/workbook.xml')).find(f'{NS}sheets/{NS}sheet')
+    rid = sheet.get(f'{REL_NS}id')
+    for rel in ET.fromstring(z.read('xl/_rels/workbook.xml.rels')):
+        if rel.get('Id') == rid:
+            target = rel.get('Target')
+            return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    raise KeyError(rid)
+
+
+def read_sheet_xml(path):
+    """
+    串流解析第一個工作表 (共用字串 / inline 字串)，第一列為欄名，空白儲存格為 NaN
+    其他儲存格型別 (數字、日期、公式) 會丟出 UnsupportedCell
+    """
+    with zipfile.ZipFile(path) as z:
+        shared = []
+        if 'xl/sharedStrings.xml' in z.namelist():
+            shared = [''.join(si.itertext()) for si in ET.fromstring(z.read('xl/sharedStrings.xml'))]
+        rows = []
+        with z.open(_first_sheet(z)) as f:
+            for _, row in ET.iterparse(f):
+                if row.tag != NS + 'row':
+                    continue
+                values = {}
+                for cell in row:
+                    kind = cell.get('t')
+                    if kind == 'inlineStr':
+                        text = ''.join(cell.itertext())
+                    elif kind == 's':
+                        text = shared[int(cell.findtext(NS + 'v'))]
+                    elif kind == 'str' or len(cell) == 0:
+                        text = cell.findtext(NS + 'v') or ''
+                    else:
+                        raise UnsupportedCell(f"{path}: {cell.get('r')} t={kind}")
+                    if text:
+                        values[_column_index(cell.get('r'))] = text
+                rows.append(values)
+                row.clear()
+    if not rows:
+        return pd.DataFrame()
+    positions = sorted(rows[0])
+    df = pd.DataFrame([[r.get(i) for i in positions] for r in rows[1:]], columns=[rows[0][i] for i in positions])
+    return df.astype(str).where(df.notna())
+
+
+def read_workbook(path):
+    """回傳欄位統一成 COLUMNS 的字串 DataFrame (多的欄位丟棄，缺少的欄位為 NaN)"""
+    try:
+        df = read_sheet_xml(path)
+    except UnsupportedCell:
+        df = pd.read_excel(path, dtype=str, keep_default_na=False, na_values=[''])
+    df = df.rename(columns=lambda c: str(c).strip())
+    return df.reindex(columns=COLUMNS)
+
+
+def workbook_paths(pattern=INPUT_PATTERN):
+    """依檔名中的編號排序 (總表2 在 總表10 之前)，也就是爬取時的頁碼順序"""
+    def number(path):
+        found = re.findall(r'\d+', os.path.basename(path))
+        return int(found[-1]) if found else -1
+    return sorted(glob.glob(pattern), key=lambda p: (number(p), p))
+
+
+# ==========================================
+# 2. 合併、去重、分區寫入
+# ==========================================
+def read_workbooks(paths, workers=None):
+    """多個行程同時讀取，回傳與 paths 同順序的 DataFrame 列表"""
+    workers = max(1, min(workers or os.cpu_count(), len(paths)))
+    if workers == 1:
+        return [read_workbook(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_workbook, paths))
+
+
+def drop_noise_rows(df):
+    """刪除任一欄含有 每頁紀錄 的分頁列，回傳 (新 DataFrame, 刪除列數)"""
+    noise = np.zeros(len(df), dtype=bool)
+    for col in df.columns:
+        noise |= df[col].str.contains(NOISE_KEYWORD, regex=False, na=False).values
+    return df[~noise], int(noise.sum())
+
+
+def consolidate(paths, workers=None):
+    """
+    讀取全部活頁簿並合併，回傳 (型別化的 DataFrame, 統計)
+    同一 序號 出現多次 (相鄰爬取範圍重疊的分頁) 時保留檔案編號 / 列順序最前面的一筆
+    """
+    frames = read_workbooks(paths, workers)
+    df = pd.concat(frames, ignore_index=True)
+    df, n_noise = drop_noise_rows(df)
+    duplicated = df[KEY_COL].notna() & df.duplicated(KEY_COL)
+    df = to_typed(df[~duplicated].reset_index(drop=True))
+    df[PARTITION_COL] = df[DATE_COL].dt.strftime('%Y-%m').fillna(UNKNOWN_MONTH)
+    stats = {'workbooks': len(paths), 'rows': sum(len(frame) for frame in frames), 'noise': n_noise,
+             'duplicates': int(duplicated.sum()), 'kept': len(df)}
+    return df, stats
+
+
+def write_store(df, store_dir=STORE_DIR):
+    """整個資料集重寫 (先刪除舊的分區，避免留下已不存在的月份)"""
+    shutil.rmtree(store_dir, ignore_errors=True)
+    df.to_parquet(store_dir, partition_cols=[PARTITION_COL], index=False)
+    return df[PARTITION_COL].nunique()
+
+
+def read_store(store_dir=STORE_DIR, start=None, end=None, columns=None):
+    """
+    讀取合併後的資料集，start / end 為 'YYYY-MM' (含)，只讀範圍內的月份分區 (不含日期無法解析的 unknown)
+    columns 指定時只讀這些欄位
+    """
+    filters = [(PARTITION_COL, '!=', UNKNOWN_MONTH)] if start or end else []
+    if start:
+        filters.append((PARTITION_COL, '>=', start))
+    if end:
+        filters.append((PARTITION_COL, '<=', end))
+    df = pd.read_parquet(store_dir, columns=columns, filters=filters or None)
+    if PARTITION_COL in df.columns:
+        df[PARTITION_COL] = df[PARTITION_COL].astype(str)
+    return df
+
+
+# ==========================================
+# 3. 驗證與效能測試
+# ==========================================
+def verify(pattern=INPUT_PATTERN):
+    paths = workbook_paths(pattern)
+    for path in paths:
+        expected = pd.read_excel(path, dtype=str, keep_default_na=False, na_values=['']).reindex(columns=COLUMNS)
+        pd.testing.assert_frame_equal(read_workbook(path), expected, check_dtype=False)
+    print(f"✅ {len(paths)} 個活頁簿的 XML 解析結果與 pd.read_excel 相同")
+
+    df, stats = consolidate(paths)
+    assert df[KEY_COL].is_unique and not df[KEY_COL].isna().any()
+    assert not df.astype(str).apply(lambda c: c.str.contains(NOISE_KEYWORD, regex=False)).any().any()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        store_dir = os.path.join(tmp_dir, 'violations')
+        write_store(df, store_dir)
+        back = read_store(store_dir).sort_values(KEY_COL, ignore_index=True)
+        expected = df.sort_values(KEY_COL, ignore_index=True)
+        pd.testing.assert_frame_equal(back[expected.columns], expected, check_dtype=False, check_categorical=False)
+        months = sorted(m for m in df[PARTITION_COL].unique() if m != UNKNOWN_MONTH)
+        start, end = months[len(months) // 2], months[-1]
+        part = read_store(store_dir, start, end)
+        assert len(part) == df[PARTITION_COL].between(start, end).sum()
+        assert part[PARTITION_COL].between(start, end).all()
+    finally:
+        shutil.rmtree(tmp_dir)
+    print(f"✅ 合併 {stats['rows']:,} 筆 -> {stats['kept']:,} 筆 (分頁列 {stats['noise']:,}、重複序號 "
+          f"{stats['duplicates']:,})，序號唯一；資料集讀回相同，{start} ~ {end} 只讀 {len(part):,} 筆")
+
+
+def benchmark(pattern=INPUT_PATTERN, workers=None):
+    paths = workbook_paths(pattern)
+    t0 = time.perf_counter()
+    legacy = [pd.read_excel(path, dtype=str) for path in paths]
+    openpyxl_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    read_workbooks(paths, workers=1)
+    xml_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    read_workbooks(paths, workers)
+    parallel_seconds = time.perf_counter() - t0
+    n_workers = max(1, min(workers or os.cpu_count(), len(paths)))
+    n_rows = sum(len(df) for df in legacy)
+    print(f"{len(paths)} 個活頁簿 / {n_rows:,} 筆:")
+    print(f"   pd.read_excel (openpyxl) 依序: {openpyxl_seconds:6.2f}s")
+    print(f"   XML 串流解析 依序:            {xml_seconds:6.2f}s ({openpyxl_seconds / xml_seconds:.1f}x)")
+    print(f"   XML 串流解析 {n_workers} 個行程:        {parallel_seconds:6.2f}s ({openpyxl_seconds / parallel_seconds:.1f}x)")
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        store_dir = os.path.join(tmp_dir, 'violations')
+        df, _ = consolidate(paths, workers)
+        write_store(df, store_dir)
+        t0 = time.perf_counter()
+        read_store(store_dir)
+        full = time.perf_counter() - t0
+        last = sorted(m for m in df[PARTITION_COL].unique() if m != UNKNOWN_MONTH)[-12]
+        t0 = time.perf_counter()
+        part = read_store(store_dir, start=last)
+        recent = time.perf_counter() - t0
+        print(f"   讀取資料集: 全部 {full:.3f}s，最近 12 個月 ({len(part):,} 筆) {recent:.3f}s")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main(pattern=INPUT_PATTERN, store_dir=STORE_DIR, workers=None):
+    paths = workbook_paths(pattern)
+    if not paths:
+        print(f"找不到符合 {pattern} 的檔案")
+        return
+    print(f"🚀 讀取 {len(paths)} 個活頁簿: {', '.join(os.path.basename(p) for p in paths)}")
+    t0 = time.perf_counter()
+    df, stats = consolidate(paths, workers)
+    n_partitions = write_store(df, store_dir)
+    print(f"共 {stats['rows']:,} 筆，刪除分頁列 {stats['noise']:,} 筆、重複序號 {stats['duplicates']:,} 筆，"
+          f"保留 {stats['kept']:,} 筆")
+    dates = df[DATE_COL].dropna()
+    print(f"{DATE_COL} {dates.min():%Y-%m-%d} ~ {dates.max():%Y-%m-%d}，"
+          f"無法解析 {(df[PARTITION_COL] == UNKNOWN_MONTH).sum()} 筆")
+    print(f"處理完成！已依月份寫成 {n_partitions} 個分區至 {store_dir} ({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合併爬蟲匯出的 Excel 成依月份分區的 parquet 資料集")
+    parser.add_argument('--input', default=INPUT_PATTERN, help="活頁簿路徑 (glob)")
+    parser.add_argument('--output', default=STORE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help="同時讀取的行程數 (預設為 CPU 核心數)")
+    parser.add_argument('--verify', action='store_true', help="確認 XML 解析與 pd.read_excel 相同、資料集可正確讀回")
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+
+    if args.verify:
+        verify(args.input)
+    if args.benchmark:
+        benchmark(args.input, args.workers)
+    if not (args.verify or args.benchmark):
+        main(args.input, args.output, args.workers)
@@ -1,14 +1,8 @@
-import pandas as pd
+import argparse
+import time
 
-# 1. 讀取清洗後的資料
-input_filename = '../../data_after_process/violate_cleaned.csv'
-try:
-    with open(input_filename, 'r', encoding='utf-8-sig') as f:
-        df = pd.read_csv(f)
-    print(f"成功讀取 {input_filename}，共 {len(df)} 筆資料。")
-except FileNotFoundError:
-    print(f"找不到檔案 {input_filename}，請確認檔名是否正確。")
-    exit()
+import numpy as np
+import pandas as pd
 
 # ==========================================
 # 邏輯 A: 車牌規則辨識 (V5 - 備用)
@@ -75,25 +69,199 @@ def determine_vehicle_type(row):
         # 舊式序號 -> 使用車牌規則
         return classify_by_plate_v5(plate)
 
-# 3. 應用函數
-# 這裡使用 axis=1 因為我們需要同時讀取 '序號' 和 '車牌號碼'
-print("正在依照「序號優先」規則進行分類...")
-df['Vehicle_Type'] = df.apply(determine_vehicle_type, axis=1)
+# ==========================================
+# 邏輯 C: 向量化版本 (結果與 determine_vehicle_type 逐列相同)
+# ==========================================
+SCOOTER_FIRST_CHARS = 'MNPQWLE'
+PRINTABLE_ASCII = r'[\x20-\x7e]*'
+
+
+def _as_text(col):
+    """等同逐列 str(x)：缺值變成 'nan' (長度不足，不影響判斷)"""
+    if pd.api.types.is_string_dtype(col.dtype) and col.dtype != object:
+        return col.fillna('nan')
+    return col.map(str)
+
+
+def classify_plates(plates):
+    """
+    向量化的 classify_by_plate_v5 (plates 需為可列印 ASCII 字串)
+    相同車牌只判斷一次，再展開回每一列
+    """
+    codes, uniques = pd.factorize(plates)
+    raw = pd.Series(uniques, dtype=str).str.replace('-', '', regex=False).str.replace(' ', '', regex=False).str.upper()
+    length = raw.str.len().values
+    alphas = raw.str.count('[A-Z]').values
+    digits = raw.str.count('[0-9]').values
+    first = raw.str[:1]
+    std_start = raw.str.match('[A-Z]{2}').values
+    std_end = raw.str.contains('[A-Z]{2}$').values
+
+    len7, len6 = length == 7, length == 6
+    labels = np.select(
+        [len7 & ((alphas == 2) | first.isin(list(SCOOTER_FIRST_CHARS)).values),
+         len7,
+         len6 & (alphas == 3) & (digits == 3),
+         len6 & (alphas == 2) & (digits == 4) & (std_start | std_end),
+         len6 & (alphas == 2) & (digits == 4),
+         len6 & (alphas == 1) & (digits == 5)],
+        ['Scooter', 'Car', 'Scooter', 'Car', 'Scooter', 'Car'],
+        default='Other',
+    )
+    return labels[codes]
+
+
+def classify_vehicle_types(df, serial_col='序號', plate_col='車牌號碼'):
+    """
+    向量化的 determine_vehicle_type，回傳與 df 同索引的 Vehicle_Type
+    含非 ASCII / 控制字元的少數列 (isalpha / isdigit / strip 的 Unicode 規則較複雜) 改用原本的逐列函數
+    """
+    sid = _as_text(df[serial_col])
+    plate = _as_text(df[plate_col])
+    simple = (sid.str.fullmatch(PRINTABLE_ASCII) & plate.str.fullmatch(PRINTABLE_ASCII)).values
+
+    out = np.full(len(df), 'Other', dtype=object)
+    sid_s, plate_s = sid[simple].str.strip(), plate[simple].str.strip()
+
+    # 新式序號：數字開頭且長度 >= 11，第 11 碼 1 = 機車、2 = 汽車；其餘退回車牌判斷
+    indicator = sid_s.str[10].where(sid_s.str.match('[0-9].{10}'), '').values
+    labels = np.where(indicator == '1', 'Scooter', np.where(indicator == '2', 'Car', None)).astype(object)
+    by_plate = labels == None  # noqa: E711
+    labels[by_plate] = classify_plates(plate_s[by_plate])
+    out[simple] = labels
+
+    if not simple.all():
+        rest = pd.DataFrame({'序號': sid[~simple].values, '車牌號碼': plate[~simple].values})
+        out[~simple] = rest.apply(determine_vehicle_type, axis=1).values
+    return pd.Series(out, index=df.index, name='Vehicle_Type')
+
+
+# ==========================================
+# 驗證與效能測試
+# ==========================================
+_PLATE_CHARS = list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789') * 3 + \
+    list('MNPQWLE') * 4 + list('-  ') + ['\t', '\x1c', '１', '²', 'ß', '車', 'Ａ', '\u3000', 'ı', '_', '.']
+
 
-# 4. 分流資料
-valid_data = df[df['Vehicle_Type'] != 'Other']
-wrong_plate_data = df[df['Vehicle_Type'] == 'Other']
+def _random_strings(rng, n, chars, max_len):
+    lengths = rng.choice(np.r_[0:max_len + 1, [6] * max_len, [7] * max_len], n)
+    pool = np.array(chars)
+    return [''.join(pool[rng.integers(0, len(pool), k)]) for k in lengths]
 
-# 5. 存檔
-output_valid = 'violate_with_type.csv'
-valid_data.to_csv(output_valid, index=False, encoding='utf-8-sig')
 
-output_wrong = 'wrong_plate.csv'
-wrong_plate_data.to_csv(output_wrong, index=False, encoding='utf-8-sig')
+def _random_violations(n, seed=0):
+    """隨機序號與車牌 (含 6 / 7 碼、分隔符號、小寫、全形、Unicode 數字與字母、缺值)"""
+    rng = np.random.default_rng(seed)
+    plates = _random_strings(rng, n, _PLATE_CHARS, 9)
+    serials = _random_strings(rng, n, list('0123456789') * 5 + list('12') * 10 + list('ZDRH ') + ['１'], 20)
+    plates = pd.Series(plates, dtype=object)
+    serials = pd.Series(serials, dtype=object)
+    plates[rng.random(n) < 0.02] = np.nan
+    serials[rng.random(n) < 0.02] = np.nan
+    return pd.DataFrame({'序號': serials, '車牌號碼': plates})
 
-print("-" * 30)
-print("處理完成！(序號判斷優先: 1=機車, 2=汽車)")
-print(f"1. 有效資料 '{output_valid}':")
-print(f"   - Car (汽車): {len(valid_data[valid_data['Vehicle_Type'] == 'Car'])} 筆")
-print(f"   - Scooter (機車): {len(valid_data[valid_data['Vehicle_Type'] == 'Scooter'])} 筆")
-print(f"2. 異常/無法辨識資料 '{output_wrong}': {len(wrong_plate_data)} 筆")
\ No newline at end of file
+
+def verify(n=200_000, seeds=(0, 1, 2), real_path='../../rawdata/violate.csv'):
+    """隨機產生的資料與真實資料上，向量化結果都必須與逐列 apply 完全相同"""
+    cases = [_random_violations(n, seed) for seed in seeds]
+    cases += [case.astype(str) for case in cases[:1]]  # pandas 預設字串型別
+    try:
+        with open(real_path, 'r', encoding='big5', errors='replace') as f:
+            cases.append(pd.read_csv(f, sep='\t', dtype=str))
+    except FileNotFoundError:
+        pass
+    for df in cases:
+        expected = df.apply(determine_vehicle_type, axis=1)
+        got = classify_vehicle_types(df)
+        mismatch = (got.values != expected.values)
+        assert not mismatch.any(), df[mismatch].assign(expected=expected[mismatch], got=got[mismatch]).head()
+        print(f"✅ {len(df):,} 筆一致 ({expected.value_counts().to_dict()})")
+
+
+def _fill_template(rng, template, n):
+    """依樣板產生 n 個字串：A = 英文字母、9 = 數字，其餘字元照抄"""
+    letters = np.frombuffer(b'ABCDEFGHJKLMNPQRSTUVWXYZ', dtype=np.uint8)
+    digits = np.frombuffer(b'0123456789', dtype=np.uint8)
+    chars = np.empty((n, len(template)), dtype=np.uint8)
+    for i, c in enumerate(template):
+        pool = letters if c == 'A' else digits if c == '9' else np.frombuffer(c.encode(), dtype=np.uint8)
+        chars[:, i] = pool[rng.integers(0, len(pool), n)]
+    return chars.view(f'S{len(template)}').ravel().astype(str)
+
+
+def _realistic_violations(n, seed=0, noise=0.001):
+    """常見格式的車牌與新舊式序號 (序號第 11 碼為 1 / 2 / 其他)，少量含中文的雜訊"""
+    rng = np.random.default_rng(seed)
+    plate_templates = ['AAA-9999', '999-AAA', 'AA-9999', '9999-AA', '9A-9999', '99-A999', '999999', 'A99-999']
+    serial_templates = ['99999999991999990Z', '99999999992999990Z', '99999999990999990Z', 'DR9999999', 'H999999']
+    plates = np.empty(n, dtype=object)
+    serials = np.empty(n, dtype=object)
+    for out, templates in ((plates, plate_templates), (serials, serial_templates)):
+        choice = rng.integers(0, len(templates), n)
+        for i, template in enumerate(templates):
+            mask = choice == i
+            out[mask] = _fill_template(rng, template, mask.sum())
+    noisy = rng.random(n) < noise
+    plates[noisy] = plates[noisy] + '車'
+    return pd.DataFrame({'序號': serials, '車牌號碼': plates}).astype(str)
+
+
+def benchmark(n=10_000_000, legacy_n=100_000):
+    df = _realistic_violations(n)
+    t0 = time.perf_counter()
+    expected = df.iloc[:legacy_n].apply(determine_vehicle_type, axis=1)
+    legacy = (time.perf_counter() - t0) / legacy_n * n
+    assert (classify_vehicle_types(df.iloc[:legacy_n]).values == expected.values).all()
+    t0 = time.perf_counter()
+    classify_vehicle_types(df)
+    fast = time.perf_counter() - t0
+    print(f"{n:,} 筆: 向量化 {fast:.1f}s，apply 估計 {legacy:.0f}s ({legacy / fast:.0f}x)")
+
+
+def main():
+    # 1. 讀取清洗後的資料
+    input_filename = '../../data_after_process/violate_cleaned.csv'
+    try:
+        with open(input_filename, 'r', encoding='utf-8-sig') as f:
+            df = pd.read_csv(f)
+        print(f"成功讀取 {input_filename}，共 {len(df)} 筆資料。")
+    except FileNotFoundError:
+        print(f"找不到檔案 {input_filename}，請確認檔名是否正確。")
+        exit()
+
+    # 3. 應用函數
+    # 整欄一次分類 (同時依 '序號' 與 '車牌號碼' 判斷)
+    print("正在依照「序號優先」規則進行分類...")
+    df['Vehicle_Type'] = classify_vehicle_types(df)
+
+    # 4. 分流資料
+    valid_data = df[df['Vehicle_Type'] != 'Other']
+    wrong_plate_data = df[df['Vehicle_Type'] == 'Other']
+
+    # 5. 存檔
+    output_valid = 'violate_with_type.csv'
+    valid_data.to_csv(output_valid, index=False, encoding='utf-8-sig')
+
+    output_wrong = 'wrong_plate.csv'
+    wrong_plate_data.to_csv(output_wrong, index=False, encoding='utf-8-sig')
+
+    print("-" * 30)
+    print("處理完成！(序號判斷優先: 1=機車, 2=汽車)")
+    print(f"1. 有效資料 '{output_valid}':")
+    print(f"   - Car (汽車): {len(valid_data[valid_data['Vehicle_Type'] == 'Car'])} 筆")
+    print(f"   - Scooter (機車): {len(valid_data[valid_data['Vehicle_Type'] == 'Scooter'])} 筆")
+    print(f"2. 異常/無法辨識資料 '{output_wrong}': {len(wrong_plate_data)} 筆")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="依序號與車牌判斷車種")
+    parser.add_argument('--verify', action='store_true', help="確認向量化結果與逐列 apply 相同")
+    parser.add_argument('--benchmark', action='store_true', help="1000 萬筆的效能測試")
+    args = parser.parse_args()
+
+    if args.verify:
+        verify()
+    elif args.benchmark:
+        benchmark()
+    else:
+        main()
@@ -1,36 +1,318 @@
+import argparse
+import csv
+import io
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+# 舉發日期 與增量匯入 / 訓練 / 評分服務共用 src/ingest.py 的解析
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ingest import parse_ticket_dates
+
+ENCODING = 'big5'
+NOISE_KEYWORD = "每頁紀錄"  # 爬蟲分頁列 (該列每一欄都是「每頁紀錄數 - 1 5 10 25 50 ...」)
+DATE_COL = '舉發日期'
+CATEGORY_COLS = ['違規地點', '違規事由', '處理方式']
+BLOCK_SIZE = 16 << 20  # 每次讀取 16 MB (逐塊寫出時峰值記憶體約為區塊大小的 20 倍，與檔案大小無關)
+
+
+# ==========================================
+# 1. 分隔符號偵測與分頁列過濾 (位元組層級)
+# ==========================================
+def sniff_header(path, sample_size=64 * 1024):
+    """只讀檔案開頭，由標題列判斷分隔符號，回傳 (分隔符號, 欄名)"""
+    with open(path, 'rb') as f:
+        header = f.read(sample_size).decode(ENCODING, errors='replace').splitlines()[0]
+    sep = csv.Sniffer().sniff(header).delimiter
+    return sep, next(csv.reader([header], delimiter=sep))
+
+
+def drop_noise_lines(block, keyword=NOISE_KEYWORD.encode(ENCODING)):
+    """
+    刪除 block (以換行結尾的 bytes) 中含有 keyword 的整行，回傳 (新 block, 刪除行數)
+    只在關鍵字出現處往前後找換行，不逐行比對；分頁列很少，所以幾乎等於一次 bytes.find 掃描
+    """
+    parts, start, n_dropped = [], 0, 0
+    pos = block.find(keyword)
+    while pos >= 0:
+        line_start = block.rfind(b'\n', 0, pos) + 1
+        line_end = block.find(b'\n', pos)
+        line_end = len(block) if line_end < 0 else line_end + 1
+        parts.append(block[start:line_start])
+        start = line_end
+        n_dropped += 1
+        pos = block.find(keyword, line_end)
+    parts.append(block[start:])
+    return b''.join(parts), n_dropped
+
+
+def iter_blocks(path, block_size=BLOCK_SIZE):
+    """依序回傳約 block_size 大小、切在換行處的 bytes (第一塊含標題列)"""
+    with open(path, 'rb') as f:
+        rest = b''
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            block = rest + data
+            cut = block.rfind(b'\n') + 1
+            block, rest = block[:cut], block[cut:]
+            if block:
+                yield block
+        if rest:
+            yield rest
+
+
+# ==========================================
+# 2. 型別轉換
+# ==========================================
+def parse_block(block, sep, columns, skip_header=False):
+    """
+    解碼 Big5 (無法辨識的字元以 U+FFFD 取代，同原本 errors='replace') 後以 pyarrow 解析；
+    全部欄位指定為字串 (不推斷型別)，空欄位為 NaN
+    """
+    text = block.decode(ENCODING, errors='replace').encode('utf-8')
+    table = pa_csv.read_csv(
+        io.BytesIO(text),
+        read_options=pa_csv.ReadOptions(column_names=columns, skip_rows=1 if skip_header else 0),
+        parse_options=pa_csv.ParseOptions(delimiter=sep),
+        convert_options=pa_csv.ConvertOptions(column_types={col: pa.string() for col in columns},
+                                              strings_can_be_null=True))
+    return table.to_pandas()
+
+
+def to_typed(df):
+    """舉發日期 -> datetime64，違規地點 / 違規事由 / 處理方式 -> category，其餘維持字串"""
+    df[DATE_COL] = parse_ticket_dates(df[DATE_COL])
+    for col in CATEGORY_COLS:
+        df[col] = df[col].astype('category')
+    return df
+
+
+def concat_chunks(chunks):
+    """合併各區塊 (category 欄位以 union_categoricals 合併，不退回字串)"""
+    if not chunks:
+        return pd.DataFrame()
+    out = pd.concat([chunk.drop(columns=CATEGORY_COLS, errors='ignore') for chunk in chunks], ignore_index=True)
+    for col in CATEGORY_COLS:
+        if col in chunks[0].columns:
+            out[col] = pd.Series(union_categoricals([chunk[col] for chunk in chunks]), index=out.index)
+    return out[chunks[0].columns]
+
+
+# ==========================================
+# 3. 讀取原始檔
+# ==========================================
+def iter_violations(path, typed=True, block_size=BLOCK_SIZE):
+    """
+    逐塊讀取 violate.csv (Big5)，每塊產生 (DataFrame, 該塊刪除的分頁列數)；同時只有一塊在記憶體中
+    分隔符號只偵測一次，分頁列在解析前以位元組比對刪除，每塊以 pyarrow 解析 (全部欄位先讀成字串)；
+    typed=True 時轉成日期 / category 欄位
+    """
+    sep, columns = sniff_header(path)
+    for i, block in enumerate(iter_blocks(path, block_size)):
+        block, n_dropped = drop_noise_lines(block)
+        chunk = parse_block(block, sep, columns, skip_header=i == 0)
+        yield (to_typed(chunk) if typed else chunk), n_dropped
+
+
+def load_violations(path, typed=True, block_size=BLOCK_SIZE):
+    """整個檔案讀進記憶體 (iter_violations 的各塊合併)，回傳 (DataFrame, 刪除的分頁列數)"""
+    chunks, n_noise = [], 0
+    for chunk, n_dropped in iter_violations(path, typed, block_size):
+        chunks.append(chunk)
+        n_noise += n_dropped
+    return concat_chunks(chunks) if typed else pd.concat(chunks, ignore_index=True), n_noise
+
+
+def typed_schema(columns):
+    """型別化輸出的固定 parquet schema (每塊的 category 編碼長度不同，統一成 int32 字典)"""
+    fields = []
+    for col in columns:
+        if col == DATE_COL:
+            fields.append(pa.field(col, pa.timestamp('us')))
+        elif col in CATEGORY_COLS:
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+
+def clean_file(input_filename, output_filename, parquet_filename=None, block_size=BLOCK_SIZE):
+    """
+    逐塊清洗並附加寫出 csv (utf-8-sig，保留原始字串) 與 (選用) 型別化 parquet，記憶體只與區塊大小有關
+    回傳 (筆數, 刪除的分頁列數, 欄名)
+    """
+    n_rows, n_noise, columns, writer = 0, 0, None, None
+    try:
+        for chunk, n_dropped in iter_violations(input_filename, typed=False, block_size=block_size):
+            if columns is None:
+                columns = chunk.columns.tolist()
+                chunk.to_csv(output_filename, index=False, encoding='utf-8-sig')
+            else:
+                chunk.to_csv(output_filename, mode='a', header=False, index=False, encoding='utf-8')
+            if parquet_filename:
+                if writer is None:
+                    writer = pq.ParquetWriter(parquet_filename, typed_schema(columns))
+                writer.write_table(pa.Table.from_pandas(to_typed(chunk), schema=writer.schema, preserve_index=False))
+            n_rows += len(chunk)
+            n_noise += n_dropped
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows, n_noise, columns
+
+
+def legacy_load(path):
+    """原本的寫法：Python 引擎自動偵測分隔符號，逐列轉成字串比對關鍵字"""
+    with open(path, 'r', encoding=ENCODING, errors='replace') as f:
+        df = pd.read_csv(f, sep=None, engine='python')
+    mask = df.apply(lambda row: row.astype(str).str.contains(NOISE_KEYWORD).any(), axis=1)
+    return df[~mask]
+
+
+# ==========================================
+# 4. 驗證與效能測試
+# ==========================================
+def verify(path='rawdata/violate.csv'):
+    expected = legacy_load(path)
+    got, n_noise = load_violations(path, typed=False, block_size=256 * 1024)  # 小區塊，確認跨區塊正確
+    pd.testing.assert_frame_equal(got, expected.astype(str).where(expected.notna()).reset_index(drop=True),
+                                  check_dtype=False)
+    typed, _ = load_violations(path, block_size=256 * 1024)
+    mixed = pd.to_datetime(got[DATE_COL], errors='coerce', format='mixed')
+    assert typed[DATE_COL].equals(mixed), "舉發日期 解析結果與 format='mixed' 不同"
+    for col in CATEGORY_COLS:
+        assert isinstance(typed[col].dtype, pd.CategoricalDtype)
+        assert typed[col].astype(object).where(typed[col].notna()).equals(got[col].astype(object).where(got[col].notna()))
+    print(f"✅ {len(got):,} 筆與原本的清洗結果一致 (刪除 {n_noise} 筆分頁列)，"
+          f"{DATE_COL} 與 format='mixed' 相同，NaT {typed[DATE_COL].isna().sum()} 筆")
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        csv_path, parquet_path = os.path.join(tmp_dir, 'cleaned.csv'), os.path.join(tmp_dir, 'cleaned.parquet')
+        clean_file(path, csv_path, parquet_path, block_size=256 * 1024)
+        streamed = pd.read_csv(csv_path, encoding='utf-8-sig', dtype=str, keep_default_na=False, na_values=[''])
+        pd.testing.assert_frame_equal(streamed, got, check_dtype=False)
+        pd.testing.assert_frame_equal(pd.read_parquet(parquet_path), typed, check_dtype=False,
+                                      check_categorical=False)
+    finally:
+        shutil.rmtree(tmp_dir)
+    print("✅ 逐塊寫出的 csv / parquet 與整檔讀取相同")
+
+
+def _synthetic_block(n_rows, seed=0, page_size=50):
+    """模擬 violate.csv 的一段 (Big5 bytes，不含標題列)：每 page_size 筆一列分頁列，少數日期格式不同"""
+    rng = np.random.default_rng(seed)
+    places = np.array([f'停車場{i}' for i in range(200)] + ['生科館後', 'L 棟', '行政大樓', '理工大樓'])
+    reasons = np.array(['未依學校規定區域停放', '未依規定停放', '占用身障車位'])
+    times = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 3 * 365 * 86400, n_rows), unit='s')
+    dates = times.strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=object)
+    odd = rng.random(n_rows)
+    dates[odd < 0.09] = times[odd < 0.09].strftime('%Y-%m-%d')
+    dates[(odd >= 0.09) & (odd < 0.14)] = times[(odd >= 0.09) & (odd < 0.14)].strftime('%Y-%m-%d %H:%M')
+    df = pd.DataFrame({
+        '序號': pd.Series(rng.integers(10**17, 10**18, n_rows)).astype(str) + 'Z3',
+        '車牌號碼': pd.Series(rng.integers(1000, 9999, n_rows)).astype(str).radd('ABC'),
+        '違規地點': places[rng.integers(0, len(places), n_rows)],
+        '違規事由': reasons[rng.integers(0, len(reasons), n_rows)],
+        '處理方式': np.where(rng.random(n_rows) < 0.5, '拖吊', '違規單'),
+        '聯絡人': np.where(rng.random(n_rows) < 0.7, '王小明', ''),
+        '舉發日期': dates,
+        '處理限期': '', '繳款日期': '', '提出申訴': '',
+    })
+    lines = df.to_csv(sep='\t', index=False, header=False).splitlines(keepends=True)
+    noise = '\t'.join([f"{NOISE_KEYWORD}數 -  1 5 10 25 50  1 之 2170"] * df.shape[1]) + '\n'
+    pages = [''.join(lines[i:i + page_size]) for i in range(0, len(lines), page_size)]
+    return (noise.join(pages)).encode(ENCODING)
+
+
+def _write_synthetic(path, size_mb=1024, block_rows=100_000):
+    header = '\t'.join(['序號', '車牌號碼', '違規地點', '違規事由', '處理方式', '聯絡人', '舉發日期',
+                        '處理限期', '繳款日期', '提出申訴']) + '\n'
+    block = _synthetic_block(block_rows)
+    with open(path, 'wb') as f:
+        f.write(header.encode(ENCODING))
+        for _ in range(max(1, round(size_mb * 2**20 / len(block)))):
+            f.write(block)
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
-print("正在讀取檔案並修正編碼問題...")
 
-# 1. 使用 Python 內建的 open() 來開啟檔案
-# 這樣我們可以使用 errors='replace' 來強制替換掉看不懂的亂碼 (0xf9)
-with open('rawdata/violate.csv', 'r', encoding='big5', errors='replace') as f:
-    # 2. 將處理過的檔案物件 f 丟給 read_csv
-    # sep=None 與 engine='python' 讓它自動偵測分隔符號 (解決整行變字串的問題)
-    df = pd.read_csv(f, sep=None, engine='python')
+def benchmark(size_mb=1024, legacy_mb=32):
+    """size_mb 的模擬檔：分塊 pyarrow 解析 (含型別轉換)；原本的寫法以 legacy_mb 的檔案實測後依大小換算"""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'violate.csv')
+        _write_synthetic(path, size_mb)
+        size = os.path.getsize(path) / 2**20
 
-print(f"原始資料讀取成功！資料形狀: {df.shape}")
-print("欄位名稱:", df.columns.tolist())
+        # 先量逐塊寫出 (峰值 RSS 為整個行程的最大值，所以要在整檔讀取之前量)
+        t0 = time.perf_counter()
+        n_rows, n_noise, _ = clean_file(path, os.path.join(tmp_dir, 'cleaned.csv'),
+                                        os.path.join(tmp_dir, 'cleaned.parquet'))
+        streamed = time.perf_counter() - t0
+        print(f"{size:,.0f} MB / {n_rows:,} 筆 (刪除 {n_noise:,} 筆分頁列): 逐塊清洗並寫出 csv + parquet "
+              f"{streamed:.1f}s，行程峰值 RSS {_peak_rss_mb():,.0f} MB")
 
-# --- 以下是原本的清洗邏輯 ---
+        t0 = time.perf_counter()
+        df, n_noise = load_violations(path)
+        fast = time.perf_counter() - t0
+        mem = df.memory_usage(deep=True).sum() / 2**20
+        print(f"整檔讀進記憶體: 分塊 pyarrow 解析 {fast:.1f}s，"
+              f"結果 {mem:,.0f} MB，行程峰值 RSS {_peak_rss_mb():,.0f} MB")
+        del df
 
-# 定義要刪除的關鍵字
-keyword = "每頁紀錄"
+        small = os.path.join(tmp_dir, 'violate_small.csv')
+        _write_synthetic(small, legacy_mb)
+        small_size = os.path.getsize(small) / 2**20
+        t0 = time.perf_counter()
+        legacy_load(small)
+        legacy = (time.perf_counter() - t0) / small_size * size
+        print(f"原本的寫法 (Python 引擎 + 逐列 apply): {small_size:.0f} MB 實測，{size:,.0f} MB 估計 {legacy:,.0f}s "
+              f"({legacy / fast:.0f}x)")
+    finally:
+        shutil.rmtree(tmp_dir)
 
-# 建立過濾器 (Mask)
-mask = df.apply(lambda row: row.astype(str).str.contains(keyword).any(), axis=1)
 
-# 刪除包含關鍵字的列
-df_clean = df[~mask]
+def main(input_filename='rawdata/violate.csv', output_filename='violate_cleaned.csv', parquet_filename=None):
+    print("正在讀取檔案並修正編碼問題...")
+    # 逐塊附加寫出；csv 保留原始字串 (不轉型別)，下游 plate.py 讀到的內容與原本相同
+    # (存成 utf-8-sig 以便 Excel 開啟)
+    n_rows, n_noise, columns = clean_file(input_filename, output_filename, parquet_filename)
 
-# (選用) 移除沒有聯絡人的空資料
-# df_clean = df_clean.dropna(subset=['聯絡人'])
+    print(f"清洗後資料筆數: {n_rows}")
+    print(f"共刪除了 {n_noise} 筆雜訊資料")
+    print("欄位名稱:", columns)
+    print(f"處理完成！已儲存為 {output_filename}")
+    if parquet_filename:
+        print(f"已另存型別化欄位 ({DATE_COL}: datetime, {', '.join(CATEGORY_COLS)}: category) 至 {parquet_filename}")
 
-print(f"清洗後資料筆數: {len(df_clean)}")
-print(f"共刪除了 {len(df) - len(df_clean)} 筆雜訊資料")
 
-# 3. 儲存結果 (存成 utf-8-sig 以便 Excel 開啟)
-output_filename = 'violate_cleaned.csv'
-df_clean.to_csv(output_filename, index=False, encoding='utf-8-sig')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="清洗 violate.csv (刪除分頁列)")
+    parser.add_argument('--input', default='rawdata/violate.csv')
+    parser.add_argument('--output', default='violate_cleaned.csv')
+    parser.add_argument('--parquet', default=None, help="另存型別化欄位的 parquet 檔")
+    parser.add_argument('--verify', action='store_true', help="確認結果與原本的寫法相同")
+    parser.add_argument('--benchmark', action='store_true', help="1 GB 模擬檔的效能測試")
+    args = parser.parse_args()
 
-print(f"處理完成！已儲存為 {output_filename}")
\ No newline at end of file
+    if args.verify:
+        verify(args.input)
+    if args.benchmark:
+        benchmark()
+    if not (args.verify or args.benchmark):
+        main(args.input, args.output, args.parquet)
@@ -0,0 +1,343 @@
+"""
+超參數搜尋 - XGBoost 參數與 WINDOW_SIZE / FREQ 一起搜尋
+每組特徵 (FREQ, WINDOW_SIZE) 由 feature_store 讀取，在每個工作行程內只建立一次 QuantileDMatrix，所有試驗共用；
+試驗以多個行程平行執行 (核心數 = 行程數 x 每個 XGBoost 的 nthread)，
+以逐段加輪數的 successive halving 淘汰表現差的試驗，評分使用 notebook 的排序指標 (Hit Rate@K、NDCG)
+
+切分同 notebook：依日期前 80% 訓練、後 20% 測試；訓練期最後 VALID_FRAC 的日期另作驗證，
+early stopping、淘汰與挑選只看驗證期，測試期指標只用於報告
+"""
+
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import roc_auc_score
+
+from feature_store import KEEP, FeatureStore, default_inputs, load_features
+from metrics import SlotRanking
+from scoring import FEATURES
+
+TRAIN_FRAC = 0.8
+VALID_FRAC = 0.1
+EARLY_STOPPING = 50
+
+# notebook 的 params_clf (第一個試驗固定使用，作為比較基準)
+BASE_PARAMS = {
+    'eta': 0.0410,
+    'max_depth': 8,
+    'min_child_weight': 16,
+    'subsample': 0.6875,
+    'colsample_bytree': 0.5556,
+    'colsample_bylevel': 0.7,
+    'reg_alpha': 0.0047,
+    'reg_lambda': 0.0090,
+    'gamma': 0.4218,
+}
+
+# 參數: (分佈, 下限, 上限)
+SEARCH_SPACE = {
+    'eta': ('log', 0.01, 0.2),
+    'max_depth': ('int', 4, 10),
+    'min_child_weight': ('log', 1, 64),
+    'subsample': ('uniform', 0.5, 1.0),
+    'colsample_bytree': ('uniform', 0.4, 1.0),
+    'colsample_bylevel': ('uniform', 0.5, 1.0),
+    'reg_alpha': ('log', 1e-3, 1.0),
+    'reg_lambda': ('log', 1e-3, 10.0),
+    'gamma': ('uniform', 0.0, 1.0),
+}
+
+
+def sample_params(rng, space=SEARCH_SPACE):
+    params = {}
+    for name, (kind, low, high) in space.items():
+        if kind == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        elif kind == 'int':
+            params[name] = int(rng.integers(low, high + 1))
+        else:
+            params[name] = float(rng.uniform(low, high))
+    return params
+
+
+# ==========================================
+# 1. 資料 (一組 FREQ / WINDOW_SIZE 一份)
+# ==========================================
+def add_interactions(columns):
+    """notebook 的交互特徵"""
+    columns['risk_x_morning'] = columns['zone_baseline_risk'] * columns['is_morning_session']
+    columns['risk_x_afternoon'] = columns['zone_baseline_risk'] * columns['is_afternoon_session']
+    columns['risk_x_progress'] = columns['zone_baseline_risk'] * columns['session_progress']
+    columns['weekday_hour_risk'] = columns['zone_weekday_risk'] * columns['zone_weekday_hour_rate']
+    return columns
+
+
+def feature_matrix(grid, features):
+    """特徵矩陣 (float32)，列依 (時段, 區域) 的順序排列；連續時段範圍的切片不需複製"""
+    shape = grid.shape
+    columns = {name: values[:, None] if values.ndim == 1 else values for name, values in features.items()}
+    columns = add_interactions(columns)
+    X = np.empty((shape[0] * shape[1], len(FEATURES)), dtype=np.float32)
+    for j, name in enumerate(FEATURES):
+        X[:, j] = np.broadcast_to(columns[name], shape).reshape(-1)
+    return X
+
+
+def ranking_metrics(slots, zones, labels, predictions, ks=(3, 5, 10)):
+    """
+    notebook 的排序指標 + AUC
+    labels: (時段 x 區域) 取締數；predictions: 依 (時段, 區域) 順序排列的分數
+    """
+    scores = predictions.reshape(labels.shape)
+    ranking = SlotRanking(slots, zones, scores, labels, np.ones(labels.shape, dtype=bool))
+    y = labels.reshape(-1) > 0
+    result = {f'hit@{k}': v for k, v in ranking.hit_rate_at_k(ks).items()}
+    result.update({f'ndcg@{k}': v for k, v in ranking.ndcg_at_k((5, 10)).items()})
+    result['auc'] = roc_auc_score(y, predictions) if 0 < y.sum() < len(y) else np.nan
+    return result
+
+
+class SearchData:
+    """訓練 / 驗證 / 測試都是連續的時段範圍；預測結果 reshape 成 (時段 x 區域) 後直接交給 SlotRanking"""
+
+    def __init__(self, grid, features, train_frac=TRAIN_FRAC, valid_frac=VALID_FRAC):
+        self.X = feature_matrix(grid, features)
+        self.labels = np.asarray(features['label'])
+        self.slots = grid.slots
+        self.zones = grid.zones
+
+        # 依日期切分 (同 notebook：split_date 當天屬於測試期)
+        day_codes = grid.day_codes
+        n_days = day_codes.max() + 1
+        split_day = int(n_days * train_frac)
+        valid_day = split_day - max(1, int(split_day * valid_frac))
+        self.ranges = {
+            'train': (0, int(np.searchsorted(day_codes, valid_day))),
+            'valid': (int(np.searchsorted(day_codes, valid_day)), int(np.searchsorted(day_codes, split_day))),
+            'test': (int(np.searchsorted(day_codes, split_day)), grid.n_slots),
+        }
+        y_train = self.binary('train')
+        self.scale_pos_weight = float((y_train == 0).sum() / max((y_train == 1).sum(), 1))
+        self._dmatrix = {}
+
+    def rows(self, part):
+        start, end = self.ranges[part]
+        n_zones = len(self.zones)
+        return slice(start * n_zones, end * n_zones)
+
+    def binary(self, part):
+        start, end = self.ranges[part]
+        return (self.labels[start:end] > 0).astype(np.float32).reshape(-1)
+
+    def dmatrix(self, part):
+        """訓練集為 QuantileDMatrix，驗證 / 測試集以訓練集的分箱為參考，只建立一次"""
+        if part not in self._dmatrix:
+            ref = None if part == 'train' else self.dmatrix('train')
+            self._dmatrix[part] = xgb.QuantileDMatrix(self.X[self.rows(part)], label=self.binary(part),
+                                                      feature_names=FEATURES, ref=ref)
+        return self._dmatrix[part]
+
+
+def evaluate(data, part, predictions):
+    start, end = data.ranges[part]
+    return ranking_metrics(data.slots[start:end], data.zones, data.labels[start:end], predictions)
+
+
+# ==========================================
+# 2. 工作行程
+# ==========================================
+_WORKER = {}
+
+
+def _init_worker(cache_dir, inputs, nthread):
+    _WORKER.update(cache_dir=cache_dir, inputs=inputs, nthread=nthread, data={})
+
+
+def _worker_data(feature_set):
+    """工作行程內每組特徵只讀取 (memory-map) 與建立 DMatrix 一次"""
+    if feature_set not in _WORKER['data']:
+        freq, window_size = feature_set
+        # 主行程已寫好快取；工作行程不刪除快取 (keep=None)，避免刪掉其他行程正在讀的目錄
+        store = FeatureStore(_WORKER['cache_dir'], _WORKER['inputs'], freq=freq, keep=None)
+        grid, features = load_features(store, window_size)
+        data = SearchData(grid, features)
+        for part in ('train', 'valid', 'test'):
+            data.dmatrix(part)
+        _WORKER['data'][feature_set] = data
+    return _WORKER['data'][feature_set]
+
+
+def _warm_up(feature_set):
+    _worker_data(feature_set)
+    return os.getpid()
+
+
+def _run_trial(trial):
+    """
+    trial: {'id', 'feature_set', 'params', 'rounds', 'model' (上一段的模型 bytes 或 None)}
+    從上一段的模型繼續訓練到 rounds 輪，回傳驗證 / 測試指標與模型
+    """
+    data = _worker_data(trial['feature_set'])
+    params = dict(trial['params'], objective='binary:logistic', eval_metric='logloss', tree_method='hist',
+                  scale_pos_weight=data.scale_pos_weight, nthread=_WORKER['nthread'], seed=42)
+    previous = xgb.Booster(model_file=bytearray(trial['model'])) if trial['model'] is not None else None
+    done = previous.num_boosted_rounds() if previous is not None else 0
+
+    t0 = time.perf_counter()
+    booster = xgb.train(params, data.dmatrix('train'), num_boost_round=trial['rounds'] - done,
+                        evals=[(data.dmatrix('valid'), 'valid')], early_stopping_rounds=EARLY_STOPPING,
+                        xgb_model=previous, verbose_eval=False)
+    n_rounds = booster.num_boosted_rounds()
+    best = booster.best_iteration if booster.attr('best_iteration') is not None else n_rounds - 1
+    iteration_range = (0, best + 1)
+
+    result = {'id': trial['id'], 'rounds': n_rounds, 'best_iteration': best,
+              'stopped': n_rounds < trial['rounds'], 'seconds': time.perf_counter() - t0}
+    for part in ('valid', 'test'):
+        predictions = booster.predict(data.dmatrix(part), iteration_range=iteration_range)
+        result.update({f'{part}_{name}': value for name, value in evaluate(data, part, predictions).items()})
+    result['model'] = bytes(booster.save_raw())
+    return result
+
+
+# ==========================================
+# 3. 搜尋
+# ==========================================
+def prepare_feature_sets(cache_dir, inputs, freqs, window_sizes):
+    """
+    先在主行程把每組特徵寫入快取，工作行程只需載入
+    每個群組至少保留與搜尋組合數相同的快取，寫入後面的組合時不會刪掉前面剛寫好的
+    """
+    feature_sets = [(freq, w) for freq in freqs for w in window_sizes]
+    for freq, window_size in feature_sets:
+        store = FeatureStore(cache_dir, inputs, freq=freq, keep=max(KEEP, len(feature_sets)))
+        load_features(store, window_size)
+        print(f"   特徵 FREQ={freq}, WINDOW_SIZE={window_size}: {store.last_status}")
+    return feature_sets
+
+
+def split_cores(n_cores, nthread=None):
+    """核心分給 (行程數, 每個行程的 nthread)；預設每個試驗 2 執行緒"""
+    nthread = nthread or min(2, n_cores)
+    return max(1, n_cores // nthread), nthread
+
+
+def search(cache_dir, inputs, freqs=('15min',), window_sizes=(10,), n_trials=24, rungs=(100, 300, 800),
+           keep_frac=1 / 3, n_cores=None, nthread=None, objective='valid_ndcg@5', seed=0):
+    """
+    successive halving：所有試驗先訓練到 rungs[0] 輪，依驗證指標保留前 keep_frac，繼續訓練到下一段，依此類推
+    已 early stop 的試驗不再訓練，但仍參與排名
+    回傳所有試驗最後一段的結果 (依 objective 由高到低排序)
+    """
+    n_cores = n_cores or os.cpu_count()
+    workers, nthread = split_cores(n_cores, nthread)
+    feature_sets = prepare_feature_sets(cache_dir, inputs, freqs, window_sizes)
+
+    rng = np.random.default_rng(seed)
+    trials = []
+    for i in range(n_trials):
+        params = dict(BASE_PARAMS) if i < len(feature_sets) else sample_params(rng)
+        trials.append({'id': i, 'feature_set': feature_sets[i % len(feature_sets)], 'params': params, 'model': None})
+    results = {}
+
+    alive = list(range(n_trials))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_dir, inputs, nthread)) as pool:
+        for level, rounds in enumerate(rungs):
+            todo = [dict(trials[i], rounds=rounds) for i in alive if not results.get(i, {}).get('stopped')]
+            t0 = time.perf_counter()
+            for result in pool.map(_run_trial, todo):
+                trials[result['id']]['model'] = result.pop('model')
+                results[result['id']] = result
+            for i in alive:
+                results[i]['rung'] = level
+            ranked = sorted(alive, key=lambda i: results[i][objective], reverse=True)
+            best = results[ranked[0]]
+            print(f"   第 {level + 1} 段 ({rounds} 輪): 訓練 {len(todo)} 個試驗 {time.perf_counter() - t0:.1f}s，"
+                  f"最佳 {objective} = {best[objective]:.4f} (試驗 {ranked[0]})")
+            if level < len(rungs) - 1:
+                alive = ranked[:max(1, math.ceil(len(ranked) * keep_frac))]
+
+    rows = []
+    for i, trial in enumerate(trials):
+        freq, window_size = trial['feature_set']
+        rows.append(dict(results[i], freq=freq, window_size=window_size, **trial['params']))
+    table = pd.DataFrame(rows).sort_values(['rung', objective], ascending=False).reset_index(drop=True)
+    return table
+
+
+def best_params(table):
+    """第一名的參數，格式同 notebook 的 params_clf"""
+    row = table.iloc[0]
+    params = {name: round(float(row[name]), 4) for name in SEARCH_SPACE}
+    params['max_depth'] = int(params['max_depth'])
+    return params, {'FREQ': row['freq'], 'WINDOW_SIZE': int(row['window_size']),
+                    'num_boost_round': int(row['best_iteration']) + 1}
+
+
+# ==========================================
+# 4. 擴充性測試 (1 ~ N 核心)
+# ==========================================
+def benchmark(cache_dir, inputs, n_trials=8, rounds=100, max_cores=None):
+    """同一組試驗 (固定輪數、不淘汰) 在不同核心數與 行程數 x nthread 配置下的總時間"""
+    max_cores = max_cores or os.cpu_count()
+    feature_set = prepare_feature_sets(cache_dir, inputs, ('15min',), (10,))[0]
+    rng = np.random.default_rng(0)
+    trials = [{'id': i, 'feature_set': feature_set, 'params': sample_params(rng), 'model': None, 'rounds': rounds}
+              for i in range(n_trials)]
+
+    configs = []
+    cores = 1
+    while cores <= max_cores:
+        configs += sorted({(cores, 1), (1, cores), split_cores(cores)})
+        cores *= 2
+    print(f"{n_trials} 個試驗 x {rounds} 輪 (本機 {os.cpu_count()} 核心)")
+    print(f"{'核心':>4} | {'行程':>4} | {'nthread':>7} | {'秒數':>8} | {'加速':>6}")
+    baseline = None
+    for workers, nthread in configs:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(cache_dir, inputs, nthread)) as pool:
+            list(pool.map(_warm_up, [feature_set] * workers))  # 不計入載入資料與建立 DMatrix 的時間
+            t0 = time.perf_counter()
+            list(pool.map(_run_trial, trials))
+            elapsed = time.perf_counter() - t0
+        baseline = baseline or elapsed
+        print(f"{workers * nthread:>4} | {workers:>4} | {nthread:>7} | {elapsed:>8.1f} | {baseline / elapsed:>5.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="XGBoost 區域模型的超參數搜尋")
+    parser.add_argument('--data-dir', default='../data_after_process')
+    parser.add_argument('--cache-dir', default='../data_after_process/feature_store')
+    parser.add_argument('--freqs', nargs='+', default=['15min'])
+    parser.add_argument('--window-sizes', nargs='+', type=int, default=[10])
+    parser.add_argument('--trials', type=int, default=24)
+    parser.add_argument('--rungs', nargs='+', type=int, default=[100, 300, 800], help="各段累計的訓練輪數")
+    parser.add_argument('--keep', type=float, default=1 / 3, help="每段保留的比例")
+    parser.add_argument('--cores', type=int, default=None)
+    parser.add_argument('--nthread', type=int, default=None, help="每個試驗的 XGBoost 執行緒數")
+    parser.add_argument('--objective', default='valid_ndcg@5')
+    parser.add_argument('--output', default='tuning_results.csv')
+    parser.add_argument('--benchmark', action='store_true', help="量測 1 ~ N 核心的總時間")
+    args = parser.parse_args()
+
+    inputs = default_inputs(args.data_dir)
+    if args.benchmark:
+        benchmark(args.cache_dir, inputs, max_cores=args.cores)
+    else:
+        table = search(args.cache_dir, inputs, args.freqs, args.window_sizes, args.trials, args.rungs,
+                       args.keep, args.cores, args.nthread, args.objective)
+        table.to_csv(args.output, index=False, encoding='utf-8-sig')
+        params, settings = best_params(table)
+        print("\n🏆 最佳試驗:")
+        print(table.head(5)[['id', 'freq', 'window_size', 'rounds', args.objective,
+                             'test_hit@3', 'test_hit@5', 'test_hit@10', 'test_ndcg@5', 'test_auc']].to_string(index=False))
+        print(f"\nparams_clf = {params}")
+        print(f"{settings}")
+        print(f"結果已儲存至 {args.output}")
@@ -0,0 +1,147 @@
+"""
+天氣特徵模組 - 一次載入 rainfall.csv / temperature.csv，以日期為索引向量化併入時間網格
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+RAIN_FALLBACK = 0.0  # 查無降水資料時的預設值
+FILL_DAYS = 2        # 缺值以前後各 N 天的平均補全
+
+
+def fill_precipitation(df_rain, days=FILL_DAYS):
+    """將 'T' (微量) 視為缺值，並以前後各 days 天 (原始值) 的平均補全"""
+    df_rain = df_rain.copy()
+    precip = pd.to_numeric(df_rain['Precipitation'].replace('T', np.nan), errors='coerce').astype(float)
+
+    # 前 days 天 + 後 days 天，疊成 (列數 x 2*days) 的矩陣一次計算
+    offsets = [k for k in range(1, days + 1)] + [-k for k in range(1, days + 1)]
+    neighbors = np.column_stack([precip.shift(k).values for k in offsets])
+    valid = ~np.isnan(neighbors)
+    n_valid = valid.sum(axis=1)
+    neighbor_sum = np.where(valid, neighbors, 0.0).sum(axis=1)
+    neighbor_mean = np.round(neighbor_sum / np.maximum(n_valid, 1), 3)
+
+    fill_mask = precip.isna().values & (n_valid > 0)
+    df_rain['Precipitation'] = np.where(fill_mask, neighbor_mean, precip.values)
+    return df_rain
+
+
+def build_daily_weather(df_rain, df_temp):
+    """
+    建立以日期 (datetime64, 當天 00:00) 為索引的每日天氣表
+    欄位: Precipitation, temperature, has_rain, has_temp (該日是否有原始資料)
+    """
+    rain = pd.Series(
+        df_rain['Precipitation'].astype(float).values,
+        index=pd.to_datetime(df_rain['date'].astype(str).str.strip()),
+    )
+    temp = pd.Series(
+        df_temp['temperature'].astype(float).values,
+        index=pd.to_datetime(df_temp['date'].astype(str).str.strip()),
+    )
+    # 同一天重複時以第一筆為準
+    rain = rain[~rain.index.duplicated(keep='first')]
+    temp = temp[~temp.index.duplicated(keep='first')]
+
+    daily = pd.concat({'Precipitation': rain, 'temperature': temp}, axis=1).sort_index()
+    daily['has_rain'] = daily.index.isin(rain.index)
+    daily['has_temp'] = daily.index.isin(temp.index)
+    daily.attrs['temp_fallback'] = float(temp.mean())
+    return daily
+
+
+def load_daily_weather(rain_path, temp_path):
+    """讀取 rainfall.csv 與 temperature.csv，補全降水量後回傳每日天氣表"""
+    df_rain = pd.read_csv(rain_path, encoding='utf-8-sig')
+    df_temp = pd.read_csv(temp_path, encoding='utf-8-sig')
+    return build_daily_weather(fill_precipitation(df_rain), df_temp)
+
+
+def lookup_daily_weather(days, daily):
+    """
+    依日期陣列查出 (降水量, 溫度) 兩個 numpy 陣列
+    查無資料時：降水量 = 0.0，溫度 = 整體平均溫度
+    """
+    days = pd.DatetimeIndex(days).normalize()
+    pos = daily.index.get_indexer(days)
+    found = pos >= 0
+    safe_pos = np.where(found, pos, 0)
+
+    has_rain = daily['has_rain'].values[safe_pos] & found
+    has_temp = daily['has_temp'].values[safe_pos] & found
+    rain = np.where(has_rain, daily['Precipitation'].values[safe_pos], RAIN_FALLBACK)
+    temp = np.where(has_temp, daily['temperature'].values[safe_pos], daily.attrs['temp_fallback'])
+    return rain, temp
+
+
+def attach_daily_weather(df, daily, time_col='Slot_Start'):
+    """將每日天氣一次併入網格 (不逐列迴圈)，新增 Precipitation 與 temperature 欄位"""
+    # 網格常有數十萬列但只有數百個不同日期：先對唯一日期查表，再展開回每一列
+    day_codes, unique_days = pd.factorize(df[time_col].dt.normalize())
+    rain, temp = lookup_daily_weather(unique_days, daily)
+    df['Precipitation'] = rain[day_codes]
+    df['temperature'] = temp[day_codes]
+    return df
+
+
+# ==========================================
+# 效能測試 (與原本逐列迴圈比較)
+# ==========================================
+def _legacy_attach(df, df_rain, df_temp):
+    for i in range(len(df)):
+        date = str.strip(str(df.loc[i, 'date']))
+        rain_row = df_rain[df_rain['date'] == date]
+        if not rain_row.empty:
+            df.loc[i, 'Precipitation'] = rain_row['Precipitation'].values[0]
+        else:
+            df.loc[i, 'Precipitation'] = 0.0
+    for i in range(len(df)):
+        date = str.strip(str(df.loc[i, 'date']))
+        temp_row = df_temp[df_temp['date'] == date]
+        if not temp_row.empty:
+            df.loc[i, 'temperature'] = temp_row['temperature'].values[0]
+        else:
+            df.loc[i, 'temperature'] = df_temp['temperature'].mean()
+    return df
+
+
+def _synthetic_grid(n_rows, n_zones=22, seed=0):
+    rng = np.random.default_rng(seed)
+    n_slots = -(-n_rows // n_zones)
+    slots = pd.Timestamp('2023-01-01 09:00') + pd.to_timedelta(
+        np.sort(rng.integers(0, 3 * 365 * 96, n_slots)) * 15, unit='min')
+    return pd.DataFrame({'Slot_Start': np.repeat(slots, n_zones)[:n_rows]})
+
+
+def benchmark(data_dir='../data_after_process', sizes=(100_000, 1_000_000, 10_000_000), legacy_rows=2_000):
+    df_rain = pd.read_csv(f'{data_dir}/rainfall.csv', encoding='utf-8-sig')
+    df_temp = pd.read_csv(f'{data_dir}/temperature.csv', encoding='utf-8-sig')
+    df_rain = fill_precipitation(df_rain)
+    daily = build_daily_weather(df_rain, df_temp)
+
+    # 舊版為逐列迴圈，只量測少量列數後換算每列耗時
+    sample = _synthetic_grid(legacy_rows)
+    sample['date'] = sample['Slot_Start'].dt.date
+    t0 = time.perf_counter()
+    expected = _legacy_attach(sample.copy(), df_rain, df_temp)
+    legacy_per_row = (time.perf_counter() - t0) / legacy_rows
+
+    got = attach_daily_weather(sample.copy(), daily)
+    assert np.allclose(got[['Precipitation', 'temperature']].values,
+                       expected[['Precipitation', 'temperature']].values, equal_nan=True)
+
+    print(f"{'列數':>12} | {'向量化 (s)':>10} | {'逐列迴圈估計 (s)':>16} | {'加速':>8}")
+    for n in sizes:
+        grid = _synthetic_grid(n)
+        t0 = time.perf_counter()
+        attach_daily_weather(grid, daily)
+        elapsed = time.perf_counter() - t0
+        legacy = legacy_per_row * n
+        print(f"{n:>12,} | {elapsed:>10.3f} | {legacy:>16.1f} | {legacy / elapsed:>7.0f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
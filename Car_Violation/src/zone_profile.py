@@ -0,0 +1,206 @@
+"""
+區域輪廓查表 - 區域靜態特徵與進階特徵只依賴 (區域, 星期幾, 時, 分)，由歷史紀錄一次統計成 numpy 查表陣列，
+以整數位置 (區域在網格中的順序、星期幾、一天中的分鐘) 用 fancy indexing 取到網格或任意列上；
+取代 notebook 逐列 apply (.loc 查表)、slot_key 字串拼接與 merge
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+MINUTES_PER_DAY = 24 * 60
+WEEKDAY_FALLBACK = 0.14  # notebook: 沒有紀錄的區域 zone_weekday_risk = 0.14 (約 1/7)
+RATIO_FALLBACK = 0.5     # notebook: 沒有上午 (下午) 紀錄的區域比例為 0.5
+
+STATIC_FEATURES = ['zone_baseline_risk', 'zone_morning_ratio', 'zone_afternoon_ratio', 'zone_weekday_risk']
+ADVANCED_FEATURES = ['zone_weekday_hour_rate', 'hist_slot_count']
+FEATURES = STATIC_FEATURES + ADVANCED_FEATURES
+
+
+def minute_of_day(times):
+    """DatetimeIndex / Series -> 一天中的第幾分鐘 (0 ~ 1439)"""
+    times = pd.DatetimeIndex(times)
+    return np.asarray(times.hour) * 60 + np.asarray(times.minute)
+
+
+class ZoneProfile:
+    """
+    由歷史紀錄 (Datetime, Zone_ID) 統計的查表陣列，第一維為區域位置 (與 zones 同順序)
+    baseline / morning / afternoon: (區域,)；weekday_risk: (區域, 7)
+    weekday_hour_rate: (區域, 7, 24)；slot_count: (區域, 7, 1440) (notebook 以原始分鐘計數)
+    zones 中沒有紀錄的區域依 notebook 的預設值；不在 zones 的紀錄不計入
+    """
+
+    def __init__(self, df_viol, zones):
+        self.zones = np.asarray(zones)
+        n = len(self.zones)
+        zpos = pd.Index(self.zones).get_indexer(df_viol['Zone_ID'])
+        keep = zpos >= 0
+        zpos = zpos[keep]
+        dt = df_viol['Datetime'][keep]
+        wd, hour = dt.dt.dayofweek.values, dt.dt.hour.values
+        mod = hour * 60 + dt.dt.minute.values
+        morning = (hour >= 9) & (hour < 12)
+
+        # 全部以 bincount 在攤平的整數索引上計數
+        total = np.bincount(zpos, minlength=n).astype(float)
+        self.baseline = total / max(total.sum(), 1)
+        n_morning = np.bincount(zpos[morning], minlength=n)
+        n_afternoon = np.bincount(zpos[~morning], minlength=n)
+        self.morning = np.where(n_morning > 0, n_morning / np.maximum(total, 1), RATIO_FALLBACK)
+        self.afternoon = np.where(n_afternoon > 0, n_afternoon / np.maximum(total, 1), RATIO_FALLBACK)
+
+        zone_wd = np.bincount(zpos * 7 + wd, minlength=n * 7).reshape(n, 7).astype(float)
+        self.weekday_risk = np.where(total[:, None] > 0, zone_wd / (total[:, None] + 1e-10), WEEKDAY_FALLBACK)
+
+        zone_wd_hour = np.bincount((zpos * 7 + wd) * 24 + hour, minlength=n * 7 * 24).reshape(n, 7, 24).astype(float)
+        self.weekday_hour_rate = zone_wd_hour / (zone_wd_hour.sum(axis=0, keepdims=True) + 1)
+
+        self.slot_count = np.bincount((zpos * 7 + wd) * MINUTES_PER_DAY + mod,
+                                      minlength=n * 7 * MINUTES_PER_DAY).reshape(n, 7, MINUTES_PER_DAY).astype(float)
+
+    # ---------- 查表 ----------
+    def gather(self, zone_pos, weekday, mod, names=None):
+        """
+        任意列的查表結果 (三個整數陣列可互相 broadcast)
+        zone_pos: 區域位置；weekday: 0 ~ 6；mod: 一天中的分鐘；names: 只取這些特徵 (預設全部)
+        """
+        zone_pos, weekday, mod = np.broadcast_arrays(zone_pos, weekday, mod)
+        lookups = {
+            'zone_baseline_risk': lambda: self.baseline[zone_pos],
+            'zone_morning_ratio': lambda: self.morning[zone_pos],
+            'zone_afternoon_ratio': lambda: self.afternoon[zone_pos],
+            'zone_weekday_risk': lambda: self.weekday_risk[zone_pos, weekday],
+            'zone_weekday_hour_rate': lambda: self.weekday_hour_rate[zone_pos, weekday, mod // 60],
+            'hist_slot_count': lambda: self.slot_count[zone_pos, weekday, mod],
+        }
+        return {name: lookups[name]() for name in (names or FEATURES)}
+
+    def grid_features(self, slots, names=None):
+        """(時段 x 區域) 陣列 (區域順序同 self.zones)"""
+        slots = pd.DatetimeIndex(slots)
+        weekday = np.asarray(slots.dayofweek)[:, None]
+        mod = minute_of_day(slots)[:, None]
+        return self.gather(np.arange(len(self.zones))[None, :], weekday, mod, names)
+
+    def features(self, slot):
+        """單一時段所有區域的特徵 ((區域,) 陣列)"""
+        slot = pd.Timestamp(slot)
+        return self.gather(np.arange(len(self.zones)), slot.dayofweek, slot.hour * 60 + slot.minute)
+
+
+# ==========================================
+# 驗證與效能測試
+# ==========================================
+def _legacy_notebook(df, df_raw):
+    # notebook 原本的寫法：map、逐列 apply (.loc 查表)、merge、slot_key 字串拼接
+    df = df.copy()
+    df_raw = df_raw.copy()
+    df['weekday'] = df['Slot_Start'].dt.dayofweek
+    df['hour'] = df['Slot_Start'].dt.hour
+    df['minute'] = df['Slot_Start'].dt.minute
+
+    zone_total = df_raw.groupby('Zone_ID').size()
+    zone_rate = zone_total / zone_total.sum()
+    df['zone_baseline_risk'] = df['Zone_ID'].map(zone_rate).fillna(0)
+    df_raw['is_morning'] = ((df_raw['Datetime'].dt.hour >= 9) & (df_raw['Datetime'].dt.hour < 12)).astype(int)
+    morning_counts = df_raw[df_raw['is_morning'] == 1].groupby('Zone_ID').size()
+    afternoon_counts = df_raw[df_raw['is_morning'] == 0].groupby('Zone_ID').size()
+    total_counts = df_raw.groupby('Zone_ID').size()
+    zone_morning_ratio = (morning_counts / total_counts).fillna(0.5)
+    zone_afternoon_ratio = (afternoon_counts / total_counts).fillna(0.5)
+    df['zone_morning_ratio'] = df['Zone_ID'].map(zone_morning_ratio).fillna(0.5)
+    df['zone_afternoon_ratio'] = df['Zone_ID'].map(zone_afternoon_ratio).fillna(0.5)
+
+    df_raw['weekday'] = df_raw['Datetime'].dt.dayofweek
+    zone_weekday_avg = df_raw.groupby(['Zone_ID', 'weekday']).size().unstack(fill_value=0)
+    zone_weekday_avg = zone_weekday_avg / (zone_weekday_avg.sum(axis=1).values.reshape(-1, 1) + 1e-10)
+
+    def get_zone_weekday_risk(row):
+        zone, wd = row['Zone_ID'], row['weekday']
+        if zone in zone_weekday_avg.index:
+            return zone_weekday_avg.loc[zone, wd]
+        return 0.14
+
+    df['zone_weekday_risk'] = df.apply(get_zone_weekday_risk, axis=1)
+
+    df_raw['hour'] = df_raw['Datetime'].dt.hour
+    zone_weekday_hour = df_raw.groupby(['Zone_ID', 'weekday', 'hour']).size().reset_index(name='hist_count')
+    zone_weekday_hour_total = df_raw.groupby(['weekday', 'hour']).size().reset_index(name='total_count')
+    zone_weekday_hour = zone_weekday_hour.merge(zone_weekday_hour_total, on=['weekday', 'hour'])
+    zone_weekday_hour['zone_weekday_hour_rate'] = zone_weekday_hour['hist_count'] / (zone_weekday_hour['total_count'] + 1)
+    df = df.merge(zone_weekday_hour[['Zone_ID', 'weekday', 'hour', 'zone_weekday_hour_rate']],
+                  on=['Zone_ID', 'weekday', 'hour'], how='left')
+    df['zone_weekday_hour_rate'] = df['zone_weekday_hour_rate'].fillna(0)
+
+    df['slot_key'] = df['weekday'].astype(str) + '_' + df['hour'].astype(str) + '_' + df['minute'].astype(str)
+    zone_slot_hist = df_raw.copy()
+    zone_slot_hist['slot_key'] = zone_slot_hist['weekday'].astype(str) + '_' + \
+        zone_slot_hist['Datetime'].dt.hour.astype(str) + '_' + zone_slot_hist['Datetime'].dt.minute.astype(str)
+    zone_slot_count = zone_slot_hist.groupby(['Zone_ID', 'slot_key']).size().reset_index(name='hist_slot_count')
+    df = df.merge(zone_slot_count, on=['Zone_ID', 'slot_key'], how='left')
+    df['hist_slot_count'] = df['hist_slot_count'].fillna(0)
+    return df
+
+
+def _synthetic_violations(years, n_zones, seed=0):
+    from grid import _synthetic_violations
+    df_raw = _synthetic_violations(years=years, n_zones=n_zones, seed=seed)
+    # 取締時間加上秒數 (hist_slot_count 以原始分鐘計數，秒數不應影響結果)
+    rng = np.random.default_rng(seed)
+    df_raw['Datetime'] += pd.to_timedelta(rng.integers(0, 60, len(df_raw)), unit='s')
+    return df_raw
+
+
+def _compare(df_raw, zones_extra=()):
+    from grid import SlotZoneGrid
+    grid = SlotZoneGrid.from_violations(df_raw)
+    zones = np.concatenate([grid.zones, np.asarray(zones_extra, dtype=grid.zones.dtype)])
+    grid = SlotZoneGrid(grid.slots, zones, np.zeros((grid.n_slots, len(zones)), dtype=np.int32))
+    df = grid.to_long()
+    expected = _legacy_notebook(df, df_raw)
+    got = ZoneProfile(df_raw, grid.zones).grid_features(grid.slots)
+    for name in FEATURES:
+        assert np.array_equal(grid.flatten(got[name]), expected[name].values), name
+    return len(df)
+
+
+def verify(data_dir='../data_after_process'):
+    n_rows = _compare(_synthetic_violations(years=1, n_zones=12), zones_extra=[99])
+    print(f"✅ 模擬資料 {n_rows:,} 列 (含沒有紀錄的區域)：查表結果與 notebook 的 apply / merge 完全相同")
+    try:
+        from feature_store import default_inputs, load_violations
+        inputs = default_inputs(data_dir)
+        n_rows = _compare(load_violations(inputs['violations'], inputs['rules']))
+        print(f"✅ 真實資料 {n_rows:,} 列：查表結果與 notebook 的 apply / merge 完全相同")
+    except FileNotFoundError:
+        pass
+
+
+def benchmark(years=3, n_zones=22):
+    from grid import SlotZoneGrid
+    df_raw = _synthetic_violations(years=years, n_zones=n_zones)
+    grid = SlotZoneGrid.from_violations(df_raw)
+    df = grid.to_long()
+    t0 = time.perf_counter()
+    _legacy_notebook(df, df_raw)
+    legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ZoneProfile(df_raw, grid.zones).grid_features(grid.slots)
+    fast = time.perf_counter() - t0
+    print(f"{len(df_raw):,} 筆紀錄 / {len(df):,} 列網格: notebook (apply + merge) {legacy:.2f}s，"
+          f"查表 {fast:.3f}s ({legacy / fast:.0f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="區域輪廓查表")
+    parser.add_argument('--data-dir', default='../data_after_process')
+    parser.add_argument('--verify', action='store_true')
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+    if args.verify:
+        verify(args.data_dir)
+    if args.benchmark:
+        benchmark()
@@ -1,20 +1,195 @@
-import fastf1
+"""
+FastF1 批次載入 - 依 年份 / 賽站 / 場次 範圍平行載入多個 session (共用 .cache)，輸出合併的成績表
+只載入需要的資料 (laps / weather / messages 可個別開關，不載入 telemetry)；
+每個 session 記錄載入時間，並拆成 網路、快取讀取、解析 三部分，找出慢的 session 與原因
+
+python main.py                                   # 同原本：2025 第 20 站 (Mexico) 正賽
+python main.py --years 2023-2025 --rounds 1-5 --sessions Q R --no-laps --output results.parquet
+"""
 
+import argparse
 import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fastf1
+import pandas as pd
+import requests
+
+CACHE_DIR = '.cache'
+RESULT_COLUMNS = ['Position', 'Abbreviation', 'TeamName', 'GridPosition', 'Status', 'Points']
+
+
+# ==========================================
+# 1. 範圍解析
+# ==========================================
+def parse_range(values):
+    """['2023-2025', '2027'] -> [2023, 2024, 2025, 2027]；非數字 (賽站名稱) 原樣保留"""
+    out = []
+    for value in values:
+        for part in str(value).split(','):
+            lo, sep, hi = part.partition('-')
+            if sep and lo.isdigit() and hi.isdigit():
+                out.extend(range(int(lo), int(hi) + 1))
+            elif part.isdigit():
+                out.append(int(part))
+            elif part:
+                out.append(part)
+    return out
+
+
+def expand_jobs(years, rounds, sessions):
+    """rounds 為 None 時取該年賽程的所有正式賽站"""
+    jobs = []
+    for year in years:
+        year_rounds = rounds
+        if year_rounds is None:
+            schedule = fastf1.get_event_schedule(year, include_testing=False)
+            year_rounds = schedule['RoundNumber'].tolist()
+        jobs.extend((year, race, session) for race in year_rounds for session in sessions)
+    return jobs
+
+
+# ==========================================
+# 2. 載入計時 (每個工作行程一次只載入一個 session)
+# ==========================================
+class LoadTimer:
+    """
+    包住 requests 與 pickle 的進入點累計時間：
+    http = requests.Session.request 內的時間 (含 requests-cache 命中時讀 sqlite)
+    network = 真正送出請求 (HTTPAdapter.send，只有快取未命中才會呼叫)
+    pickle = 讀取 fastf1 的 .ff1pkl 快取
+    """
+
+    def __init__(self):
+        self.seconds = {'http': 0.0, 'network': 0.0, 'pickle': 0.0}
+        self.requests = 0
+        self._patched = []
+
+    def _wrap(self, owner, name, key, count=False):
+        original = getattr(owner, name)
+        timer = self
+
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                timer.seconds[key] += time.perf_counter() - t0
+                if count:
+                    timer.requests += 1
+
+        setattr(owner, name, wrapper)
+        self._patched.append((owner, name, original))
+
+    def __enter__(self):
+        self._wrap(requests.Session, 'request', 'http')
+        self._wrap(requests.adapters.HTTPAdapter, 'send', 'network', count=True)
+        self._wrap(pickle, 'load', 'pickle')
+        return self
+
+    def __exit__(self, *exc):
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+
+
+def _init_worker(cache_dir):
+    fastf1.set_log_level('ERROR')
+    fastf1.Cache.enable_cache(cache_dir)
+
+
+def load_session(job, laps=True, weather=True, messages=False):
+    """載入一個 session，回傳 (成績表或 None, 計時紀錄)"""
+    year, race, session_name = job
+    t0 = time.perf_counter()
+    record = {'Year': year, 'Race': race, 'Session': session_name}
+    with LoadTimer() as timer:
+        try:
+            session = fastf1.get_session(year, race, session_name)
+            session.load(laps=laps, telemetry=False, weather=weather, messages=messages)
+            results = session.results.reindex(columns=RESULT_COLUMNS).reset_index(drop=True)
+            results.insert(0, 'Event', session.event['EventName'])
+            results.insert(0, 'Round', int(session.event['RoundNumber']))
+            results.insert(0, 'Session', session_name)
+            results.insert(0, 'Year', year)
+            record['Event'] = session.session_info['Meeting']['OfficialName']
+            record['Laps'] = len(session.laps) if laps else 0
+            record['Error'] = ''
+        except Exception as e:
+            results = None
+            record['Error'] = str(e)
+    total = time.perf_counter() - t0
+    network = timer.seconds['network']
+    cache = timer.seconds['http'] - network + timer.seconds['pickle']
+    record.update(Total=total, Network=network, Cache=cache, Parse=max(total - network - cache, 0.0),
+                  Requests=timer.requests)
+    return results, record
+
+
+# ==========================================
+# 3. 批次
+# ==========================================
+def load_batch(jobs, workers=None, cache_dir=CACHE_DIR, **load_kwargs):
+    """平行載入全部 session，回傳 (合併成績表, 每個 session 的計時表)"""
+    os.makedirs(cache_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count(), len(jobs)))
+    tables, records = [], []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_dir,)) as pool:
+        futures = [pool.submit(load_session, job, **load_kwargs) for job in jobs]
+        for future in as_completed(futures):
+            results, record = future.result()
+            status = f"⚠️ {record['Error']}" if record['Error'] else f"{record['Event']}"
+            print(f"   {record['Year']} {record['Race']} {record['Session']}: {record['Total']:.1f}s  {status}")
+            records.append(record)
+            if results is not None:
+                tables.append(results)
+    results = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+    if not results.empty:
+        results = results.sort_values(['Year', 'Round', 'Session', 'Position'], ignore_index=True)
+    timings = pd.DataFrame(records).sort_values('Total', ascending=False, ignore_index=True)
+    return results, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FastF1 批次載入")
+    parser.add_argument('--years', nargs='+', default=['2025'], help="例如 2023-2025 或 2023 2025")
+    parser.add_argument('--rounds', nargs='+', default=['20'], help="賽站編號範圍或名稱；all = 整個賽季")
+    parser.add_argument('--sessions', nargs='+', default=['R'], help="例如 FP1 Q S R")
+    parser.add_argument('--laps', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--weather', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--messages', action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument('--workers', type=int, default=None, help="平行載入的行程數 (預設為 CPU 核心數)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--output', default=None, help="合併成績表 (.parquet 或 .csv)")
+    args = parser.parse_args()
+
+    fastf1.set_log_level('ERROR')
+    fastf1.Cache.enable_cache(args.cache_dir)
+    rounds = None if args.rounds == ['all'] else parse_range(args.rounds)
+    jobs = expand_jobs(parse_range(args.years), rounds, args.sessions)
+    print(f"🚀 載入 {len(jobs)} 個 session (laps={args.laps}, weather={args.weather}, messages={args.messages})")
 
-# 檢查並建立 cache 資料夾
-if not os.path.exists('.cache'):
-    os.makedirs('.cache')
+    t0 = time.perf_counter()
+    results, timings = load_batch(jobs, args.workers, args.cache_dir,
+                                  laps=args.laps, weather=args.weather, messages=args.messages)
+    elapsed = time.perf_counter() - t0
 
-fastf1.set_log_level('ERROR')
-fastf1.Cache.enable_cache('.cache')
+    if not results.empty:
+        print(results.to_string(index=False))
+    print(f"\n⏱️ 共 {elapsed:.1f}s (各 session 合計 {timings['Total'].sum():.1f}s)，最慢的 session:")
+    columns = ['Year', 'Race', 'Session', 'Total', 'Network', 'Cache', 'Parse', 'Requests']
+    print(timings[columns].head(10).to_string(index=False, float_format=lambda v: f'{v:.2f}'))
+    print(f"   網路 {timings['Network'].sum():.1f}s / 快取 {timings['Cache'].sum():.1f}s / "
+          f"解析 {timings['Parse'].sum():.1f}s")
 
-YEAR = 2025
-RACE = 20 # Mexico
-SESSION = 'R'
+    if args.output:
+        if args.output.endswith('.csv'):
+            results.to_csv(args.output, index=False, encoding='utf-8-sig')
+        else:
+            results.to_parquet(args.output, index=False)
+        print(f"結果已儲存至 {args.output}")
 
-session = fastf1.get_session(YEAR, RACE, SESSION)
-session.load(laps=True, telemetry=False, weather=True, messages=False)
 
-print(session.session_info['Meeting']['OfficialName'])
-print(session.results[['Position', 'Abbreviation', 'Points']])
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,187 @@
-import xml.etree.ElementTree as ET
+"""
+CWA 逐日降水量 XML -> CSV
+以 iterparse 串流解析 (解析完的元素立即從樹上移除，記憶體用量與檔案大小無關)，一次取出任意多個測站；
+各年份檔案以多個行程平行處理，合併成一個長表 (date, station, Precipitation)
+"""
+
+import argparse
 import csv
+import glob
+import os
+import shutil
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+NS = "{urn:cwa:gov:tw:cwacommon:0.1}"
+LOCATION = NS + "location"
+STATION_NAME = NS + "StationName"
+OBS_TIME = NS + "stationObsTime"
+DATE_PATH = NS + "Date"
+PRECIP_PATH = f"{NS}weatherElements/{NS}Precipitation"
+
+LONG_COLUMNS = ["date", "station", "Precipitation"]
+
+
+def iter_precipitation(xml_file, stations=None):
+    """逐筆產生 (日期, 測站, 降水量字串)；stations=None 表示全部測站"""
+    stations = set(stations) if stations else None
+    stack = []  # 目前開啟中的元素 (用來把處理完的元素從父元素移除)
+    name = None
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            continue
+        stack.pop()
+        tag = elem.tag
+        if tag == STATION_NAME:
+            name = elem.text
+        elif tag == OBS_TIME:
+            if stations is None or name in stations:
+                yield elem.findtext(DATE_PATH), name, elem.findtext(PRECIP_PATH)
+            stack[-1].remove(elem)
+        elif tag == LOCATION:
+            name = None
+            stack[-1].remove(elem)
+
+
+def convert_file(xml_file, part_file, stations=None):
+    """單一 XML 轉成沒有標題列的長表 CSV，回傳筆數 (在子行程中執行)"""
+    n = 0
+    with open(part_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for row in iter_precipitation(xml_file, stations):
+            writer.writerow(row)
+            n += 1
+    return n
+
+
+def convert_all(xml_files, output_file, stations=None, workers=None):
+    """平行轉換多個 XML，依檔名順序合併成一個長表 CSV，回傳總筆數"""
+    xml_files = sorted(xml_files)
+    part_files = [f"{output_file}.part{i}" for i in range(len(xml_files))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(convert_file, xml_files, part_files, [stations] * len(xml_files)))
+
+    with open(output_file, "w", newline="", encoding="utf-8") as out:
+        csv.writer(out).writerow(LONG_COLUMNS)
+        for part in part_files:
+            with open(part, "r", encoding="utf-8") as f:
+                shutil.copyfileobj(f, out)
+            os.remove(part)
+    return sum(counts)
+
+
+def split_station_by_year(long_file, station, out_dir):
+    """由長表輸出單一測站的逐年檔案 ({year}.csv，欄位 Date, Precipitation；即原本的輸出格式)"""
+    by_year = {}
+    with open(long_file, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader)
+        for date, name, precip in reader:
+            if name == station:
+                by_year.setdefault(date[:4], []).append([date, precip])
+    for year, rows in by_year.items():
+        with open(os.path.join(out_dir, f"{year}.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Date", "Precipitation"])
+            writer.writerows(rows)
+
+
+# ==========================================
+# 效能測試 (合成大型 XML：ET.parse 整份載入 vs iterparse 串流)
+# ==========================================
+def write_synthetic_xml(path, size_mb=500, n_stations=40):
+    """產生與 CWA 格式相同的大型 XML (多測站、多年的逐日資料)"""
+    obs = ("<stationObsTime><Date>{d}</Date><weatherElements>"
+           "<Precipitation>{p}</Precipitation></weatherElements></stationObsTime>\n")
+    days = pd.date_range("1900-01-01", "2099-12-31").strftime("%Y-%m-%d")
+    precips = ["0.0", "T", "1.5", "12.0", "0.0", "0.0", "X", "0.5"]
+    chunk = "".join(obs.format(d=d, p=precips[i % len(precips)]) for i, d in enumerate(days))
+    target = size_mb * 2**20
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<cwaopendata xmlns="urn:cwa:gov:tw:cwacommon:0.1"><resources><resource><data><surfaceObs>\n')
+        station = 0
+        while f.tell() < target:
+            f.write(f"<location><station><StationID>{station:06d}</StationID>"
+                    f"<StationName>測站{station % n_stations}</StationName></station><stationObsTimes>\n")
+            f.write(chunk)
+            f.write("</stationObsTimes></location>\n")
+            station += 1
+        f.write("</surfaceObs></data></resource></resources></cwaopendata>\n")
+
 
-year = 2022
+def _legacy_rows(xml_file, station):
+    # 原本的做法：整份文件載入後 findall
+    ns = {"cwa": "urn:cwa:gov:tw:cwacommon:0.1"}
+    rows = []
+    for loc in ET.parse(xml_file).getroot().findall(".//cwa:location", ns):
+        if loc.find("cwa:station/cwa:StationName", ns).text == station:
+            for t in loc.findall(".//cwa:stationObsTime", ns):
+                rows.append([t.find("cwa:Date", ns).text,
+                             t.find("cwa:weatherElements/cwa:Precipitation", ns).text])
+    return rows
 
-xml_file = f"./raw_data/{year}.xml"
-output_file = f"./csv_data/{year}.csv"
 
-tree = ET.parse(xml_file)
-root = tree.getroot()
+def _measure(func, *args):
+    """在子行程中執行，回傳 (結果筆數, 秒數, 峰值 RSS MB)"""
+    import resource
+    t0 = time.perf_counter()
+    n = func(*args)
+    elapsed = time.perf_counter() - t0
+    return n, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
-ns = {"cwa": "urn:cwa:gov:tw:cwacommon:0.1"}
 
-rows = []
+def _count_legacy(xml_file, station):
+    return len(_legacy_rows(xml_file, station))
 
-# 找到所有 location
-locations = root.findall(".//cwa:location", ns)
 
-for loc in locations:
-    station = loc.find("cwa:station", ns)
-    if station is None:
-        continue
+def _count_stream(xml_file, stations):
+    return sum(1 for _ in iter_precipitation(xml_file, stations))
 
-    name = station.find("cwa:StationName", ns).text
 
-    # 只取高雄
-    if name == "高雄":
-        # 找該測站下所有日期與降水量
-        times = loc.findall(".//cwa:stationObsTime", ns)
+def benchmark(size_mb=500, legacy_mb=50):
+    import tempfile
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'方法':<24} | {'檔案 (MB)':>9} | {'筆數':>10} | {'秒數':>7} | {'峰值 RSS (MB)':>13}")
+        for mb in (legacy_mb, size_mb):
+            path = os.path.join(tmp_dir, f"synthetic_{mb}.xml")
+            write_synthetic_xml(path, mb)
+            real_mb = os.path.getsize(path) / 2**20
+            # 每次量測都用新的行程，峰值 RSS 才不會互相影響
+            runs = [("iterparse 串流 (單一測站)", _count_stream, {"測站0"}),
+                    ("iterparse 串流 (全部測站)", _count_stream, None)]
+            if mb == legacy_mb:
+                runs.insert(0, ("ET.parse 整份載入", _count_legacy, "測站0"))
+            for label, func, arg in runs:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    n, elapsed, rss = pool.submit(_measure, func, path, arg).result()
+                print(f"{label:<24} | {real_mb:>9.0f} | {n:>10,} | {elapsed:>7.1f} | {rss:>13.0f}")
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmp_dir)
 
-        for t in times:
-            date = t.find("cwa:Date", ns).text
-            precip = t.find("cwa:weatherElements/cwa:Precipitation", ns).text
-            rows.append([date, precip])
 
-# 寫入 CSV
-with open(output_file, "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-    writer.writerow(["Date", "Precipitation"])
-    writer.writerows(rows)
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="CWA 降水量 XML 轉 CSV")
+    parser.add_argument("--xml", nargs="*", default=sorted(glob.glob(os.path.join(base_dir, "raw_data", "*.xml"))))
+    parser.add_argument("--stations", nargs="*", default=None, help="要取出的測站名稱 (預設全部)")
+    parser.add_argument("--output", default=os.path.join(base_dir, "csv_data", "rainfall_long.csv"))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--split-station", default="高雄", help="另外輸出此測站的逐年檔案 (空字串則略過)")
+    parser.add_argument("--benchmark", action="store_true", help="以合成的 500 MB XML 量測時間與記憶體")
+    args = parser.parse_args()
 
-print(f"完成！已輸出 {output_file}")
+    if args.benchmark:
+        benchmark()
+    else:
+        n = convert_all(args.xml, args.output, args.stations, args.workers)
+        print(f"完成！共 {n} 筆 ({len(args.xml)} 個檔案)，已輸出 {args.output}")
+        if args.split_station:
+            split_station_by_year(args.output, args.split_station, os.path.dirname(args.output))
+            print(f"已輸出 {args.split_station} 的逐年檔案")
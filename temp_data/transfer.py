@@ -1,32 +1,115 @@
+"""
+氣溫 (日 x 月) 表 -> 長表 (date, temperature)
+整張表一次 melt，以遮罩去除 平均 列與 "--" 缺值，日期以向量化方式建立 (不存在的日期如 2/30 直接成為 NaT 後刪除)
+"""
+
+import argparse
+import glob
+import os
+import re
+import time
+
 import pandas as pd
 
-# 讀取 CSV 檔案
-year = 2023
-file_path = f'./{year}.csv'
-df = pd.read_csv(file_path, encoding='utf-8')
+DAY_COL = "日/月"
+MISSING = "--"
+OUTPUT_COLUMNS = ["date", "temperature"]
+
+
+def melt_temperature(tables):
+    """
+    多個年份的 日 x 月 表一次轉成依日期排序的長表 (date: datetime64, temperature: float)
+    tables: {年份: 日 x 月 表}
+    """
+    wide = pd.concat(tables, names=["year", None]).reset_index(level="year")
+    long = wide.melt(id_vars=["year", DAY_COL], var_name="month", value_name="temperature")
+    day = pd.to_numeric(long[DAY_COL], errors="coerce")  # 平均 列 -> NaN
+    value = long["temperature"].astype(str).str.strip()
+    keep = day.notna() & (value != MISSING)
+
+    long = long[keep]
+    dates = pd.to_datetime(pd.DataFrame({
+        "year": long["year"].astype(int),
+        "month": pd.to_numeric(long["month"]),
+        "day": day[keep].astype(int),
+    }), errors="coerce")
+    out = pd.DataFrame({
+        "date": dates.values,
+        "temperature": pd.to_numeric(value[keep], errors="coerce").values,
+    })
+    return out.dropna().sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def read_year_files(in_dir):
+    """讀取目錄下所有 {year}.csv，回傳 {年份: 日 x 月 表}"""
+    tables = {}
+    for path in sorted(glob.glob(os.path.join(in_dir, "*.csv"))):
+        match = re.fullmatch(r"(\d{4})\.csv", os.path.basename(path))
+        if match:
+            tables[int(match.group(1))] = pd.read_csv(path, encoding="utf-8-sig", dtype=str)
+    return tables
+
+
+def convert_directory(in_dir, output_file=None):
+    """目錄下所有 {year}.csv 合併成一張長表；給 output_file 時另存成 CSV (weather.load_daily_weather 可直接讀取)"""
+    df = melt_temperature(read_year_files(in_dir))
+    if output_file:
+        df.assign(date=df["date"].dt.strftime("%Y-%m-%d")).to_csv(output_file, index=False, encoding="utf-8")
+    return df
+
+
+# ==========================================
+# 效能測試 (與原本 iterrows 迴圈比較)
+# ==========================================
+def _legacy_melt(df, year):
+    months = df.columns[1:]
+    result = []
+    for index, row in df.iterrows():
+        if row[DAY_COL] == "平均":
+            continue
+        day = row[DAY_COL]
+        for month in months:
+            value = row[month]
+            if value != MISSING:
+                date = f"{year}-{int(month):02d}-{int(day):02d}"
+                result.append([date, float(value)])
+    return pd.DataFrame(result, columns=OUTPUT_COLUMNS)
+
 
-# 提取月份名稱
-months = df.columns[1:]
+def benchmark(in_dir, n_years=200):
+    tables = read_year_files(in_dir)
 
-# 初始化結果列表
-result = []
+    # 結果一致 (舊版依 日 -> 月 的順序輸出，排序後比較)
+    expected = pd.concat([_legacy_melt(df, year) for year, df in tables.items()], ignore_index=True)
+    expected["date"] = pd.to_datetime(expected["date"])
+    expected = expected.sort_values("date", kind="stable").reset_index(drop=True)
+    pd.testing.assert_frame_equal(melt_temperature(tables), expected, check_dtype=False)
 
-# 遍歷每一行資料
-for index, row in df.iterrows():
-    if row["日/月"] == "平均":  # 跳過平均行
-        continue
-    day = row["日/月"]
-    for month in months:
-        value = row[month]
-        if value != "--":  # 跳過缺失值
-            date = f"{year}-{int(month):02d}-{int(day):02d}"
-            result.append([date, float(value)])
+    # 以既有的表重複成 n_years 個年份
+    base = list(tables.values())
+    many = {1800 + i: base[i % len(base)] for i in range(n_years)}
+    t0 = time.perf_counter()
+    melt_temperature(many)
+    fast = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for year, df in many.items():
+        _legacy_melt(df, year)
+    legacy = time.perf_counter() - t0
+    print(f"{n_years} 個年份: 向量化 {fast:.3f}s，iterrows {legacy:.2f}s ({legacy / fast:.0f}x)")
 
-# 轉換為 DataFrame
-result_df = pd.DataFrame(result, columns=["date", "temperature"])
 
-# 儲存為 CSV
-output_path = f'./temperature_{year}.csv'
-result_df.to_csv(output_path, index=False, encoding='utf-8')
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="氣溫 日 x 月 表轉長表")
+    parser.add_argument("--input-dir", default=base_dir)
+    parser.add_argument("--output", default=os.path.join(base_dir, "..", "Car_Violation", "data_after_process",
+                                                         "temperature.csv"))
+    parser.add_argument("--benchmark", action="store_true")
+    args = parser.parse_args()
 
-print(f"轉換完成，結果已儲存至 {output_path}")
\ No newline at end of file
+    if args.benchmark:
+        benchmark(args.input_dir)
+    else:
+        df = convert_directory(args.input_dir, args.output)
+        print(f"轉換完成，共 {len(df)} 天 ({df['date'].min().date()} ~ {df['date'].max().date()})，"
+              f"結果已儲存至 {args.output}")